@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals, is_integer_dtype
+from PitchEngine import encode_pitches
+
+
+# Values of the coded columns that are given the first codes, in a fixed order.
+# Counts are ordered the same as Team.counts_str, so the code of a count with b balls and s strikes is b + 4*s (see PitchEngine)
+COUNT_STRINGS = [i+j for j in ['0','1','2'] for i in ['0','1','2','3']]
+COUNT_NUMBERS = [10*b+s for s in range(3) for b in range(4)] # Counts read back from the per-team CSV files are integers
+OUTCOME_VALUES = ['K','O','W','S','D','T','R']
+TYPE_VALUES = ['G','F','P','T','D','NC']
+
+
+# Dictionary encode a column as a Categorical with small integer codes (-1 for missing values).
+# The standard values come first, followed by any other values in sorted order.
+def encode_column(values, standard=()):
+    present = pd.Index(pd.unique(values.dropna()))
+    extra = present[~present.isin(standard)].sort_values()
+    categories = pd.Index(list(standard)).append(extra) if len(standard) else extra
+    return pd.Categorical(values, categories=categories)
+
+
+def standard_values(name, values):
+    if name == 'Count':
+        return COUNT_NUMBERS if is_integer_dtype(values) else COUNT_STRINGS
+    return {'Outcome':OUTCOME_VALUES, 'Type':TYPE_VALUES}.get(name, ())
+
+
+# Compact table of a team's at-bats.
+# Every column of the event and outcome DataFrames is dictionary encoded: the count as a code from 0-11,
+# the outcome and type as int8 codes, and batters as ids into the list of the team's batters.
+# Pitch strings are kept as one uint8 array of pitch codes and the number of pitches in each at-bat.
+# The original DataFrames are decoded on request by event_frame and outcome_frame.
+class AtBatTable:
+    def __init__(self, event_data, outcomes):
+        self.index = event_data.index
+        self.event_columns = event_data.columns.tolist()
+        self.outcome_columns = outcomes.columns.tolist()
+
+        # 'Count' is in both the events and the outcomes, and is only stored once
+        self.columns = {}
+        for df in [event_data, outcomes]:
+            for col in df.columns.drop('Pitches', errors='ignore'):
+                if col not in self.columns:
+                    self.columns[col] = encode_column(df[col], standard_values(col, df[col]))
+
+        if 'Pitches' in self.event_columns:
+            self.pitch_codes, lengths = encode_pitches(event_data['Pitches'])
+            self.pitch_lengths = lengths.astype(np.int32)
+
+
+    # Join tables of at-bats end to end, merging the categories of each column
+    @classmethod
+    def concat(cls, tables):
+        table = cls.__new__(cls)
+        table.index = tables[0].index.append([other.index for other in tables[1:]])
+        table.event_columns = tables[0].event_columns
+        table.outcome_columns = tables[0].outcome_columns
+        table.columns = {col:union_categoricals([other.columns[col] for other in tables]) for col in tables[0].columns}
+        if 'Pitches' in table.event_columns:
+            table.pitch_codes = np.concatenate([other.pitch_codes for other in tables])
+            table.pitch_lengths = np.concatenate([other.pitch_lengths for other in tables])
+        return table
+
+
+    # The table as DataFrames of its integer codes and of the values the codes stand for, to be saved with TeamCache.save_frames.
+    # The layout holds the column and index names.  from_frames rebuilds the table without encoding the columns again.
+    def to_frames(self):
+        index = self.index if isinstance(self.index, pd.MultiIndex) else pd.MultiIndex.from_arrays([self.index])
+        codes = {'Level {}'.format(i):level_codes for i, level_codes in enumerate(index.codes)}
+        codes.update({col:values.codes for col, values in self.columns.items()})
+        frames = {'level {}'.format(i):pd.DataFrame({'Value':np.asarray(level)}) for i, level in enumerate(index.levels)}
+        frames.update({'categories '+col:pd.DataFrame({'Value':np.asarray(values.categories)}) for col, values in self.columns.items()})
+        if 'Pitches' in self.event_columns:
+            codes['Pitch Lengths'] = self.pitch_lengths
+            frames['pitch codes'] = pd.DataFrame({'Code':self.pitch_codes})
+        frames['codes'] = pd.DataFrame(codes)
+        layout = {'event_columns':self.event_columns, 'outcome_columns':self.outcome_columns, 'columns':list(self.columns),
+                  'index_names':list(index.names), 'multiindex':isinstance(self.index, pd.MultiIndex)}
+        return frames, layout
+
+    @classmethod
+    def from_frames(cls, frames, layout):
+        table = cls.__new__(cls)
+        codes = frames['codes']
+        levels = range(len(layout['index_names']))
+        table.index = pd.MultiIndex(levels=[frames['level {}'.format(i)]['Value'].to_numpy() for i in levels],
+                                    codes=[codes['Level {}'.format(i)].to_numpy() for i in levels],
+                                    names=layout['index_names'], verify_integrity=False)
+        if not layout['multiindex']:
+            table.index = table.index.get_level_values(0)
+        table.event_columns = layout['event_columns']
+        table.outcome_columns = layout['outcome_columns']
+        table.columns = {col:pd.Categorical.from_codes(codes[col].to_numpy(), categories=frames['categories '+col]['Value'].to_numpy())
+                         for col in layout['columns']}
+        if 'Pitches' in table.event_columns:
+            table.pitch_codes = frames['pitch codes']['Code'].to_numpy()
+            table.pitch_lengths = codes['Pitch Lengths'].to_numpy()
+        return table
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    # Integer code of every at-bat in a column, and the value each code stands for
+    def codes(self, name):
+        return self.columns[name].codes
+
+    def categories(self, name):
+        return self.columns[name].categories
+
+
+    # Decoders back to the original values
+    def column(self, name):
+        return pd.Series(np.asarray(self.columns[name]), index=self.index, name=name)
+
+    def pitch_strings(self):
+        lengths = np.maximum(self.pitch_lengths, 0)
+        ends = np.cumsum(lengths)
+        text = self.pitch_codes.tobytes().decode('ascii')
+        strings = np.array([text[start:end] for start, end in zip(ends-lengths, ends)], dtype=object)
+        strings[self.pitch_lengths < 0] = np.nan
+        return pd.Series(strings, index=self.index, name='Pitches')
+
+    def event_frame(self):
+        return pd.DataFrame({col:(self.pitch_strings() if col == 'Pitches' else self.column(col)) for col in self.event_columns},
+                            index=self.index)
+
+    def outcome_frame(self):
+        return pd.DataFrame({col:self.column(col) for col in self.outcome_columns}, index=self.index)
+
+
+    # Number of at-bats with each value of a column, the same as DataFrame[name].value_counts().sort_index()
+    def value_counts(self, name):
+        codes, categories = self.codes(name), self.categories(name)
+        totals = np.bincount(codes[codes >= 0], minlength=len(categories))
+        counts = pd.Series(totals, index=pd.Index(categories, name=name), name='count')
+        return counts[totals > 0].sort_index()
+
+
+    # Number of at-bats with each pair of values of two columns,
+    # the same as DataFrame.groupby(row)[col].value_counts().unstack().fillna(0)
+    def crosstab(self, row, col):
+        row_codes, col_codes = self.codes(row).astype(np.int64), self.codes(col)
+        num_rows, num_cols = len(self.categories(row)), len(self.categories(col))
+        valid = (row_codes >= 0) & (col_codes >= 0)
+
+        totals = np.bincount(row_codes[valid]*num_cols + col_codes[valid], minlength=num_rows*num_cols).reshape(num_rows, num_cols)
+        table = pd.DataFrame(totals.astype(float), index=pd.Index(self.categories(row), name=row),
+                             columns=pd.Index(self.categories(col), name=col))
+        return table.loc[totals.sum(axis=1) > 0, totals.sum(axis=0) > 0].sort_index().sort_index(axis=1)
+
+
+    # Bytes used by the table, including the categories of each column
+    def memory_usage(self):
+        usage = self.index.memory_usage(deep=True)
+        usage += sum(cat.codes.nbytes + cat.categories.memory_usage(deep=True) for cat in self.columns.values())
+        if 'Pitches' in self.event_columns:
+            usage += self.pitch_codes.nbytes + self.pitch_lengths.nbytes
+        return usage
@@ -0,0 +1,973 @@
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+import io
+import os
+from SyntheticRetrosheet import write_event_file, write_league, TEAMS
+from RawPbPtoPitchCount import BatterPbP, split_home_away, team_next_batter, terminal_counts, league_terminal_counts, COUNT_LABELS
+from RawPbPtoPitchCount import season_terminal_counts, season_count_tables
+from TeamData import Team, PitchingStaff, setup_teams
+from StratMod_Batch import *
+from StratOptimizer import optimize_strategy, saturation_bounds, strategy_values
+from PASimulator import strategy_markov_chain, validate_simulation, simulate_seasons
+from EventStore import EventStore
+from TeamCache import file_hash
+import Instrumentation
+from WinModelBootstrap import WinModelData, resample_weights, batch_least_squares, strategy_intervals
+
+
+# Peak resident memory of the current process in MB.
+# VmHWM is used when available, since ru_maxrss is carried over from the parent process when a worker is spawned.
+def peak_rss():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line[:6] == 'VmHWM:':
+                    return int(line.split()[1])/1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+# Runs inside a fresh process: time a single call and record the peak resident memory
+def timed_call(func, args):
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    rss_peak = peak_rss()
+    return elapsed, rss_peak, rss_peak-rss_before
+
+
+# Measure a function in a newly spawned process so the peak memory of one call does not leak into the next
+def measure(func, args, repeats=3):
+    ctx = mp.get_context('spawn')
+    runs = []
+    for _ in range(repeats):
+        with ctx.Pool(1) as pool:
+            runs.append(pool.apply(timed_call, (func, args)))
+    runs = np.array(runs)
+    return pd.Series({'Time (s)':runs[:,0].min(), 'Peak RSS (MB)':runs[:,1].max(), 'Added RSS (MB)':runs[:,2].max()})
+
+
+# Best wall time of several in-process calls
+def best_time(func, args, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# Write a synthetic league season and split it into the home and away frames of each team.
+# The frames go through the per-team CSV format, so they are typed the same as the ones setup_teams reads.
+def season_frames(path, year=2007, games=81):
+    files = [write_event_file(str(year)+team+'.EVA', path, team, [year], games) for team in TEAMS]
+    home_dict, away_dict = split_home_away(files, path)
+
+    csv_frames = []
+    for team_dict in [home_dict, away_dict]:
+        team_csv = {}
+        for team, team_games in team_dict.items():
+            buffer = io.StringIO()
+            team_games.to_csv(buffer)
+            buffer.seek(0)
+            team_csv[team] = pd.read_csv(buffer, index_col=[0,1])
+        csv_frames.append(team_csv)
+    return csv_frames
+
+
+# One team's home games of a synthetic league season, with its plate discipline set, as used by the strategy benchmarks
+def season_team(path, year=2007, team='BOS', zcontact=0.87, ocontact=0.66):
+    home_frames, _ = season_frames(path, year)
+    team_class = Team(team, str(year), home_frames[team], 1)
+    team_class.plate_discipline(zcontact, ocontact)
+    return team_class
+
+
+# Write the per-team PbP files of the home games of a synthetic league season into path/teams/, as setup_teams reads them
+def home_team_files(path, year=2007):
+    path_teams = path + 'teams/'
+    os.makedirs(path_teams, exist_ok=True)
+    home_dict, _ = split_home_away(write_league(path, [year]), path)
+    for team, team_games in home_dict.items():
+        team_games.to_csv(path_teams + str(year) + team + 'Home')
+    return path_teams
+
+
+# Whether two teams hold the same at-bats, outcomes, counts and count outcomes
+def same_team(team, other):
+    return (team.event_data.equals(other.event_data) and team.outcomes.equals(other.outcomes) and team.counts.equals(other.counts)
+            and team.count_outcomes.equals(other.count_outcomes))
+
+
+# Reference version of Team.pitch_counts_during_ab using string splitting and stacking, before PitchEngine
+def legacy_pitch_counts_during_ab(pitch_strings):
+    stacked_pitch = ('0'+pitch_strings.str[0:-1]).str.split('',expand=True).stack()
+    pc_during_ab = stacked_pitch.drop(stacked_pitch[stacked_pitch==''].index).str.translate(str.maketrans({'B':'100','S':'1'})).astype(int).groupby(level=[0,1]).cumsum()
+    counts_cap_ball = pc_during_ab*(pc_during_ab//100 < 4) + (300+pc_during_ab%100)*(pc_during_ab//100 > 3)
+    counts_cap_strike = counts_cap_ball*(counts_cap_ball%100 < 3) + (2 + 100*(counts_cap_ball//100))*(counts_cap_ball%100 >2)
+    return (counts_cap_strike//100).astype(str) + (counts_cap_strike%100).astype(str)
+
+
+# Reference version of Team.set_count_outcomes, before PitchEngine
+def legacy_set_count_outcomes(team_class):
+    team_pitches = team_class.parsing_pitches('IKMOPQRTV', 'BSSSBSFSB')
+    stacked_pitch = (team_pitches).str.split('', expand=True).stack()
+    stacked_pitch = stacked_pitch.drop(stacked_pitch[stacked_pitch==''].index)
+    pitches_and_counts = pd.concat([legacy_pitch_counts_during_ab(team_class.parsing_pitches()),stacked_pitch],axis=1)
+    pitches_and_counts.columns = ['Count','Outcome']
+    return pitches_and_counts
+
+
+# Reference version of Team.transformation_matrix, looping over every at-bat and count reached, before PitchEngine
+def legacy_transformation_matrix(team_class):
+    counts_reached = team_class.pitch_counts_during_ab(team_class.parsing_pitches()).groupby(level=[0,1]).unique()
+    num_counts = len(team_class.counts_str)
+    term_from_cur = pd.DataFrame(np.zeros((num_counts,num_counts)), index = team_class.counts_str, columns = team_class.counts_str)
+    for atbat in counts_reached.to_list():
+        for count in atbat:
+            term_from_cur.loc[count,atbat[-1]] += 1
+    for i in team_class.counts_str:
+        term_from_cur.loc[i,i] = 0
+    relative_frac = term_from_cur.div(term_from_cur.sum(axis=1),axis=0).fillna(0) - np.identity(num_counts)
+    relative_frac.loc['32','32'] = 0
+    return relative_frac.T
+
+
+# Compare the looped transformation matrix with the bincount version, for one team and for every team of a league-season
+def bench_transformation_matrix(path, repeats=3):
+    home_frames, away_frames = season_frames(path)
+    teams = [Team(team, '2007', frames[team], homeaway) for homeaway, frames in [(1, home_frames), (0, away_frames)] for team in TEAMS]
+
+    for team in teams:
+        if not legacy_transformation_matrix(team).equals(team.transformation_matrix()):
+            raise ValueError('transformation_matrix does not match the looped version for ' + team.team)
+
+    league_loop = lambda func: [func(team) for team in teams]
+    results = pd.DataFrame({'Loop (s)':[best_time(legacy_transformation_matrix, (teams[0],), repeats),
+                                        best_time(league_loop, (legacy_transformation_matrix,), 1)],
+                            'bincount (s)':[best_time(Team.transformation_matrix, (teams[0],), repeats),
+                                            best_time(league_loop, (Team.transformation_matrix,), repeats)]},
+                           index=['One team','League-season ({} teams)'.format(len(teams))])
+    results['Speedup'] = results['Loop (s)']/results['bincount (s)']
+    print('Transformation matrix')
+    print(results.round(4))
+    return results
+
+
+# Compare the string based pitch count pipeline with PitchEngine on a full season of pitch strings
+# All home at-bats of the synthetic league are loaded into a single Team
+def bench_pitch_counts(path, repeats=3):
+    home_frames, _ = season_frames(path)
+    league = Team('MLB', '2007', pd.concat(home_frames.values()), 1)
+
+    # Both versions must produce the same pitch counts and pitch labels
+    simple_pitch = league.parsing_pitches()
+    if not legacy_pitch_counts_during_ab(simple_pitch).equals(league.pitch_counts_during_ab(simple_pitch)):
+        raise ValueError('pitch_counts_during_ab does not match the string based version')
+    if not legacy_set_count_outcomes(league).equals(league.set_count_outcomes()):
+        raise ValueError('set_count_outcomes does not match the string based version')
+
+    results = pd.DataFrame({'String (s)':[best_time(legacy_pitch_counts_during_ab, (simple_pitch,), repeats),
+                                          best_time(legacy_set_count_outcomes, (league,), repeats)],
+                            'PitchEngine (s)':[best_time(league.pitch_counts_during_ab, (simple_pitch,), repeats),
+                                               best_time(league.set_count_outcomes, (), repeats)]},
+                           index=['pitch_counts_during_ab','set_count_outcomes'])
+    results['Speedup'] = results['String (s)']/results['PitchEngine (s)']
+    print('Pitch counts for {} at-bats ({} pitches)'.format(len(simple_pitch), simple_pitch.str.len().sum()))
+    print(results.round(3))
+    return results
+
+
+# Compare the memory of the decoded event and outcome DataFrames with the AtBatTable of every home and away team,
+# and the time taken to count outcomes at each count from the table against the string groupby
+def bench_atbat_table(path, repeats=3):
+    home_frames, away_frames = season_frames(path)
+    teams = [Team(team, '2007', frames[team], homeaway) for homeaway, frames in [(1, home_frames), (0, away_frames)] for team in TEAMS]
+
+    frame_bytes, table_bytes = 0, 0
+    for team in teams:
+        event_data, outcomes = team.event_data, team.outcomes
+        if not outcomes['Count'].value_counts().sort_index().equals(team.counts):
+            raise ValueError('AtBatTable counts do not match the outcomes of ' + team.team)
+        frame_bytes += event_data.memory_usage(deep=True).sum() + outcomes.memory_usage(deep=True).sum()
+        table_bytes += team.atbats.memory_usage()
+
+    team, outcomes = teams[0], teams[0].outcomes
+    groupby_table = lambda: outcomes.groupby('Count')['Outcome'].value_counts().unstack().fillna(0)
+    if not groupby_table().astype(float).equals(team.atbats.crosstab('Count', 'Outcome')):
+        raise ValueError('AtBatTable.crosstab does not match the groupby of the outcomes')
+
+    results = pd.Series({'DataFrames (MB)':frame_bytes/2**20, 'AtBatTable (MB)':table_bytes/2**20,
+                         'groupby (s)':best_time(groupby_table, (), repeats),
+                         'bincount (s)':best_time(team.atbats.crosstab, ('Count', 'Outcome'), repeats)})
+    print('At-bats of {} team-seasons'.format(len(teams)))
+    print(results.round(4))
+    return results
+
+
+# Signed swing percentages (aggressive > 0, patient < 0) changing a few random counts of each strategy
+def random_strategies(num_strategies, seed=0, max_change=0.3):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-max_change, max_change, (num_strategies, 12))*(rng.random((num_strategies, 12)) < 0.3)
+
+
+# Reference version of custom_strat_mod, applying aggressive_modification and patient_modification to separate counts
+def legacy_custom_strat_mod(team_class, swing_percentages):
+    context = team_class.strategy_context()
+    aggro, patient = swing_percentages >= 0, swing_percentages < 0
+    swing_changes = []
+    if aggro.any():
+        swing_changes.append(aggressive_modification(context.plate_disc[aggro], context.count_outcomes[aggro], swing_percentages[aggro]))
+    if patient.any():
+        swing_changes.append(patient_modification(context.plate_disc[patient], context.count_outcomes[patient], -swing_percentages[patient]))
+    swing_changes = pd.concat(swing_changes)
+    return swing_changes.sort_index()[swing_columns].to_numpy(dtype=float)
+
+
+# Compare building swing changes strategy by strategy with the masked DataFrame functions against one swing_change_kernel call
+# Large percentages are included so the saturation limits are reached
+def bench_swing_changes(path, num_strategies=200, zcontact=0.87, ocontact=0.66):
+    team = season_team(path, zcontact=zcontact, ocontact=ocontact)
+    swing_percentages = random_strategies(num_strategies, max_change=1.5)
+
+    start = time.perf_counter()
+    looped = np.array([legacy_custom_strat_mod(team, strategy) for strategy in swing_percentages])
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused = swing_change_kernel(team, swing_percentages)
+    kernel_time = time.perf_counter() - start
+
+    if not np.allclose(looped, fused):
+        raise ValueError('swing_change_kernel does not match aggressive_modification and patient_modification')
+
+    results = pd.Series({'DataFrame loop (s)':loop_time, 'swing_change_kernel (s)':kernel_time, 'Speedup':loop_time/kernel_time})
+    print('Swing changes for {} strategies'.format(num_strategies))
+    print(results.round(4))
+    return results
+
+
+# Check the exact absorbing chain solution of strategy_mod against the 25 pitch steady state, and time both.
+# The expected pitches per plate appearance from the same solve are checked against the probability of still batting
+# after each pitch, summed over enough pitches for the rest to be negligible.
+def bench_absorbing_state(path, num_strategies=50, zcontact=0.87, ocontact=0.66, repeats=3):
+    team = season_team(path, zcontact=zcontact, ocontact=ocontact)
+    strategies = [pd.DataFrame(changes, index=team.count_outcomes.index, columns=swing_columns)
+                  for changes in swing_changes_from_percentages(team, random_strategies(num_strategies))]
+
+    for swing_changes in strategies:
+        exact = strategy_mod(team, swing_changes, exact=True)
+        if not np.allclose(exact, strategy_mod(team, swing_changes), rtol=1e-6):
+            raise ValueError('strategy_mod(exact=True) does not match the steady state solution')
+        MC = np.nan_to_num(np.asarray(strategy_markov_chain(team, swing_changes), dtype=float))
+        state = np.zeros(len(MC))
+        state[0] = 1
+        pitches = 0
+        for _ in range(200):
+            pitches += state[:-len(outcome_labels)].sum()
+            state = MC.dot(state)
+        if not np.isclose(exact.attrs['pitches_per_pa'], pitches, rtol=1e-6) or expected_pitches(team, swing_changes) != exact.attrs['pitches_per_pa']:
+            raise ValueError('Expected pitches per plate appearance do not match the pitches summed from the steady state')
+
+    results = pd.Series({'Steady state (s)':best_time(lambda: [strategy_mod(team, changes) for changes in strategies], (), repeats),
+                         'Exact (s)':best_time(lambda: [strategy_mod(team, changes, exact=True) for changes in strategies], (), repeats)})
+    print('strategy_mod for {} strategies'.format(num_strategies))
+    print(results.round(4))
+    return results
+
+
+# Check the StrategyContext values against computing them from the team's outcomes, and that the context is rebuilt
+# after plate_discipline and merge_games change the team's data.  Times strategy_mod with the context built once
+# against building it again for every call.
+def bench_strategy_context(path, num_strategies=50, zcontact=0.87, ocontact=0.66, repeats=3):
+    home_frames, _ = season_frames(path)
+    team_games = home_frames['BOS']
+    game_ids = team_games.index.get_level_values(0)
+    team = Team('BOS', '2007', team_games, 1)
+    team.plate_discipline(zcontact, ocontact)
+    context = team.strategy_context()
+
+    inplay_outcomes = team.outcomes.groupby('Count')['Outcome'].value_counts().unstack().fillna(0)[['O','S','D','T','R']]
+    inplay_frac = inplay_outcomes.div(inplay_outcomes.sum(axis=1), axis=0).to_numpy()
+    contact_split = team.count_outcomes[['F','X']].div(team.count_outcomes[['F','X']].sum(axis=1), axis=0)
+    if (not np.allclose(context.inplay_frac, inplay_frac, equal_nan=True) or not context.contact_split.equals(contact_split)
+        or context.total_ab != team.outcomes['Outcome'].value_counts().sum()):
+        raise ValueError('StrategyContext does not match the values computed from the team')
+    strategies = [pd.DataFrame(changes, index=team.count_outcomes.index, columns=swing_columns)
+                  for changes in swing_changes_from_percentages(team, random_strategies(num_strategies))]
+    if not all(strategy_mod(team, changes).equals(strategy_mod(context, changes)) for changes in strategies):
+        raise ValueError('strategy_mod of the StrategyContext does not match strategy_mod of the team')
+
+    # The context can not be reassigned or edited in place, and columns replaced in its DataFrames do not reach it
+    edits = [lambda: setattr(context, 'total_ab', 0), lambda: context.count_outcomes.iloc.__setitem__((0, 0), -1),
+             lambda: context.inplay_frac['Out'].iloc.__setitem__(0, -1), lambda: context.arrays['coF'].__setitem__(0, -1)]
+    for edit in edits:
+        try:
+            edit()
+        except (AttributeError, ValueError):
+            pass
+        else:
+            raise ValueError('StrategyContext can be changed')
+    context.plate_disc['Zone%'] = 0
+    if not context.plate_disc.equals(team.plate_disc) or not context.count_outcomes.equals(team.count_outcomes):
+        raise ValueError('StrategyContext was changed through its DataFrames')
+
+    # A new contact rate or newly merged games give a new context, the same as a team built with them from the start
+    team.plate_discipline(0.8, 0.6)
+    if team.strategy_context() is context or not team.strategy_context().plate_disc.equals(team.plate_disc):
+        raise ValueError('StrategyContext was not rebuilt after plate_discipline')
+    first_games = game_ids.isin(game_ids.unique()[:40])
+    partial = Team('BOS', '2007', team_games[first_games], 1)
+    partial.plate_discipline(0.8, 0.6)
+    context = partial.strategy_context()
+    partial.merge_games(team_games[~first_games])
+    merged = partial.strategy_context()
+    if merged is context or merged.total_ab != team.strategy_context().total_ab or not np.allclose(
+            merged.count_outcomes.loc[team.count_outcomes.index, team.count_outcomes.columns], team.count_outcomes):
+        raise ValueError('StrategyContext was not rebuilt after merge_games')
+
+    def rebuilt_context():
+        for changes in strategies:
+            strategy_mod(StrategyContext(team), changes)
+    results = pd.Series({'Context built once (s)':best_time(lambda: [strategy_mod(team, changes) for changes in strategies], (), repeats),
+                         'Context built every call (s)':best_time(rebuilt_context, (), repeats)})
+    print('strategy_mod for {} strategies'.format(num_strategies))
+    print(results.round(4))
+    return results
+
+
+# Check that loading the teams in a process pool gives the same teams, in the same order, as loading them one by one,
+# and time both with the workers building the at-bat tables and counts
+def bench_setup_teams(path, workers=2, repeats=3):
+    path_teams = home_team_files(path)
+    serial = setup_teams(path_teams, 1)
+    parallel = setup_teams(path_teams, 1, workers=workers)
+    if list(serial) != list(parallel) or not all(same_team(serial[key], parallel[key]) for key in serial):
+        raise ValueError('setup_teams with {} workers does not match loading the teams one by one'.format(workers))
+
+    attributes = ('counts', 'count_outcomes')
+    results = pd.Series({'1 worker (s)':best_time(lambda: setup_teams(path_teams, 1, attributes=attributes), (), repeats),
+                         '{} workers (s)'.format(workers):best_time(lambda: setup_teams(path_teams, 1, workers, attributes=attributes), (), repeats)})
+    print('setup_teams for {} teams ({} CPUs)'.format(len(serial), os.cpu_count()))
+    print(results.round(4))
+    return results
+
+
+# Compare one strategy_mod call per strategy with a single strategy_sweep call over the whole stack
+def bench_strategy_sweep(path, num_strategies=200, zcontact=0.87, ocontact=0.66):
+    team = season_team(path, zcontact=zcontact, ocontact=ocontact)
+    swing_changes = swing_changes_from_percentages(team, random_strategies(num_strategies))
+
+    start = time.perf_counter()
+    looped = np.array([strategy_mod(team, pd.DataFrame(changes, index=team.count_outcomes.index, columns=swing_columns), exact=True)
+                       for changes in swing_changes])
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    swept = strategy_sweep(team, swing_changes)
+    sweep_time = time.perf_counter() - start
+
+    if not np.allclose(looped, swept):
+        raise ValueError('strategy_sweep does not match strategy_mod')
+
+    results = pd.Series({'strategy_mod loop (s)':loop_time, 'strategy_sweep (s)':sweep_time, 'Speedup':loop_time/sweep_time})
+    print('Evaluating {} strategies'.format(num_strategies))
+    print(results.round(4))
+    return results
+
+
+# Run values of each outcome in outcome_labels order, used as the objective when no win model is available
+RUN_VALUES = np.array([-0.28, -0.26, 0.32, 0.47, 0.78, 1.09, 1.40])
+
+
+# Compare the coordinate ascent optimizer with a random search using the same number of evaluations,
+# and a cold start of the next season with a warm start from this season's optimum, which must be at least as good (within tolerance)
+def bench_optimizer(path, zcontact=0.87, ocontact=0.66, seed=0, tolerance=1e-3):
+    seasons = [season_team(path, year, zcontact=zcontact, ocontact=ocontact) for year in [2007, 2008]]
+
+    start = time.perf_counter()
+    strategy, improvement, evaluations = optimize_strategy(seasons[0], RUN_VALUES)
+    optimize_time = time.perf_counter() - start
+
+    lower, upper = saturation_bounds(seasons[0])
+    random_search = lower + (upper-lower)*np.random.default_rng(seed).random((evaluations, len(lower)))
+    random_values = strategy_values(seasons[0], np.vstack([np.zeros(len(lower)), random_search]), RUN_VALUES)
+    random_improvement = np.nanmax(random_values[1:]) - random_values[0]
+    if improvement < random_improvement:
+        raise ValueError('optimize_strategy found a worse strategy than random search')
+
+    _, cold_improvement, cold_evaluations = optimize_strategy(seasons[1], RUN_VALUES)
+    _, warm_improvement, warm_evaluations = optimize_strategy(seasons[1], RUN_VALUES, start=strategy)
+    if warm_improvement < cold_improvement - tolerance*abs(cold_improvement):
+        raise ValueError('A warm start of optimize_strategy found a worse strategy than a cold start')
+
+    results = pd.DataFrame({'Improvement':[improvement, random_improvement, cold_improvement, warm_improvement],
+                            'Evaluations':[evaluations, evaluations, cold_evaluations, warm_evaluations]},
+                           index=['optimize_strategy','Random search','Next season (cold)','Next season (warm)'])
+    print('Strategy optimizer ({:.3f} s)'.format(optimize_time))
+    print(results.round(3))
+    return results
+
+
+# Validate the plate appearance simulator against the Markov Chain of an unmodified strategy,
+# and time simulated seasons in one process and across worker processes (which must give the same seasons)
+def bench_simulator(path, num_pa=10**6, num_seasons=200, workers=4, zcontact=0.87, ocontact=0.66):
+    team = season_team(path, zcontact=zcontact, ocontact=ocontact)
+    markov_chain = strategy_markov_chain(team, pd.DataFrame(0.0, index=team.count_outcomes.index, columns=swing_columns))
+
+    start = time.perf_counter()
+    validation = validate_simulation(markov_chain, num_pa)
+    pa_rate = num_pa/(time.perf_counter() - start)
+    if not validation['Valid'].all():
+        raise ValueError('Simulated plate appearances do not match the Markov Chain')
+
+    pa_per_season = team.strategy_context().total_ab
+    serial_time = best_time(simulate_seasons, (markov_chain, pa_per_season, num_seasons, 0), 1)
+    parallel_time = best_time(simulate_seasons, (markov_chain, pa_per_season, num_seasons, 0, 8, workers), 1)
+    if not simulate_seasons(markov_chain, pa_per_season, num_seasons, 0).equals(simulate_seasons(markov_chain, pa_per_season, num_seasons, 0, 8, workers)):
+        raise ValueError('Simulated seasons depend on the number of workers')
+
+    print(validation.round(4))
+    print('{:.2e} plate appearances per second'.format(pa_rate))
+    print('{} seasons: {:.3f} s in one process, {:.3f} s with {} workers'.format(num_seasons, serial_time, parallel_time, workers))
+    return validation
+
+
+# Compare reading every team-season from per-team PbP CSV files with slicing them from an EventStore.
+# Both must give the same frames.  Opening the store only loads its game index.
+def bench_event_store(path, seasons=3):
+    years = list(range(2007, 2007+seasons))
+    csv_files = []
+    for year in years:
+        for homeaway, frames in enumerate(reversed(season_frames(path, year))):
+            for team, team_games in frames.items():
+                csv_files.append((path + str(year) + team + ['Away','Home'][homeaway], year, team, homeaway))
+                team_games.to_csv(csv_files[-1][0])
+
+    store = EventStore(path + 'store/', mode='a')
+    start = time.perf_counter()
+    store.append_directory(path, [str(year)+team+'.EVA' for year in years for team in TEAMS])
+    build_time = time.perf_counter() - start
+
+    for csv_file, year, team, homeaway in csv_files:
+        if not pd.read_csv(csv_file, index_col=[0,1]).equals(store.team_frame(year, team, homeaway)):
+            raise ValueError('EventStore frame does not match the PbP file ' + csv_file)
+
+    # An interrupted append leaves bytes past the committed lengths.  Readers only map the committed lengths and leave the
+    # files alone, and the bytes are cut off when the store is next opened for appending.
+    committed_size = os.path.getsize(path + 'store/records.bin')
+    with open(path + 'store/records.bin', 'ab') as records:
+        records.write(b'\0' * 100)
+    store = EventStore(path + 'store/')
+    if os.path.getsize(path + 'store/records.bin') != committed_size + 100 or store.records.nbytes != committed_size:
+        raise ValueError('EventStore reader changed the store files or mapped an interrupted append')
+    if not pd.read_csv(csv_files[0][0], index_col=[0,1]).equals(store.team_frame(*csv_files[0][1:])):
+        raise ValueError('EventStore reader did not skip an interrupted append')
+    EventStore(path + 'store/', mode='a')
+    if os.path.getsize(path + 'store/records.bin') != committed_size:
+        raise ValueError('EventStore did not recover from an interrupted append')
+
+    # Readers refuse a missing store without creating it, and refuse to append
+    try:
+        EventStore(path + 'missing/')
+    except FileNotFoundError:
+        pass
+    else:
+        raise ValueError('EventStore opened a missing store for reading')
+    try:
+        store.append_file(str(years[0]) + TEAMS[0] + '.EVA', path)
+    except ValueError:
+        pass
+    else:
+        raise ValueError('EventStore appended to a store opened read-only')
+    if os.path.exists(path + 'missing/'):
+        raise ValueError('EventStore reader created a missing store')
+
+    # An empty event is missing, as read_csv gives, and batter IDs too long for the records are refused
+    edge_path, edge_file = path + 'edge/', str(years[0]) + TEAMS[0] + '.EVA'
+    os.makedirs(edge_path, exist_ok=True)
+    lines = open(path + edge_file).read().split('\n')
+    play = next(i for i, line in enumerate(lines) if line.startswith('play,'))
+    lines[play] = lines[play].rsplit(',', 1)[0] + ','
+    open(edge_path + edge_file, 'w').write('\n'.join(lines))
+    edge_store = EventStore(edge_path + 'store/', mode='a')
+    edge_store.append_file(edge_file, edge_path)
+    buffer = io.StringIO()
+    split_home_away([edge_file], edge_path)[0][TEAMS[0]].to_csv(buffer)
+    buffer.seek(0)
+    if not pd.read_csv(buffer, index_col=[0,1]).equals(edge_store.team_frame(years[0], TEAMS[0], 1)):
+        raise ValueError('EventStore frame does not match the PbP file with an empty event')
+    lines[play] = ','.join(field if i != 3 else 'longbatter01' for i, field in enumerate(lines[play].split(',')))
+    open(edge_path + 'long' + edge_file, 'w').write('\n'.join(lines))
+    try:
+        edge_store.append_file('long' + edge_file, edge_path)
+    except ValueError:
+        pass
+    else:
+        raise ValueError('EventStore accepted a batter ID longer than its records')
+
+    read_csv =lambda: [pd.read_csv(csv_file, index_col=[0,1]) for csv_file, _, _, _ in csv_files]
+    open_store = lambda: EventStore(path + 'store/')
+    read_store = lambda: [store.team_frame(year, team, homeaway) for _, year, team, homeaway in csv_files]
+    results = pd.Series({'Build store (s)':build_time, 'Open store (s)':best_time(open_store, ()),
+                         'read_csv (s)':best_time(read_csv, ()), 'EventStore slices (s)':best_time(read_store, ())})
+    print('{} team-seasons ({} plate appearances)'.format(len(csv_files), len(store.records)))
+    print(results.round(4))
+    return results
+
+
+# Check that an away team merged from several source frames, one file at a time, matches the team built from all of its
+# games at once, with counts either kept up to date by each merge or computed after the last one.  Each frame repeats the
+# last games of the one before it, which must be skipped.  Times the merges against rebuilding the team after every file.
+def bench_merge_games(path, team='BOS', files=8, repeats=3):
+    _, away_frames = season_frames(path)
+    team_games = away_frames[team]
+    game_ids = team_games.index.get_level_values(0)
+    file_games = np.array_split(game_ids.unique(), files)
+    sources = [team_games[game_ids.isin(file_games[0])]] + [team_games[game_ids.isin(np.concatenate([file_games[i-1][-2:], file_games[i]]))]
+                                                            for i in range(1, files)]
+    full = Team(team, '2007', team_games, 0)
+
+    def merged(counted):
+        merged_team = Team(team, '2007', sources[0], 0)
+        if counted:
+            merged_team.counts, merged_team.count_outcomes
+        for source in sources[1:]:
+            merged_team.merge_games(source)
+        merged_team.counts, merged_team.count_outcomes
+        return merged_team
+
+    def rebuilt():
+        for i in range(1, files + 1):
+            rebuilt_team = Team(team, '2007', pd.concat(sources[:i]).pipe(lambda games: games[~games.index.duplicated()]), 0)
+            rebuilt_team.counts, rebuilt_team.count_outcomes
+        return rebuilt_team
+
+    if not all(same_team(merged(counted), full) for counted in [True, False]) or not same_team(rebuilt(), full):
+        raise ValueError('Team merged from {} files does not match the team built from all of its games'.format(files))
+
+    results = pd.Series({'merge_games (s)':best_time(merged, (True,), repeats),
+                         'Rebuilt after every file (s)':best_time(rebuilt, (), repeats)})
+    results['Speedup'] = results['Rebuilt after every file (s)']/results['merge_games (s)']
+    print('Away team-season of {} merged from {} files ({} games)'.format(team, files, len(game_ids.unique())))
+    print(results.round(4))
+    return results
+
+
+# Check that teams loaded from their cache files match the teams they were saved from, including the plate discipline,
+# and that only a team whose PbP file changed is rebuilt.  Times building the teams against loading them from the cache.
+def bench_team_cache(path, zcontact=0.87, ocontact=0.66, repeats=3):
+    path_teams = home_team_files(path)
+    cache_path = path + 'cache/'
+    os.makedirs(cache_path, exist_ok=True)
+    built = setup_teams(path_teams, 1, cache_path=cache_path, attributes=('counts', 'count_outcomes'))
+    loaded = setup_teams(path_teams, 1, cache_path=cache_path)
+    if list(built) != list(loaded) or not all(same_team(built[key], loaded[key]) for key in built):
+        raise ValueError('Teams loaded from the cache do not match the teams they were saved from')
+
+    key = list(built)[0]
+    team = built[key]
+    team.plate_discipline(zcontact, ocontact)
+    team.save_cache(cache_path + 'discipline.npz', 'hash')
+    cached = Team.from_cache(cache_path + 'discipline.npz', 'hash')
+    if not same_team(team, cached) or cached.discipline != team.discipline or not cached.plate_disc.equals(team.plate_disc):
+        raise ValueError('Team loaded from the cache does not keep its plate discipline')
+    if Team.from_cache(cache_path + 'discipline.npz', 'other hash') is not None:
+        raise ValueError('Team was loaded from a cache file built from a different PbP file')
+    NewTeam = type('NewTeam', (Team,), {'cache_version':Team.cache_version + 1})
+    if NewTeam.from_cache(cache_path + 'discipline.npz', 'hash') is not None:
+        raise ValueError('Team was loaded from a cache file saved with a different cache version')
+
+    # A truncated cache file is out of date, and is rebuilt in place
+    cache_file, source_hash = cache_path + key + 'Home.npz', file_hash(path_teams + key + 'Home')
+    os.truncate(cache_file, os.path.getsize(cache_file)//2)
+    if Team.from_cache(cache_file, source_hash) is not None:
+        raise ValueError('Team was loaded from a truncated cache file')
+    rebuilt = setup_teams(path_teams, 1, cache_path=cache_path)
+    if not same_team(rebuilt[key], loaded[key]) or not same_team(Team.from_cache(cache_file, source_hash), loaded[key]):
+        raise ValueError('A truncated cache file was not rebuilt')
+    if any(file.endswith('.tmp') for file in os.listdir(cache_path)):
+        raise ValueError('Saving the cache left temporary files behind')
+
+    # Drop the last game of one PbP file: only that team is rebuilt, and it matches a team built from the new file
+    team_games = pd.read_csv(path_teams + key + 'Home', index_col=[0,1])
+    game_ids = team_games.index.get_level_values(0)
+    team_games[game_ids != game_ids[-1]].to_csv(path_teams + key + 'Home')
+    cache_times = {file:os.path.getmtime(cache_path + file) for file in os.listdir(cache_path)}
+    reloaded = setup_teams(path_teams, 1, cache_path=cache_path)
+    changed = [file for file, mtime in cache_times.items() if os.path.getmtime(cache_path + file) != mtime]
+    if changed != [key + 'Home.npz'] or not same_team(reloaded[key], Team(team.team, team.year, team_games[game_ids != game_ids[-1]], 1)):
+        raise ValueError('Only the team with a changed PbP file should be rebuilt, found ' + ', '.join(changed))
+
+    results = pd.Series({'Build (s)':best_time(lambda: setup_teams(path_teams, 1, attributes=('counts', 'count_outcomes')), (), repeats),
+                         'Load from cache (s)':best_time(lambda: setup_teams(path_teams, 1, cache_path=cache_path), (), repeats)})
+    results['Load per team (ms)'] = 1000*results['Load from cache (s)']/len(built)
+    print('Cached teams of {} team-seasons'.format(len(built)))
+    print(results.round(4))
+    return results
+
+
+# Compare building every team of a league-season and using only its counts, against computing every attribute up front.
+# Counts only still builds the at-bat table (cleaned events and outcomes), so it saves the plate discipline and strategy context.
+# Also times switching back to contact rates already used, which reuses the cached plate discipline table.
+def bench_lazy_team(path, zcontact=0.87, ocontact=0.66, repeats=3):
+    home_frames, away_frames = season_frames(path)
+    frames = [(team, homeaway, team_frames[team]) for homeaway, team_frames in [(1, home_frames), (0, away_frames)] for team in TEAMS]
+
+    def build(attributes):
+        teams = [Team(team, '2007', team_games, homeaway) for team, homeaway, team_games in frames]
+        for team in teams:
+            team.plate_discipline(zcontact, ocontact)
+            for name in attributes:
+                getattr(team, name)
+        return teams
+
+    team = build(['strat_context'])[0]
+    switch_discipline = lambda: [(team.plate_discipline(rates[0], rates[1]), team.plate_disc) for rates in [(0.8, 0.6), (zcontact, ocontact)]]
+    switch_discipline()
+    results = pd.Series({'Counts only (s)':best_time(build, (['counts'],), repeats),
+                         'Every attribute (s)':best_time(build, (['counts', 'count_outcomes', 'plate_disc', 'strat_context'],), repeats),
+                         'Cached plate discipline (s)':best_time(switch_discipline, (), repeats)})
+    print('Cold start of {} team-seasons'.format(len(frames)))
+    print(results.round(4))
+    return results
+
+
+# Reference version of all_team_count, counting each team separately, before terminal_counts
+def legacy_all_team_count(team_dict, homeaway):
+    team_pitch_count_dict = {}
+    for team in team_dict.keys():
+        team_all_batter = team_dict[team].copy()
+        team_all_batter.columns = ['0','1','2','3','4','5']
+        team_batters = team_all_batter.loc[team_all_batter['1']==homeaway]
+        team_batter_nodup = team_next_batter(team_batters).groupby('3').size()
+        team_pitch_count_dict[team[:3]] = team_batter_nodup.reindex(COUNT_LABELS, fill_value=0).tolist()
+    return pd.DataFrame.from_dict(team_pitch_count_dict, orient='index', columns=COUNT_LABELS)
+
+
+# Compare the per-team pitch count tables with the single grouped pass, and time regenerating the tables of several seasons
+def bench_terminal_counts(path, seasons=4, workers=4, repeats=3):
+    years = list(range(2007, 2007+seasons))
+    write_league(path, years)
+    home_dict, away_dict = split_home_away([str(years[0])+team+'.EVA' for team in TEAMS], path)
+
+    for team_dict, homeaway in [(home_dict, 1), (away_dict, 0)]:
+        if not legacy_all_team_count(team_dict, str(homeaway)).equals(terminal_counts(team_dict, homeaway)):
+            raise ValueError('terminal_counts does not match the per-team pitch counts')
+
+    results = pd.Series({'Per-team loop (s)':best_time(legacy_all_team_count, (home_dict, '1'), repeats),
+                         'Grouped pass (s)':best_time(terminal_counts, (home_dict, 1), repeats),
+                         '{} seasons, 1 worker (s)'.format(seasons):best_time(league_terminal_counts, (path, years), 1),
+                         '{} seasons, {} workers (s)'.format(seasons, workers):best_time(league_terminal_counts, (path, years, workers), 1)})
+    print('Pitch count tables of {} teams'.format(len(home_dict)))
+    print(results.round(4))
+    return results
+
+
+# Reference version of split_home_away, adding every game to its teams with get_group and pd.concat, before one grouped pass
+def legacy_split_home_away(team_raw_list, path_raw):
+    home_dict = {file[4:7]:pd.DataFrame() for file in team_raw_list}
+    away_dict = {file[4:7]:pd.DataFrame() for file in team_raw_list}
+    for file in team_raw_list:
+        all_games = BatterPbP(file, path_raw)
+        for game in all_games.index.levels[0]:
+            home_dict[game[:3]] = pd.concat([home_dict[game[:3]], all_games.groupby(level=0).get_group(game)])
+            away_dict[game[-3:]] = pd.concat([away_dict[game[-3:]], all_games.groupby(level=0).get_group(game)])
+    return home_dict, away_dict
+
+
+# Check that the RawPbPtoPitchCount entry point writes the same Home and Away files, byte for byte,
+# as the get_group loop with the per-team counts, and that every team's frame is written the same.
+# Fewer games are used than a full season, as the loop is quadratic in the number of games.
+def bench_split_home_away(path, games=40, repeats=3):
+    path_split = path + 'split/'
+    os.makedirs(path_split, exist_ok=True)
+    files = write_league(path_split, [2007], games=games)
+    legacy_dicts = legacy_split_home_away(files, path_split)
+    team_dicts = split_home_away(files, path_split)
+    tables = season_count_tables(files, path_split)
+    for legacy_dict, team_dict, homeaway, name in zip(legacy_dicts, team_dicts, ['1', '0'], ['Home', 'Away']):
+        if list(legacy_dict) != list(team_dict) or any(legacy_dict[team].to_csv() != team_dict[team].to_csv() for team in team_dict):
+            raise ValueError('split_home_away does not write the same ' + name + ' team frames as the get_group loop')
+        if legacy_all_team_count(legacy_dict, homeaway).to_csv() != tables[name].to_csv():
+            raise ValueError('The ' + name + ' pitch count file does not match the get_group loop')
+
+    results = pd.Series({'get_group loop (s)':best_time(legacy_split_home_away, (files, path_split), 1),
+                         'split_home_away (s)':best_time(split_home_away, (files, path_split), repeats)})
+    results['Speedup'] = results['get_group loop (s)']/results['split_home_away (s)']
+    print('Home and away frames of {} teams ({} games each)'.format(len(files), games))
+    print(results.round(4))
+    return results
+
+
+# Random league pitch count tables of num_teams team-seasons, with a win percentage falling with the at-bats ending on two strikes
+def random_league_table(num_teams=300, seed=0):
+    rng = np.random.default_rng(seed)
+    typical = np.array([900, 500, 250, 120, 700, 600, 400, 200, 500, 700, 600, 500])
+    counts = rng.poisson(typical*rng.uniform(0.8, 1.2, (num_teams, 1))*rng.uniform(0.85, 1.15, (num_teams, 12))).astype(float)
+    two_strikes = counts[:, 8:11].sum(axis=1)
+    index = pd.MultiIndex.from_tuples([(str(2000+i//30), 'T{:02d}'.format(i%30)) for i in range(num_teams)], names=['Year','Team'])
+    data = pd.DataFrame(counts, index=index, columns=COUNT_LABELS)
+    data['RA'] = rng.normal(380, 40, num_teams)
+    data['W%'] = np.clip(0.5 - 2e-4*(two_strikes - two_strikes.mean()) + rng.normal(0, 0.05, num_teams), 0.2, 0.8)
+    return data
+
+
+# Compare refitting the win model one resample at a time with the stacked normal equations,
+# and time the confidence intervals of every team-season's best strategy change
+def bench_win_model_bootstrap(num_teams=300, num_fits=2000, workers=4):
+    data = random_league_table(num_teams)
+    model_data = WinModelData(data)
+    design, target = model_data.design[model_data.fit_rows], model_data.target[model_data.fit_rows]
+    weights = resample_weights(len(design), num_fits, np.random.default_rng(0))
+
+    def one_at_a_time():
+        return np.array([np.linalg.lstsq(design*np.sqrt(weight)[:, np.newaxis], target*np.sqrt(weight), rcond=None)[0] for weight in weights])
+
+    if not np.allclose(one_at_a_time(), batch_least_squares(design, target, weights)):
+        raise ValueError('batch_least_squares does not match the refits of each resample')
+
+    results = pd.Series({'One at a time (s)':best_time(one_at_a_time, (), 1),
+                         'Normal equations (s)':best_time(batch_least_squares, (design, target, weights)),
+                         'Intervals, 1 worker (s)':best_time(strategy_intervals, (model_data, data, 0.01, num_fits), 1),
+                         'Intervals, {} workers (s)'.format(workers):best_time(lambda: strategy_intervals(model_data, data, 0.01, num_fits, workers=workers), (), 1)})
+    print('{} refits of the win model on {} team-seasons'.format(num_fits, num_teams))
+    print(results.round(4))
+    return results
+
+
+# Cost of the stage instrumentation on a small, frequently called stage: undecorated, instrumentation off, on, and on with memory tracing
+def bench_instrumentation(path, calls=200, repeats=3):
+    team = season_team(path)
+    team.count_outcomes
+
+    undecorated = lambda: [Team.count_outcome_table.__wrapped__(team) for _ in range(calls)]
+    stage_calls = lambda: [team.count_outcome_table() for _ in range(calls)]
+    results = {'Undecorated (s)':best_time(undecorated, (), repeats), 'Off (s)':best_time(stage_calls, (), repeats)}
+    for memory, column in [(False, 'On (s)'), (True, 'On with memory (s)')]:
+        Instrumentation.start(memory)
+        results[column] = best_time(stage_calls, (), repeats)
+        recorded = Instrumentation.stop()
+    if recorded.report().loc[('count_outcome_table', '2007BOSHome'), 'Calls'] != calls*repeats:
+        raise ValueError('Instrumentation did not record every stage call')
+
+    results = pd.Series(results)
+    print('{} calls of count_outcome_table'.format(calls))
+    print(results.round(4))
+    return results
+
+
+# Reference pitcher of every 'play' record in a raw PbP file, read line by line.
+# The pitcher of each team is the last player put in at position 1 by a 'start' or 'sub' line.
+def legacy_pitchers(filename, path):
+    pitchers = []
+    current = {}
+    for line in open(path + filename).read().split('\n'):
+        fields = line.split(',')
+        if fields[0] == 'id':
+            current = {}
+        elif fields[0] in ['start', 'sub'] and fields[-1] == '1':
+            current[fields[-3]] = fields[1]
+        elif fields[0] == 'play':
+            pitchers.append(current.get(str(1 - int(fields[2]))))
+    return pitchers
+
+
+# Check the batting and pitching tables of one parse against separate batting and pitching runs,
+# and time the fused pass against the batting tables alone and against a second run for the pitching side.
+# The fused pass still pays for tracking pitchers while parsing and for the pitching tables, so it is cheaper than two runs but not free.
+# A pitching staff's at-bats are the other batting side of the file, so building it costs about as much again as the Team.
+def bench_pitching(path, repeats=3):
+    files = write_league(path, [2007])
+    filename = files[0]
+    parsed = BatterPbP(filename, path, pitchers=True)
+    if parsed[6].tolist() != legacy_pitchers(filename, path) or not parsed.drop(columns=6).equals(BatterPbP(filename, path)):
+        raise ValueError('BatterPbP does not match the pitchers read line by line from ' + filename)
+
+    tables = season_count_tables(files, path)
+    home_dict, away_dict = split_home_away(files, path)
+    for name, team_dict, homeaway in [('Home', home_dict, '1'), ('Away', away_dict, '0'), ('Pitching Home', home_dict, '0'), ('Pitching Away', away_dict, '1')]:
+        if not legacy_all_team_count(team_dict, homeaway).equals(tables[name]):
+            raise ValueError(name + ' table does not match the per-team pitch counts')
+        if name[:8] == 'Pitching' and not tables['Pitchers'+name[8:]].groupby(level='Team').sum().equals(tables[name].loc[tables['Pitchers'+name[8:]].index.unique('Team')]):
+            raise ValueError(name[8:] + ' pitcher tables do not add up to the pitching staff tables')
+
+    # Teams and pitching staffs built from the per-team PbP files, as setup_teams reads them
+    path_teams = path + 'pitching/'
+    os.makedirs(path_teams, exist_ok=True)
+    home_dict, _ = split_home_away(files, path, pitchers=True)
+    for team, team_games in home_dict.items():
+        team_games.to_csv(path_teams + '2007' + team + 'Home')
+    teams = setup_teams(path_teams, 1, pitching=True)
+    for key, (team, staff) in teams.items():
+        if not team.counts.equals(Team(team.team, team.year, pd.read_csv(path_teams+key+'Home', index_col=[0,1]), 1).counts):
+            raise ValueError('Team built alongside its pitching staff does not match ' + key)
+        if not staff.pitcher_counts.sum().equals(staff.counts.rename(lambda count: str(count).zfill(2)).reindex(COUNT_LABELS, fill_value=0)):
+            raise ValueError('Pitcher counts do not add up to the pitching staff counts of ' + key)
+
+    two_runs = lambda: (season_terminal_counts(files, path), split_home_away(files, path, pitchers=True))
+    results = pd.Series({'Batting tables (s)':best_time(season_terminal_counts, (files, path), repeats),
+                         'Batting, then pitching run (s)':best_time(two_runs, (), repeats),
+                         'Fused pass (s)':best_time(season_count_tables, (files, path), repeats),
+                         'Teams (s)':best_time(lambda: setup_teams(path_teams, 1, attributes=('counts',)), (), repeats),
+                         'Teams and pitching staffs (s)':best_time(lambda: setup_teams(path_teams, 1, attributes=('counts',), pitching=True), (), repeats)})
+    results['Fused overhead'] = results['Fused pass (s)']/results['Batting tables (s)']
+    results['Pitching staff overhead'] = results['Teams and pitching staffs (s)']/results['Teams (s)']
+    print('Batting and pitching tables of {} team-seasons ({} pitchers)'.format(len(files), len(tables['Pitchers Home'].index.unique('Pitcher'))))
+    print(results.round(4))
+    return results
+
+
+# Draw one team-season's heatmap with HeatmapRenderer and check that its PNG is written, that drawing again with
+# changed_only skips it, and that it is redrawn once its pitch counts change.  Times drawing it against skipping it.
+# HeatmapRenderer needs matplotlib and seaborn, so the check is skipped when they are not installed.
+def bench_heatmap_renderer(path, team='BOS', repeats=3):
+    try:
+        import HeatmapRenderer
+    except ImportError as error:
+        print('Skipping the heatmap renderer ({})'.format(error))
+        return None
+
+    write_league(path, [2007])
+    home_counts, away_counts = [counts[counts.index.get_level_values('Team') == team] for counts in league_terminal_counts(path, [2007])]
+    path_out, png = path + 'heatmaps/', team + '2007.png'
+    draw = lambda home: HeatmapRenderer.render_gallery(home, away_counts, path_out, changed_only=True)
+    if draw(home_counts) != [png] or not os.path.getsize(path_out + png):
+        raise ValueError('render_gallery did not draw the heatmap of ' + team)
+    drawn_time = os.path.getmtime(path_out + png)
+    if draw(home_counts) or os.path.getmtime(path_out + png) != drawn_time:
+        raise ValueError('render_gallery redrew a heatmap whose pitch counts did not change')
+    changed_counts = home_counts.copy()
+    changed_counts.iloc[0, 0] += 1
+    if draw(changed_counts) != [png]:
+        raise ValueError('render_gallery did not redraw a heatmap whose pitch counts changed')
+
+    results = pd.Series({'Draw (s)':best_time(lambda: HeatmapRenderer.render_gallery(home_counts, away_counts, path_out), (), repeats),
+                         'Skip unchanged (s)':best_time(draw, (home_counts,), repeats)})
+    print('Heatmap of ' + png)
+    print(results.round(4))
+    return results
+
+
+# Stages of the pipeline timed by bench_scaling, as named by their stage decorators
+SCALING_STAGES = ['BatterPbP', 'split_home_away', 'setup_teams', 'transformation_matrix', 'strategy_mod']
+
+
+# Runs inside a fresh process: the pipeline from raw PbP files to a modified strategy for every home team-season, recorded by stage.
+# Each season is split into home and away games separately, as in the notebooks.
+# Strategy contexts are built before strategy_mod, so it is timed on its own.
+def scaling_pipeline(files, path, memory=False, zcontact=0.87, ocontact=0.66):
+    path_teams = path + 'teams{}/'.format(len(files))
+    os.makedirs(path_teams, exist_ok=True)
+    recorder = Instrumentation.start(memory)
+    try:
+        for file in files:
+            BatterPbP(file, path)
+        for year in sorted(set(file[:4] for file in files)):
+            home_dict, _ = split_home_away([file for file in files if file[:4] == year], path)
+            for team, team_games in home_dict.items():
+                team_games.to_csv(path_teams + year + team + 'Home')
+
+        teams = Instrumentation.stage('setup_teams')(setup_teams)(path_teams, 1, attributes=('counts', 'count_outcomes'))
+        for team in teams.values():
+            team.transformation_matrix()
+        for team in teams.values():
+            team.plate_discipline(zcontact, ocontact)
+            team.strategy_context()
+            swing_changes = swing_changes_from_percentages(team, random_strategies(1))[0]
+            strategy_mod(team, pd.DataFrame(swing_changes, index=team.count_outcomes.index, columns=swing_columns))
+    finally:
+        Instrumentation.stop()
+    return recorder.stage_totals().reindex(SCALING_STAGES), peak_rss()
+
+
+# Run a function once in a newly spawned process
+def spawned_call(func, args):
+    with mp.get_context('spawn').Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+# Time and memory-profile the pipeline stages on 1 to 50 synthetic league-seasons.
+# Each scale is run twice in fresh processes: once for wall time, and once tracing the peak allocation of each stage.
+# The results are compared with the baseline file when it exists, flagging stages over tolerance times slower than the baseline,
+# and saved as the baseline otherwise (or with update_baseline).  The baseline file is in path unless another file is given.
+# The slope of log time against log league-seasons for each stage
+# shows how it scales: about 1 for linear stages, and well above 1 for super-linear stages.
+def bench_scaling(path, scales=(1, 2, 4), baseline_file=None, tolerance=1.25, update_baseline=False, workers=1):
+    if baseline_file is None:
+        baseline_file = path + 'ScalingBaseline.csv'
+    files = write_league(path, range(2007, 2007+max(scales)), workers=workers)
+    runs = []
+    for scale in scales:
+        scale_files = files[:scale*len(TEAMS)]
+        timed, rss = spawned_call(scaling_pipeline, (scale_files, path))
+        traced, _ = spawned_call(scaling_pipeline, (scale_files, path, True))
+        run = timed[['Calls', 'Time (s)', 'Rows']].assign(**{'Peak Memory (MB)':traced['Peak Memory (MB)'], 'Peak RSS (MB)':rss})
+        runs.append(pd.concat({scale:run}, names=['League-Seasons']))
+    results = pd.concat(runs)
+
+    times = results['Time (s)'].unstack('Stage')
+    if len(scales) > 1:
+        slopes = pd.Series({name:np.polyfit(np.log(times.index), np.log(times[name]), 1)[0] for name in SCALING_STAGES}, name='Scaling Slope')
+        print('Scaling of time with league-seasons (log-log slope)')
+        print(slopes.round(2).to_string())
+
+    if os.path.exists(baseline_file) and not update_baseline:
+        baseline = pd.read_csv(baseline_file, index_col=[0,1])
+        results['Baseline (s)'] = baseline['Time (s)'].reindex(results.index)
+        results['Ratio'] = results['Time (s)']/results['Baseline (s)']
+        regressions = results[results['Ratio'] > tolerance]
+        if len(regressions):
+            print('Stages over {:.2f}x slower than the baseline:'.format(tolerance))
+            print(regressions[['Time (s)', 'Baseline (s)', 'Ratio']].round(3))
+    else:
+        results.to_csv(baseline_file)
+        print('Saved the baseline to ' + baseline_file)
+
+    print('Pipeline stages at {} league-seasons'.format(', '.join(str(scale) for scale in scales)))
+    print(results.round(3).to_string())
+    return results
+
+
+# Time BatterPbP, and its peak memory, on a synthetic file holding several seasons of one team's home games,
+# with and without tracking the pitcher of every play record
+def bench_parser(path, seasons=10, repeats=3):
+    filename = write_event_file('BENCHPBP.EVA', path, 'BOS', list(range(2000, 2000+seasons)))
+
+    results = pd.DataFrame({'BatterPbP':measure(BatterPbP, (filename, path), repeats),
+                            'BatterPbP with pitchers':measure(BatterPbP, (filename, path, True), repeats)}).T
+    print('Parsing {} seasons ({} play records)'.format(seasons, len(BatterPbP(filename, path))))
+    print(results.round(3))
+    return results
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as path_bench:
+        bench_parser(path_bench + '/')
+        bench_pitch_counts(path_bench + '/')
+        bench_terminal_counts(path_bench + '/')
+        bench_split_home_away(path_bench + '/')
+        bench_pitching(path_bench + '/')
+        bench_heatmap_renderer(path_bench + '/')
+        bench_event_store(path_bench + '/')
+        bench_atbat_table(path_bench + '/')
+        bench_lazy_team(path_bench + '/')
+        bench_setup_teams(path_bench + '/')
+        bench_team_cache(path_bench + '/')
+        bench_merge_games(path_bench + '/')
+        bench_instrumentation(path_bench + '/')
+        bench_transformation_matrix(path_bench + '/')
+        bench_swing_changes(path_bench + '/')
+        bench_absorbing_state(path_bench + '/')
+        bench_strategy_context(path_bench + '/')
+        bench_strategy_sweep(path_bench + '/')
+        bench_optimizer(path_bench + '/')
+        bench_simulator(path_bench + '/')
+        bench_scaling(path_bench + '/', baseline_file='ScalingBaseline.csv') # Kept between runs to compare against
+    bench_win_model_bootstrap()
@@ -0,0 +1,253 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from RawPbPtoPitchCount import BatterPbP
+from TeamData import Team
+from TeamCache import file_hash
+
+
+# Fixed width record of every plate appearance ('play' line) in the store.
+# Pitch and event strings are kept in separate byte heaps, and each record holds the offset and length of its strings.
+# Every string in a heap is followed by a newline, so a run of consecutive records is decoded with a single split.
+# A length of -1 marks a missing string, which is stored as an empty string.
+# Batter IDs are at most 8 characters, as Retrosheet IDs are, and files with longer IDs are refused rather than truncated.
+RECORD_DTYPE = np.dtype([('game', '<i4'), ('event', '<i4'), ('inning', '<i2'), ('homeaway', 'u1'), ('batter', 'S8'), ('count', 'S2'),
+                         ('pitch_offset', '<i8'), ('pitch_length', '<i4'), ('event_offset', '<i8'), ('event_length', '<i4')])
+
+# Offset index of every game: the records of a game are num_records records starting at first_record
+GAME_DTYPE = np.dtype([('game_id', 'S16'), ('year', '<i2'), ('home', 'S3'), ('away', 'S3'), ('first_record', '<i8'), ('num_records', '<i4')])
+
+STORE_FILES = {'records':'records.bin', 'games':'games.bin', 'pitches':'pitches.bin', 'events':'events.bin', 'sources':'sources.json'}
+DATA_FILES = ['records', 'games', 'pitches', 'events']
+
+
+# Decode the strings of runs of consecutive records from a byte heap.
+# The runs are joined into one block of newline separated strings, so the heap is decoded and split once.
+# Missing and empty strings are NaN, as read_csv gives for an empty field.
+def heap_strings(heap, runs, offset_field, length_field):
+    blocks = [heap[run[offset_field][0]:run[offset_field][-1] + max(run[length_field][-1], 0)].tobytes() for run in runs if len(run)]
+    strings = np.array(b'\n'.join(blocks).decode('ascii', errors='replace').split('\n'), dtype=object)
+    if not blocks:
+        strings = strings[:0]
+    strings[strings == ''] = np.nan
+    return strings
+
+
+# Encode a column of strings into a byte heap, giving the offset (from heap_start) and length of each string
+def encode_strings(values, heap_start):
+    values = np.asarray(values, dtype=object)
+    valid = pd.notna(values)
+    lengths = np.full(len(values), -1, dtype=np.int32)
+    lengths[valid] = [len(value) for value in values[valid]]
+    offsets = heap_start + np.cumsum(np.maximum(lengths, 0) + 1) - (np.maximum(lengths, 0) + 1)
+    heap = ''.join(value + '\n' for value in np.where(valid, values, '')).encode('ascii', errors='replace')
+    return heap, offsets, lengths
+
+
+# Append-only store of every plate appearance of every season in a directory, opened with np.memmap.
+# Records are written one raw PbP file at a time, with the games of each file in sorted order (as in split_home_away),
+# so the home games of a team-season are one contiguous block of records.
+# The offset index of games is small and loaded into memory, while records and heaps are only read when sliced.
+# An append is committed by replacing the sources file, which records the length of every store file, and readers only map
+# those lengths.  Anything written past them by an interrupted append is cut off when the store is next opened for appending.
+# mode='r' opens an existing store read-only and never changes its files, while mode='a' creates the store if needed and appends to it.
+# Only one process should have a store open for appending at a time.
+class EventStore:
+    def __init__(self, store_path, mode='r'):
+        if mode not in ('r', 'a'):
+            raise ValueError("EventStore mode must be 'r' or 'a', not " + repr(mode))
+        self.store_path = store_path
+        self.mode = mode
+        if mode == 'a':
+            os.makedirs(store_path, exist_ok=True)
+            for name in DATA_FILES:
+                open(self.file(name), 'ab').close()
+        elif not os.path.exists(self.file('sources')):
+            raise FileNotFoundError('No EventStore at ' + store_path)
+        self.open()
+
+    def file(self, name):
+        return os.path.join(self.store_path, STORE_FILES[name])
+
+    # Map the committed length of a store file
+    def memmap(self, name, dtype):
+        length = self.lengths.get(name, 0) // np.dtype(dtype).itemsize
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.asarray(np.memmap(self.file(name), dtype=dtype, mode='r', shape=(length,))) # Plain array view of the mapped file, so slicing is cheap
+
+    # Map the store files into memory, and load the game index
+    def open(self):
+        committed = json.load(open(self.file('sources'))) if os.path.exists(self.file('sources')) else {'sources':{}, 'lengths':{}}
+        self.sources, self.lengths = committed['sources'], committed['lengths']
+        if self.mode == 'a':
+            for name in DATA_FILES:
+                if os.path.getsize(self.file(name)) > self.lengths.get(name, 0):
+                    os.truncate(self.file(name), self.lengths.get(name, 0)) # Left by an interrupted append
+
+        self.records = self.memmap('records', RECORD_DTYPE)
+        self.pitches = self.memmap('pitches', np.uint8)
+        self.events = self.memmap('events', np.uint8)
+        games = self.memmap('games', GAME_DTYPE)
+        self.games = pd.DataFrame({'game_id':games['game_id'].astype(str), 'year':games['year'].astype(int),
+                                   'home':games['home'].astype(str), 'away':games['away'].astype(str),
+                                   'first_record':games['first_record'].astype(np.int64), 'num_records':games['num_records'].astype(np.int64)})
+
+        # Positions of the games of every (year, team, homeaway), in the order they were added
+        self.team_index = {}
+        for homeaway, column in enumerate(['away', 'home']):
+            for (year, team), positions in self.games.groupby(['year', column]).indices.items():
+                self.team_index[(year, team, homeaway)] = positions
+
+
+    # Parse a raw PbP file and append its plate appearances to the store.
+    # Files already in the store (with the same contents) are skipped, so a directory can be appended again after adding files.
+    def append_file(self, filename, path):
+        if self.mode != 'a':
+            raise ValueError("EventStore is open read-only, open it with mode='a' to append files")
+        source_hash = file_hash(path + filename)
+        if self.sources.get(filename) == source_hash:
+            return False
+        if filename in self.sources:
+            raise ValueError(filename + ' has changed since it was added to the store, rebuild the store to replace it')
+
+        all_games = BatterPbP(filename, path).sort_index()
+        for col, field in [(2, 'batter'), (3, 'count')]:
+            width = RECORD_DTYPE[field].itemsize
+            if all_games[col].dropna().str.len().max() > width:
+                raise ValueError('{} has a {} longer than the {} characters of the store records'.format(filename, field, width))
+        game_ids = all_games.index.levels[0].take(all_games.index.codes[0]).to_numpy(dtype=str)
+        unique_ids, first, num_records = np.unique(game_ids, return_index=True, return_counts=True)
+        order = np.argsort(first)
+        unique_ids, first, num_records = unique_ids[order], first[order], num_records[order]
+
+        games = np.zeros(len(unique_ids), dtype=GAME_DTYPE)
+        games['game_id'] = unique_ids
+        games['year'] = [int(game_id[3:7]) for game_id in unique_ids]
+        games['home'] = [game_id[:3] for game_id in unique_ids]
+        games['away'] = [game_id[-3:] for game_id in unique_ids]
+        games['first_record'] = len(self.records) + first
+        games['num_records'] = num_records
+
+        records = np.zeros(len(all_games), dtype=RECORD_DTYPE)
+        records['game'] = len(self.games) + np.repeat(np.arange(len(unique_ids)), num_records)
+        records['event'] = all_games.index.get_level_values(1)
+        records['inning'] = pd.to_numeric(all_games[0])
+        records['homeaway'] = pd.to_numeric(all_games[1])
+        records['batter'] = all_games[2].fillna('').to_numpy(dtype=str)
+        records['count'] = all_games[3].fillna('').to_numpy(dtype=str)
+        pitch_heap, records['pitch_offset'], records['pitch_length'] = encode_strings(all_games[4], len(self.pitches))
+        event_heap, records['event_offset'], records['event_length'] = encode_strings(all_games[5], len(self.events))
+
+        for name, data in [('records', records.tobytes()), ('games', games.tobytes()), ('pitches', pitch_heap), ('events', event_heap)]:
+            with open(self.file(name), 'ab') as store_file:
+                store_file.write(data)
+                store_file.flush()
+                os.fsync(store_file.fileno())
+
+        # Commit the append by replacing the sources file in one step
+        self.sources[filename] = source_hash
+        lengths = {name:os.path.getsize(self.file(name)) for name in DATA_FILES}
+        with open(self.file('sources') + '.tmp', 'w') as sources:
+            json.dump({'sources':self.sources, 'lengths':lengths}, sources)
+        os.replace(self.file('sources') + '.tmp', self.file('sources'))
+        self.open()
+        return True
+
+
+    def append_directory(self, path, files=None):
+        return [self.append_file(file, path) for file in (sorted(os.listdir(path)) if files is None else files)]
+
+
+    # Games of a team-season, in the order they were added to the store
+    def team_games(self, year, team, homeaway):
+        return self.games.iloc[self.team_index.get((int(year), team, homeaway), [])]
+
+
+    # Bounds of the runs of records of a set of games, where a run is games stored next to each other.
+    # A team's home games are a single run.
+    def run_bounds(self, games):
+        first, num = games['first_record'].to_numpy(), games['num_records'].to_numpy()
+        if not len(first):
+            return first, first
+        run_start = np.flatnonzero(np.append(True, first[1:] != (first + num)[:-1]))
+        run_end = np.append(run_start[1:], len(first)) - 1
+        return first[run_start], first[run_end] + num[run_end]
+
+    # Records of a set of games, as a list of zero-copy slices of the memmap
+    def game_runs(self, games):
+        return [self.records[start:end] for start, end in zip(*self.run_bounds(games))]
+    
+    # Records of a set of games in one array, gathered with a single take when there is more than one run
+    def game_records(self, games):
+        starts, ends = self.run_bounds(games)
+        if len(starts) == 1:
+            return self.records[starts[0]:ends[0]]
+        lengths = ends - starts
+        return self.records[np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+
+
+    # DataFrame of a team-season's games, with the same columns and types as a per-team PbP file read by setup_teams.
+    # Empty strings are missing values, as they are when read back from CSV.
+    def team_frame(self, year, team, homeaway):
+        games = self.team_games(year, team, homeaway)
+        runs, records = self.game_runs(games), self.game_records(games)
+        
+        # Counts are two digit numbers when every count is known, as read_csv would give
+        count_digits = records['count'].astype('S2').view(np.uint8).reshape(-1, 2).astype(np.int64) - ord('0')
+        if ((count_digits >= 0) & (count_digits <= 9)).all():
+            count = count_digits[:, 0]*10 + count_digits[:, 1]
+        else:
+            count = records['count'].astype(str).astype(object)
+        
+        # Batter IDs are hashed as 8 byte integers, and only the distinct IDs are decoded
+        batter_codes, batter_ids = pd.factorize(np.ascontiguousarray(records['batter']).view('<u8'))
+        batter_ids = np.asarray(batter_ids, dtype='<u8').view('S8').astype(str).astype(object)
+        batter_ids[batter_ids == ''] = np.nan
+        
+        # Games are the first index level, in sorted order
+        record_games, game_codes = pd.factorize(records['game'])
+        game_ids = self.games['game_id'].to_numpy()[game_codes]
+        id_order = np.argsort(game_ids)
+        event = records['event'].astype(np.int64)
+        index = pd.MultiIndex(levels=[game_ids[id_order], np.arange(event.max(initial=-1)+1)],
+                              codes=[np.argsort(id_order)[record_games], event], verify_integrity=False)
+        
+        return pd.DataFrame({'0':records['inning'].astype(np.int64), '1':records['homeaway'].astype(np.int64), '2':batter_ids[batter_codes],
+                             '3':count, '4':heap_strings(self.pitches, runs, 'pitch_offset', 'pitch_length'),
+                             '5':heap_strings(self.events, runs, 'event_offset', 'event_length')}, index=index)
+
+
+    def team(self, year, team, homeaway):
+        return Team(team, str(year), self.team_frame(year, team, homeaway), homeaway)
+
+
+    # Every (year, team) pair with home games in the store
+    def team_seasons(self, years=None):
+        seasons = self.games[['year','home']].drop_duplicates()
+        if years is not None:
+            seasons = seasons[seasons['year'].isin([int(year) for year in years])]
+        return list(seasons.itertuples(index=False, name=None))
+
+
+# Build a Team from the store in a worker process.  Each worker maps the same store files, so their pages are shared.
+def load_store_team(store_path, year, team, homeaway):
+    start = time.perf_counter()
+    team_class = EventStore(store_path).team(year, team, homeaway)
+    return str(year)+team, team_class, time.perf_counter()-start
+
+
+# Build every team-season in the store, in the same form as setup_teams
+def setup_store_teams(store_path, homeaway, years=None, workers=1, chunksize=1):
+    seasons = EventStore(store_path).team_seasons(years)
+    args = [[season[i] for season in seasons] for i in range(2)]
+    if workers == 1:
+        loaded = map(load_store_team, repeat(store_path), *args, repeat(homeaway))
+        return {key:team_class for key, team_class, _ in loaded}
+    with ProcessPoolExecutor(workers) as pool:
+        loaded = pool.map(load_store_team, repeat(store_path), *args, repeat(homeaway), chunksize=chunksize)
+        return {key:team_class for key, team_class, _ in loaded}
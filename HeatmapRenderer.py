@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import seaborn as sns
+from RawPbPtoPitchCount import COUNT_LABELS
+
+
+MANIFEST_FILE = 'heatmaps.json' # Hash of the data and settings each heatmap in a directory was drawn from
+
+
+# Read the home and away pitch count tables of every season (files named YYYYHome and YYYYAway, as in the notebooks),
+# indexed by (Year, Team)
+def load_count_tables(path_counts):
+    tables = {'Home':[], 'Away':[]}
+    for file in sorted(os.listdir(path_counts)):
+        if file[4:] in tables:
+            tables[file[4:]].append(pd.concat({file[:4]:pd.read_csv(path_counts+file, index_col=[0])}, names=['Year', 'Team']))
+    return pd.concat(tables['Home']), pd.concat(tables['Away'])
+
+
+# Fraction of each team-season's at-bats ending at each count, as an (N, balls, strikes) array for the home and away tables.
+# Only team-seasons in both tables are kept.  Returns the (Year, Team) of each row with the two arrays.
+def count_fraction_arrays(home_counts, away_counts):
+    index = home_counts.index.intersection(away_counts.index, sort=False)
+    arrays = []
+    for counts in [home_counts, away_counts]:
+        counts = counts.loc[index, COUNT_LABELS].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fractions = counts/counts.sum(axis=1, keepdims=True)
+        arrays.append(fractions.reshape(-1, 3, 4).transpose(0, 2, 1)) # Counts are ordered by strikes, then balls
+    return index, arrays[0], arrays[1]
+
+
+# Hash of the data behind one heatmap and the settings it is drawn with, to tell whether its PNG is out of date
+def heatmap_hash(home, away, settings):
+    sha = hashlib.sha1(np.ascontiguousarray(home, dtype=float).tobytes())
+    sha.update(np.ascontiguousarray(away, dtype=float).tobytes())
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+# Figure of the PitchCountHeatmap notebook: home and away heatmaps (balls x strikes) with a shared colorbar.
+# The figure is drawn once with placeholder data, and each team-season is drawn by updating its artists in place.
+class HeatmapFigure:
+    def __init__(self, vmin=0.0, vmax=0.2, cmap='vlag'):
+        self.fig, ax = plt.subplots(1, 3, figsize=(7,4), gridspec_kw=dict(width_ratios=[3,3,0.1]))
+        placeholder = np.zeros((4,3))
+        sns.heatmap(placeholder, cmap=cmap, ax=ax[0], annot=True, fmt='.3f', cbar=False, vmin=vmin, vmax=vmax)
+        sns.heatmap(placeholder, cmap=cmap, ax=ax[1], annot=True, fmt='.3f', yticklabels=False, cbar=False, vmin=vmin, vmax=vmax)
+        plt.colorbar(ax[1].collections[0], cax=ax[2])
+
+        ax[0].invert_yaxis()
+        ax[1].invert_yaxis()
+
+        self.title = self.fig.suptitle('')
+        self.title.set_size('xx-large')
+        ax[0].set_title(' Home')
+        ax[1].set_title('Away')
+        ax[0].set_ylabel('Balls')
+        ax[0].set_xlabel('Strikes')
+        ax[1].set_xlabel('Strikes')
+
+        # The color mesh and the annotation of every cell (in row order) of each heatmap
+        self.meshes = [ax[0].collections[0], ax[1].collections[0]]
+        self.annotations = [ax[0].texts, ax[1].texts]
+
+    def update(self, team, year, home, away):
+        self.title.set_text(team+' '+year)
+        for mesh, annotations, values in zip(self.meshes, self.annotations, [home, away]):
+            values = np.ma.masked_invalid(values)
+            mesh.set_array(values.ravel())
+
+            # Annotations are dark on light cells and white on dark cells, the same rule as seaborn
+            rgb = mesh.cmap(mesh.norm(values.filled(0).ravel()))[:, :3]
+            rgb = np.where(rgb <= .03928, rgb/12.92, ((rgb + .055)/1.055)**2.4)
+            luminance = rgb.dot([.2126, .7152, .0722])
+            for text, value, lum, masked in zip(annotations, values.data.ravel(), luminance, np.ma.getmaskarray(values).ravel()):
+                text.set_text('' if masked else '{:.3f}'.format(value))
+                text.set_color('.15' if lum > .408 else 'w')
+
+    def save(self, filename, dpi=None):
+        self.fig.savefig(filename, dpi=dpi)
+
+
+# Figure of the current worker process, created once per process and reused for every heatmap it draws
+worker_figure = None
+
+def render_heatmaps(jobs, path_out, settings):
+    global worker_figure
+    if worker_figure is None:
+        worker_figure = HeatmapFigure(settings['vmin'], settings['vmax'], settings['cmap'])
+    for team, year, home, away in jobs:
+        worker_figure.update(team, year, home, away)
+        worker_figure.save(path_out+team+year+'.png', settings['dpi'])
+    return len(jobs)
+
+
+# Draw the heatmap of every team-season into path_out as TEAMYEAR.png, splitting the team-seasons across worker processes.
+# With changed_only, team-seasons are skipped when their PNG exists and was drawn from the same data and settings
+# (recorded in the directory's manifest file).  Returns the names of the PNGs drawn.
+def render_gallery(home_counts, away_counts, path_out, workers=1, changed_only=False, vmin=0.0, vmax=0.2, cmap='vlag', dpi=None):
+    os.makedirs(path_out, exist_ok=True)
+    settings = {'vmin':vmin, 'vmax':vmax, 'cmap':cmap, 'dpi':dpi}
+    index, home, away = count_fraction_arrays(home_counts, away_counts)
+
+    manifest_file = os.path.join(path_out, MANIFEST_FILE)
+    manifest = json.load(open(manifest_file)) if os.path.exists(manifest_file) else {}
+    hashes = {}
+    jobs = []
+    for (year, team), team_home, team_away in zip(index, home, away):
+        name = str(team)+str(year)
+        hashes[name] = heatmap_hash(team_home, team_away, settings)
+        if changed_only and manifest.get(name) == hashes[name] and os.path.exists(os.path.join(path_out, name+'.png')):
+            continue
+        jobs.append((str(team), str(year), team_home, team_away))
+
+    path_out = os.path.join(path_out, '')
+    if workers == 1 or len(jobs) <= 1:
+        render_heatmaps(jobs, path_out, settings)
+    else:
+        num_workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(num_workers) as pool:
+            list(pool.map(render_heatmaps, [jobs[i::num_workers] for i in range(num_workers)], [path_out]*num_workers, [settings]*num_workers))
+
+    manifest.update(hashes)
+    with open(manifest_file, 'w') as manifest_out:
+        json.dump(manifest, manifest_out, indent=0, sort_keys=True)
+    return [team+year+'.png' for team, year, _, _ in jobs]
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Draw the home and away pitch count heatmap of every team-season.')
+    parser.add_argument('path_counts', help='Directory of pitch count tables (YYYYHome and YYYYAway files)')
+    parser.add_argument('path_out', nargs='?', default='./Heatmaps/', help='Directory to write TEAMYEAR.png files into')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (0 for one per CPU)')
+    parser.add_argument('--changed-only', action='store_true', help='Only draw team-seasons whose pitch counts changed since they were last drawn')
+    parser.add_argument('--years', nargs='+', help='Only draw these seasons')
+    parser.add_argument('--vmin', type=float, default=0.0)
+    parser.add_argument('--vmax', type=float, default=0.2)
+    parser.add_argument('--cmap', default='vlag')
+    parser.add_argument('--dpi', type=float, default=None)
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+
+    home_counts, away_counts = load_count_tables(os.path.join(args.path_counts, ''))
+    if args.years is not None:
+        home_counts = home_counts[home_counts.index.get_level_values('Year').isin(args.years)]
+
+    drawn = render_gallery(home_counts, away_counts, args.path_out, args.workers or None, args.changed_only,
+                           args.vmin, args.vmax, args.cmap, args.dpi)
+    print('Drew {} heatmaps in {:.2f}s'.format(len(drawn), time.perf_counter()-start))
@@ -0,0 +1,201 @@
+import pandas as pd
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from functools import wraps
+
+
+# Recorder of the stages run while instrumentation is on, and None while it is off.
+# Stage functions only check this before running, so instrumentation costs a single comparison per call when off.
+recorder = None
+
+# Setting this environment variable to a .json or .csv file turns instrumentation on when the pipeline is imported,
+# and writes the report to the file when the process exits (with peak allocations if STAGE_MEMORY_ENV is also set)
+STAGE_REPORT_ENV = 'PITCHCOUNT_STAGE_REPORT'
+STAGE_MEMORY_ENV = 'PITCHCOUNT_STAGE_MEMORY'
+
+REPORT_COLUMNS = ['Calls', 'Time (s)', 'Rows', 'Peak Memory (MB)']
+
+
+# Wall time, calls, rows processed, and peak allocation of every (stage, team) run while recording.
+# Peak allocations are only measured with memory=True, since tracing allocations slows the pipeline down.
+class StageRecorder:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stats = {} # (stage, label): [calls, seconds, rows, peak bytes]
+        self.labels = [] # Labels of the enclosing team_label blocks
+        self.peaks = [] # [starting bytes, peak bytes] of each running stage, innermost last
+        self.started = time.time()
+        self.pid = os.getpid()
+
+    def run(self, name, func, args, kwargs, label, rows):
+        stage_label = label(*args, **kwargs) if label is not None else default_label(args, self.labels)
+        if self.memory:
+            self.enter_memory()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = self.exit_memory() if self.memory else 0
+        stage_rows = rows(*args, **kwargs) if rows is not None else default_rows(args, result)
+        self.add(name, stage_label, [1, seconds, stage_rows or 0, peak])
+        return result
+
+    # Nested stages each reset the peak, so the peak of every enclosing stage is carried up when an inner stage ends
+    def enter_memory(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if self.peaks:
+            self.peaks[-1][1] = max(self.peaks[-1][1], peak)
+        tracemalloc.reset_peak()
+        self.peaks.append([current, current])
+
+    def exit_memory(self):
+        start, peak = self.peaks.pop()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if self.peaks:
+            self.peaks[-1][1] = max(self.peaks[-1][1], peak)
+        return peak - start
+
+    def add(self, name, label, values):
+        stats = self.stats.setdefault((name, label), [0, 0.0, 0, 0])
+        stats[:3] = [total + value for total, value in zip(stats[:3], values[:3])]
+        stats[3] = max(stats[3], values[3])
+
+    # Add the stages recorded in another process (see recorded_call)
+    def merge(self, stats):
+        for (name, label), values in stats.items():
+            self.add(name, label, values)
+
+
+    # One row per (stage, team), sorted by time
+    def report(self):
+        if not self.stats:
+            return pd.DataFrame(columns=REPORT_COLUMNS, index=pd.MultiIndex.from_tuples([], names=['Stage','Team']))
+        report = pd.DataFrame.from_dict(self.stats, orient='index', columns=REPORT_COLUMNS)
+        report.index = pd.MultiIndex.from_tuples(report.index, names=['Stage','Team'])
+        report['Peak Memory (MB)'] /= 2**20
+        return report.sort_values('Time (s)', ascending=False)
+
+    # Totals of every stage over all teams, with the peak memory of its largest call
+    def stage_totals(self):
+        return self.report().groupby(level='Stage').agg({'Calls':'sum', 'Time (s)':'sum', 'Rows':'sum', 'Peak Memory (MB)':'max'}).sort_values('Time (s)', ascending=False)
+
+    # Write the report as CSV, or as JSON (by the file extension) along with when recording started
+    def save(self, filename):
+        report = self.report()
+        if filename.endswith('.csv'):
+            report.to_csv(filename)
+            return
+        stages = report.reset_index().to_dict('records')
+        with open(filename, 'w') as report_file:
+            json.dump({'started':self.started, 'memory':self.memory, 'stages':stages}, report_file, indent=1)
+
+
+# Team-season of a call, from a Team or StrategyContext first argument (as YYYYTEAMHome/Away), or the enclosing team_label
+def default_label(args, labels):
+    if args and all(hasattr(args[0], attr) for attr in ['team', 'year', 'homeaway']):
+        return str(args[0].year) + str(args[0].team) + ['Away','Home'][int(args[0].homeaway)]
+    return labels[-1] if labels else ''
+
+
+# Rows processed by a call: the length of its first table argument (DataFrame, Series, array, or AtBatTable), or of its result
+def default_rows(args, result):
+    for value in list(args) + [result]:
+        if hasattr(value, '__len__') and (hasattr(value, 'index') or hasattr(value, 'shape')) and not isinstance(value, (str, tuple, list)):
+            return len(value)
+    return 0
+
+
+# Decorator marking a function as a pipeline stage.
+# label and rows optionally give the team and the number of rows processed from the call's arguments.
+def stage(name=None, label=None, rows=None):
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @wraps(func)
+        def run_stage(*args, **kwargs):
+            if recorder is None:
+                return func(*args, **kwargs)
+            return recorder.run(stage_name, func, args, kwargs, label, rows)
+        return run_stage
+    return decorator
+
+
+# Label the stages run inside the block that cannot be given a team from their arguments
+class team_label:
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        if recorder is not None:
+            recorder.labels.append(self.label)
+        return self
+
+    def __exit__(self, *exc):
+        if recorder is not None and recorder.labels:
+            recorder.labels.pop()
+
+
+# Turn instrumentation on, giving the new recorder, or off, giving the recorder that was running
+def start(memory=False):
+    global recorder
+    recorder = StageRecorder(memory)
+    return recorder
+
+def stop():
+    global recorder
+    stopped, recorder = recorder, None
+    if stopped is not None and stopped.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return stopped
+
+
+# Run a function under its own recorder, giving its result and the stages it recorded.
+# Used to run stages in worker processes, whose stages are then merged into the main recorder.
+def recorded_call(memory, func, *args):
+    global recorder
+    outer, recorder = recorder, StageRecorder(memory)
+    try:
+        return func(*args), recorder.stats
+    finally:
+        recorder = outer
+
+
+# Profile a single call (such as building and modifying one team) with cProfile and tracemalloc, along with its stages.
+# Returns the call's result and a dictionary of the profile ordered by sort, the top lines allocating memory, and the stage report.
+def profile_call(func, *args, top=25, sort='cumulative', **kwargs):
+    global recorder
+    outer = recorder
+    recorder = StageRecorder(memory=True)
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        stages, recorder = recorder, outer
+
+    profile_text = io.StringIO()
+    pstats.Stats(profiler, stream=profile_text).sort_stats(sort).print_stats(top)
+    allocations = pd.DataFrame([(str(line.traceback), line.size/2**20, line.count) for line in snapshot.statistics('lineno')[:top]],
+                               columns=['Line', 'Size (MB)', 'Blocks'])
+    return result, {'profile':profile_text.getvalue(), 'allocations':allocations, 'stages':stages.report()}
+
+
+def save_on_exit(filename):
+    if recorder is not None and recorder.pid == os.getpid():
+        recorder.save(filename)
+
+
+if os.environ.get(STAGE_REPORT_ENV):
+    start(memory=bool(os.environ.get(STAGE_MEMORY_ENV)))
+    atexit.register(save_on_exit, os.environ[STAGE_REPORT_ENV])
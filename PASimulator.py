@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from StratMod_PitchSpecific import *
+
+
+# Cumulative probability of moving from each state (rows) to each state (columns) of a column stochastic Markov Chain.
+# The next state is the first column with a cumulative probability above a uniform random number.
+# Counts that are never reached have no probabilities, and the last column is set to 1 so a draw never runs past the last state.
+def transition_cdf(markov_chain):
+    cdf = np.cumsum(np.nan_to_num(np.asarray(markov_chain, dtype=float)).T, axis=1)
+    cdf[:, -1] = 1
+    return cdf
+
+
+# Simulate plate appearances pitch by pitch, all starting at the 0-0 count.
+# Every pitch draws the next state of all plate appearances still in progress at once.
+# Returns the outcome of each plate appearance (position in outcome_labels, or -1 if still going after max_pitches),
+# and the number of pitches thrown.
+def simulate_batch(cdf, num_pa, rng, num_outcomes=len(outcome_labels), max_pitches=100):
+    num_counts = len(cdf) - num_outcomes
+    state = np.zeros(num_pa, dtype=np.int64)
+    pitches = np.zeros(num_pa, dtype=np.int32)
+
+    active = np.arange(num_pa)
+    for _ in range(max_pitches):
+        if len(active) == 0:
+            break
+        draws = rng.random(len(active))
+        new_state = (draws[:, np.newaxis] >= cdf[state[active]]).sum(axis=1)
+        state[active] = new_state
+        pitches[active] += 1
+        active = active[new_state < num_counts]
+
+    return np.where(state >= num_counts, state - num_counts, -1), pitches
+
+
+# Simulate a number of seasons of plate appearances with its own random stream, in batches of whole seasons.
+# Memory is fixed by batch_size, the number of plate appearances simulated at once.
+# Returns one row per season of the number of each outcome, unfinished plate appearances, and total pitches,
+# along with a histogram of the pitches thrown in each plate appearance.
+def simulate_chunk(cdf, num_seasons, pa_per_season, seed_seq, batch_size=1<<18, max_pitches=100, num_outcomes=len(outcome_labels)):
+    rng = np.random.default_rng(seed_seq)
+    seasons_per_batch = max(1, batch_size//pa_per_season)
+
+    season_rows = []
+    pitch_hist = np.zeros(max_pitches+1, dtype=np.int64)
+    for first_season in range(0, num_seasons, seasons_per_batch):
+        batch_seasons = min(seasons_per_batch, num_seasons-first_season)
+        outcomes, pitches = simulate_batch(cdf, batch_seasons*pa_per_season, rng, num_outcomes, max_pitches)
+
+        season = np.arange(len(outcomes))//pa_per_season
+        totals = np.bincount(season*(num_outcomes+1) + outcomes+1, minlength=batch_seasons*(num_outcomes+1))
+        totals = totals.reshape(batch_seasons, num_outcomes+1)
+        season_pitches = np.bincount(season, weights=pitches, minlength=batch_seasons).astype(np.int64)
+        season_rows.append(np.column_stack([totals[:, 1:], totals[:, 0], season_pitches]))
+        pitch_hist += np.bincount(pitches, minlength=max_pitches+1)
+
+    return np.vstack(season_rows), pitch_hist
+
+
+def simulate_chunk_args(args):
+    return simulate_chunk(*args)
+
+
+# Simulate chunks of (number of seasons, plate appearances per season), optionally across worker processes.
+# Each chunk has an independent random stream spawned from seed.  The streams are fixed by seed and the chunks,
+# so the results are reproducible for any number of workers.
+def run_chunks(markov_chain, chunks, seed=None, workers=1, batch_size=1<<18, max_pitches=100):
+    cdf = transition_cdf(markov_chain)
+    streams = np.random.SeedSequence(seed).spawn(len(chunks))
+    args = [(cdf, num_seasons, pa_per_season, stream, batch_size, max_pitches) for (num_seasons, pa_per_season), stream in zip(chunks, streams)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(simulate_chunk_args, args))
+    else:
+        results = [simulate_chunk(*chunk_args) for chunk_args in args]
+    return np.vstack([rows for rows, _ in results]), sum(hist for _, hist in results)
+
+
+# Simulate full seasons of plate appearances, giving the distribution of each outcome and of pitches per plate appearance.
+# With run_values (the runs added by each outcome in outcome_labels order), the runs of each season are also estimated.
+# Returns a DataFrame with one row per season.
+def simulate_seasons(markov_chain, pa_per_season, num_seasons, seed=None, chunks=8, workers=1, run_values=None,
+                     batch_size=1<<18, max_pitches=100):
+    chunk_seasons = [(len(part), pa_per_season) for part in np.array_split(np.arange(num_seasons), min(chunks, num_seasons))]
+    season_rows, _ = run_chunks(markov_chain, chunk_seasons, seed, workers, batch_size, max_pitches)
+
+    seasons = pd.DataFrame(season_rows, columns=outcome_labels+['Unfinished','Pitches'])
+    seasons['Pitches/PA'] = seasons['Pitches']/pa_per_season
+    if run_values is not None:
+        seasons['Runs'] = seasons[outcome_labels].dot(np.asarray(run_values, dtype=float))
+    return seasons
+
+
+# Simulate a number of single plate appearances.
+# Returns the number of each outcome (and of unfinished plate appearances), and the number of plate appearances with each number of pitches.
+def simulate_plate_appearances(markov_chain, num_pa, seed=None, chunks=8, workers=1, batch_size=1<<18, max_pitches=100):
+    chunk_pa = [(1, len(part)) for part in np.array_split(np.arange(num_pa), min(chunks, num_pa))]
+    season_rows, pitch_hist = run_chunks(markov_chain, chunk_pa, seed, workers, batch_size, max_pitches)
+
+    totals = season_rows.sum(axis=0)[:-1]
+    return pd.Series(totals, index=outcome_labels+['Unfinished']), pd.Series(pitch_hist).rename_axis('Pitches')
+
+
+# Check the simulated plate appearances against the Markov Chain solutions.
+# The outcome frequencies are compared with steady_state (25 pitches, as in strategy_mod) and absorbing_state,
+# and the mean pitches per plate appearance with absorbing_state.
+# Differences are given in standard errors of the simulated mean, and are valid when within tolerance.
+def validate_simulation(markov_chain, num_pa=10**6, seed=0, tolerance=4, **kwargs):
+    MC = np.nan_to_num(np.asarray(markov_chain, dtype=float))
+    num_counts = len(MC) - len(outcome_labels)
+    initial_vector = np.zeros(len(MC))
+    initial_vector[0] = 1
+    steady = steady_state(MC, initial_vector, 25)[num_counts:]
+    exact, pitches_per_pa = absorbing_state(MC)
+
+    totals, pitch_hist = simulate_plate_appearances(markov_chain, num_pa, seed, **kwargs)
+    simulated = totals[outcome_labels].to_numpy()/num_pa
+    pitch_values = pitch_hist.index.to_numpy()
+    pitch_mean = pitch_values.dot(pitch_hist)/num_pa
+    pitch_var = ((pitch_values - pitch_mean)**2).dot(pitch_hist)/num_pa
+
+    validation = pd.DataFrame({'Steady State':np.append(steady, np.nan), 'Exact':np.append(exact, pitches_per_pa),
+                               'Simulated':np.append(simulated, pitch_mean),
+                               'Std. Error':np.sqrt(np.append(simulated*(1-simulated), pitch_var)/num_pa)},
+                              index=outcome_labels+['Pitches/PA'])
+    reference = validation['Steady State'].fillna(validation['Exact'])
+    validation['Z'] = (validation['Simulated'] - reference)/validation['Std. Error']
+    validation['Valid'] = (validation['Z'].abs() <= tolerance) | (validation['Simulated'] == reference)
+    return validation
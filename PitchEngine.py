@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+
+# Pitch counts ordered the same as Team.counts_str, so a count with b balls and s strikes has the code b + 4*s
+COUNT_LABELS = np.array([i+j for j in ['0','1','2'] for i in ['0','1','2','3']], dtype=object)
+
+# Single character strings for each byte, used to decode pitch codes back into pitch labels
+PITCH_CHARS = np.array([chr(i) for i in range(256)], dtype=object)
+
+
+# Encode all pitch strings into one contiguous uint8 array, along with the number of pitches in each string.
+# Missing pitch strings are given a length of -1 so they can be told apart from at-bats with no pitches.
+def encode_pitches(pitch_strings):
+    strings = pitch_strings.to_numpy(dtype=object)
+    valid = pd.notna(strings)
+
+    lengths = np.full(len(strings), -1, dtype=np.int64)
+    lengths[valid] = [len(pitches) for pitches in strings[valid]]
+
+    # Characters outside of ASCII are replaced by a single '?' byte, so the lengths are unchanged
+    codes = np.frombuffer(''.join(strings[valid]).encode('ascii', errors='replace'), dtype=np.uint8)
+    return codes, lengths
+
+
+# Translate and delete pitch characters with lookup tables, the same as str.translate(str.maketrans(...)) on each string
+def translate_pitches(codes, lengths, pitch_types, pitch_repl, pitch_none=''):
+    table = np.arange(256, dtype=np.uint8)
+    table[np.frombuffer(pitch_types.encode(), dtype=np.uint8)] = np.frombuffer(pitch_repl.encode(), dtype=np.uint8)
+    keep = np.ones(256, dtype=bool)
+    keep[np.frombuffer(pitch_none.encode(), dtype=np.uint8)] = False
+
+    kept = keep[codes]
+    ab_of_pitch = np.repeat(np.arange(len(lengths)), np.maximum(lengths, 0))
+    new_lengths = np.bincount(ab_of_pitch[kept], minlength=len(lengths))
+    new_lengths[lengths < 0] = -1
+    return table[codes[kept]], new_lengths
+
+
+# For every pitch, the count of the at-bat before that pitch is thrown, given as the count code b + 4*s.
+# Balls and strikes are accumulated within each at-bat with a single cumulative sum over all pitches.
+# If a pitch count goes above 4 balls without the at-bat ending (due to umpire error), the at-bat continues with 3 balls
+# If more than 3 'strikes' occur during an at-bat, do not iterate the pitch count higher than x-2
+def running_counts(codes, lengths, ball=ord('B'), strike=ord('S')):
+    lengths = np.maximum(lengths, 0)
+    ab_start = np.cumsum(lengths) - lengths
+
+    running = []
+    for pitch in [ball, strike]:
+        is_pitch = (codes == pitch)
+        before_pitch = np.cumsum(is_pitch) - is_pitch # Number of these pitches thrown before the current one
+        before_ab = np.append(before_pitch, 0)[ab_start]
+        running.append(before_pitch - np.repeat(before_ab, lengths))
+
+    return np.minimum(running[0], 3) + 4*np.minimum(running[1], 2)
+
+
+# At-bats with an empty pitch string still start at a 0-0 count.  Give them a single entry filled with fill_value.
+def pad_empty(values, lengths, fill_value):
+    ab_start = np.cumsum(np.maximum(lengths, 0)) - np.maximum(lengths, 0)
+    empty = (lengths == 0)
+    return np.insert(values, ab_start[empty], fill_value), np.where(empty, 1, lengths)
+
+
+# Add a level to an at-bat index for the position of each pitch (starting at 1), repeating each at-bat once per pitch
+def stacked_index(index, lengths):
+    lengths = np.maximum(lengths, 0)
+    if isinstance(index, pd.MultiIndex):
+        levels, codes = list(index.levels), list(index.codes)
+    else:
+        index_codes, index_levels = index.factorize()
+        levels, codes = [index_levels], [index_codes]
+
+    ab_start = np.cumsum(lengths) - lengths
+    position = np.arange(lengths.sum()) - np.repeat(ab_start, lengths)
+    return pd.MultiIndex(levels=levels + [np.arange(1, lengths.max(initial=0)+1)],
+                         codes=[np.repeat(level_codes, lengths) for level_codes in codes] + [position],
+                         names=list(index.names) + [None], verify_integrity=False)
+
+
+# Ordered pitch count strings reached during each at-bat, one entry per pitch
+def pitch_count_series(pitch_strings):
+    codes, lengths = encode_pitches(pitch_strings)
+    counts, lengths = pad_empty(running_counts(codes, lengths), lengths, 0)
+    return pd.Series(COUNT_LABELS[counts], index=stacked_index(pitch_strings.index, lengths))
+
+
+# Count code and translated pitch label of every pitch, from a single encoding of the pitch strings.
+# count_map and outcome_map are (pitch_types, pitch_repl, pitch_none) translations for the counts and pitch labels,
+# and both must remove the same characters so the pitches line up.
+def count_outcome_codes(raw_codes, raw_lengths, count_map, outcome_map):
+    count_codes, lengths = translate_pitches(raw_codes, raw_lengths, *count_map)
+    outcome_codes, _ = translate_pitches(raw_codes, raw_lengths, *outcome_map)
+    return running_counts(count_codes, lengths), outcome_codes, lengths
+
+
+# Number of at-bats that reach each count (rows) and end at each terminal count (columns), as a 12 x 12 array of count codes.
+# A count is only recorded once per at-bat.  Counts never go back down during an at-bat, so the distinct counts are
+# the pitches where the count changes, and the terminal count is the count before the last pitch.
+# Every (current, terminal) pair is added with a single bincount over current*12 + terminal.
+def terminal_from_current(codes, lengths):
+    counts, lengths = pad_empty(running_counts(codes, lengths), lengths, 0)
+    lengths = np.maximum(lengths, 0)
+    ab_of_pitch = np.repeat(np.arange(len(lengths)), lengths)
+
+    first = np.ones(len(counts), dtype=bool)
+    first[1:] = (counts[1:] != counts[:-1]) | (ab_of_pitch[1:] != ab_of_pitch[:-1])
+    terminal = counts[np.repeat(np.cumsum(lengths) - 1, lengths)]
+
+    num_counts = len(COUNT_LABELS)
+    return np.bincount(counts[first]*num_counts + terminal[first], minlength=num_counts**2).reshape(num_counts, num_counts)
+
+
+# Pitch count and pitch label of every pitch, as a DataFrame with one row per pitch (see count_outcome_codes)
+def count_outcome_frame(pitch_strings, count_map, outcome_map):
+    counts, outcome_codes, lengths = count_outcome_codes(*encode_pitches(pitch_strings), count_map, outcome_map)
+    counts, pad_lengths = pad_empty(counts, lengths, 0)
+    outcomes, _ = pad_empty(PITCH_CHARS[outcome_codes], lengths, np.nan)
+    return pd.DataFrame({'Count':COUNT_LABELS[counts], 'Outcome':outcomes},
+                        index=stacked_index(pitch_strings.index, pad_lengths))
+
+
+# Number of each pitch label thrown at each count, counted with a single bincount over count code and pitch byte.
+# The same as count_outcome_frame(...).groupby('Count')['Outcome'].value_counts().unstack().fillna(0)
+def count_outcome_counts(raw_codes, raw_lengths, count_map, outcome_map):
+    counts, outcome_codes, _ = count_outcome_codes(raw_codes, raw_lengths, count_map, outcome_map)
+    totals = np.bincount(counts*256 + outcome_codes, minlength=len(COUNT_LABELS)*256).reshape(len(COUNT_LABELS), 256)
+
+    rows, cols = np.flatnonzero(totals.sum(axis=1)), np.flatnonzero(totals.sum(axis=0))
+    table = pd.DataFrame(totals[np.ix_(rows, cols)].astype(float), index=pd.Index(COUNT_LABELS[rows], name='Count'),
+                         columns=pd.Index(PITCH_CHARS[cols], name='Outcome'))
+    return table.sort_index()
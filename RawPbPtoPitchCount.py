@@ -1,16 +1,27 @@
 import numpy as np
 import pandas as pd
 import time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 import os
+from Instrumentation import stage
+
+
+COUNT_LABELS = [i+j for j in ['0','1','2'] for i in ['0','1','2','3']] # All pitch counts from combination of balls + strikes
 
 
 # Takes raw play-by-play file and extracts only the in-games actions, labelled by 'play' in the raw file
-def BatterPbP(filename,path):
+# With pitchers=True, the pitcher of the fielding team is added as column 6 of every 'play' record.
+# The current pitcher of each team is tracked from the 'start' and 'sub' lines, which have the form
+# 'start,playerid,"name",team,battingorder,position', with team 0 for the visitors and position 1 for the pitcher.
+@stage(label=lambda filename, path, *args, **kwargs: filename)
+def BatterPbP(filename,path,pitchers=False):
     raw_file = open(path + filename,'r').read().split('\n')
     
     games_list = [] # List of games    
     games_keys = [] # Game IDs and Event number in each game. Used to create MultiIndex
     games_events = [] # In-game events, denoted by 'play' in raw file
+    games_pitchers = [] # Pitcher facing each in-game event, with pitchers=True
     
     game_start_index = [i for i,x in enumerate(raw_file) if x[:2]=='id'] # Check for start of a game id
     game_start_index.append(len(raw_file)) # Add the final line to the list of indices, we will not loop to include this point
@@ -28,18 +39,53 @@ def BatterPbP(filename,path):
         game_id = game[0][3:] + game[2][-3:]
         
         j = 0
+        current_pitchers = {'0':None, '1':None} # Pitcher facing each batting side
         for line in game:
             if line[:4] == 'play':
                 games_keys.append((game_id,j))
                 games_events.append(line[5:].split(','))
                 j += 1
+                if pitchers:
+                    games_pitchers.append(current_pitchers.get(games_events[-1][1]))
+            elif pitchers and (line[:3] == 'sub' or line[:5] == 'start'):
+                # Fields are split from the right, in case a player's name holds a comma
+                team, position = line.rsplit(',', 3)[1::2]
+                if position == '1' and team in ['0', '1']:
+                    current_pitchers['1' if team == '0' else '0'] = line.split(',', 2)[1]
         #= dict(enumerate([line[5:].split(',') for line in game if line[:4]=='play']))
         
     games_df = pd.DataFrame(games_events,index = pd.MultiIndex.from_tuples(games_keys))
+    if pitchers:
+        games_df[6] = games_pitchers
     
     return games_df
 
 
+# Parse each raw file once and assign every game event to both its home team and its away team.
+# Game IDs have the form 'HHHYYYYMMDDGAAA', so the home team is the prefix and the visiting team is the suffix.
+# Each file is grouped once by these keys, and each team's DataFrame is concatenated a single time at the end.
+# With pitchers=True, every event also has the pitcher it was against (see BatterPbP).
+@stage(rows=lambda team_raw_list, path_raw, *args, **kwargs: len(team_raw_list))
+def split_home_away(team_raw_list, path_raw, pitchers=False):
+    home_parts = {file[4:7]:[] for file in team_raw_list}
+    away_parts = {file[4:7]:[] for file in team_raw_list}
+
+    for file in team_raw_list:
+        # Keep the games in sorted order, with each game's events in the order they occurred
+        all_games = BatterPbP(file, path_raw, pitchers=pitchers).sort_index()
+
+        game_codes = all_games.index.codes[0]
+        game_ids = all_games.index.levels[0]
+        for team_parts, team_ids in [(home_parts, game_ids.str[:3]), (away_parts, game_ids.str[-3:])]:
+            for team, team_games in all_games.groupby(team_ids.take(game_codes), sort=False):
+                team_parts.setdefault(team, []).append(team_games)
+
+    home_dict = {team:(pd.concat(parts) if parts else pd.DataFrame()) for team, parts in home_parts.items()}
+    away_dict = {team:(pd.concat(parts) if parts else pd.DataFrame()) for team, parts in away_parts.items()}
+
+    return home_dict, away_dict
+
+
 # Adds two additional columns which dictates the batter on-deck (Next Batter), and the Inning that batter comes to the plate
 # If two game actions have the same batter in the same inning, the action involves runners on base
 # Since we only care about what the batter is doing, we can ignore the first of these two events then
@@ -56,67 +102,179 @@ def team_next_batter(team_games_all):
 
 
 # Counts the number of times each pitch count results in a game action for each team
+# Kept for existing callers, see terminal_counts
 def all_team_count(team_dict, homeaway):
-    team_pitch_count_dict = {}
-    
-    for team in team_dict.keys():
-        team_all_batter = team_dict[team]
-        team_all_batter.columns = ['0','1','2','3','4','5']
-        team_batters = team_all_batter.loc[team_all_batter['1']==homeaway]
+    team_counts = terminal_counts(team_dict, homeaway)
+    return {team:team_counts.loc[team].tolist() for team in team_counts.index}
 
-        team_batter_nodup = team_next_batter(team_batters).groupby('3').size()
 
-        team_pitch_count_dict[team[:3]] = team_batter_nodup[counts].tolist()
+# Columns of every team's games concatenated once, for the grouped passes below.
+# Columns are taken by position, since the raw frames have integer column names and the PbP files have strings.
+# Each game is keyed by its team as well, since a game is in the frames of both of its teams.
+def concat_team_games(team_dict, pitchers=False):
+    frames = [team_games for team_games in team_dict.values() if len(team_games)]
+    team_codes = np.repeat(np.arange(len(team_dict)), [len(team_games) for team_games in team_dict.values()])
+    games = np.concatenate([team_games.index.codes[0] for team_games in frames]).astype(np.int64)
+    columns = {'team':team_codes, 'game':team_codes*(games.max()+1) + games}
+    for name, col in [('inning', 0), ('side', 1), ('batter', 2), ('count', 3)] + [('pitcher', 6)]*pitchers:
+        columns[name] = np.concatenate([team_games.iloc[:, col].to_numpy(dtype=object) for team_games in frames])
+    columns['side'] = pd.Series(columns['side']).astype(str).to_numpy()
 
-    return team_pitch_count_dict
+    # Counts are coded by their position in COUNT_LABELS (-1 if missing or invalid), converting each distinct value once.
+    # Counts read back from the PbP files are integers ('01' is read as 1).
+    count_values, counts = pd.factorize(columns['count'])
+    count_codes = pd.Index(COUNT_LABELS).get_indexer(pd.Series(counts, dtype=object).astype(str).str.zfill(2))
+    columns['count'] = np.append(count_codes, -1)[count_values]
+    if pitchers:
+        columns['pitcher'], columns['pitchers'] = pd.factorize(columns['pitcher']) # -1 for unknown pitchers
+    return columns
 
 
+# Terminal events of one batting side (0 or 1) of the concatenated games: the position of each event and the code of its count.
+# As in team_next_batter, an event followed by the same batter in the same inning is dropped,
+# as are events without a valid count.
+def terminal_events(games, homeaway):
+    # Events of the batting side, grouped by game in the order they occurred
+    batting = np.flatnonzero(games['side'] == str(homeaway))
+    batting = batting[np.argsort(games['game'][batting], kind='stable')]
+    game, inning, batter = games['game'][batting], games['inning'][batting], games['batter'][batting]
 
+    # Drop events where the next event of the game has the same batter in the same inning (missing values never match)
+    same_next = np.zeros(len(batting), dtype=bool)
+    same_next[:-1] = ((game[1:] == game[:-1]) & (batter[1:] == batter[:-1]) & (inning[1:] == inning[:-1])
+                      & pd.notna(batter[1:]) & pd.notna(inning[1:]))
+    batting = batting[~same_next]
+    batting = batting[games['count'][batting] >= 0]
+    return batting, games['count'][batting]
 
-if __name__ == "__main__":
-    path_raw = '' # Path to directory containing the raw play-by-play data files
-    path_save = '' # Path to directory where the pitch count data will be saved
-    
-    team_raw_list = os.listdir(path_raw)
 
-    home_dict = {}
-    away_dict = {}
+# Table of the number of terminal events at each count for every key code
+def count_table(key_codes, count_codes, index):
+    totals = np.bincount(key_codes*len(COUNT_LABELS) + count_codes, minlength=len(index)*len(COUNT_LABELS))
+    return pd.DataFrame(totals.reshape(len(index), len(COUNT_LABELS)), index=index, columns=COUNT_LABELS)
 
-    s = np.array(['0','1','2'])
-    b = np.array(['0','1','2','3'])
-    counts = [i+j for j in s for i in b] # Create all pitch counts from combination of balls + strikes
 
+# Number of times each pitch count results in a game action for every team, in one grouped pass over all of the teams' games.
+# team_dict maps each team to its games, from split_home_away or the per-team PbP files, and the frames are not changed.
+# Only the at-bats of the batting side given by homeaway (0 or 1) are counted, and as in team_next_batter,
+# an event followed by the same batter in the same inning is dropped.
+# Returns a DataFrame with a row for each team and a column for each count in COUNT_LABELS.
+@stage(rows=lambda team_dict, homeaway: sum(len(team_games) for team_games in team_dict.values()))
+def terminal_counts(team_dict, homeaway):
+    teams = [team[:3] for team in team_dict]
+    if not any(len(team_games) for team_games in team_dict.values()):
+        return pd.DataFrame(0, index=teams, columns=COUNT_LABELS)
+    games = concat_team_games(team_dict)
+    events, count_codes = terminal_events(games, homeaway)
+    return count_table(games['team'][events], count_codes, teams)
 
-    # Create a dictionary of DataFrames to house the pitch data for each team, separating home and away stats
-    for file in team_raw_list:    
-        home_dict[file[4:7]] = pd.DataFrame()
-        away_dict[file[4:7]] = pd.DataFrame()
 
+# Batting and pitching pitch count tables of every team, from one grouped pass over games parsed with pitchers (see split_home_away).
+# Each team's games hold both sides of every at-bat, so the team's pitching staff faced the other batting side of the same games.
+# homeaway is the side the teams batted on (1 for the home games of split_home_away, 0 for the away games).
+# Returns the batting table (as terminal_counts), the same table of the batters each team's pitchers faced,
+# and the table of every (Team, Pitcher) that faced a batter.
+@stage(rows=lambda team_dict, homeaway: sum(len(team_games) for team_games in team_dict.values()))
+def batting_pitching_counts(team_dict, homeaway):
+    teams = [team[:3] for team in team_dict]
+    if not any(len(team_games) for team_games in team_dict.values()):
+        empty = pd.DataFrame(0, index=teams, columns=COUNT_LABELS)
+        return empty, empty.copy(), empty.iloc[:0].set_index(pd.MultiIndex.from_arrays([[], []], names=['Team','Pitcher']))
+    games = concat_team_games(team_dict, pitchers=True)
+
+    batting_events, batting_codes = terminal_events(games, homeaway)
+    pitching_events, pitching_codes = terminal_events(games, 1-homeaway)
+    batting = count_table(games['team'][batting_events], batting_codes, teams)
+    pitching = count_table(games['team'][pitching_events], pitching_codes, teams)
+
+    # Pitchers are keyed by their team as well, since a traded pitcher pitches for two teams in a season
+    pitcher_codes = games['pitcher'][pitching_events]
+    known = pitcher_codes >= 0
+    pitcher_keys = games['team'][pitching_events][known]*len(games['pitchers']) + pitcher_codes[known]
+    keys, key_codes = np.unique(pitcher_keys, return_inverse=True)
+    pitcher_index = pd.MultiIndex.from_arrays([np.array(teams, dtype=object)[keys//len(games['pitchers'])],
+                                               games['pitchers'][keys % len(games['pitchers'])]], names=['Team','Pitcher'])
+    pitcher_table = count_table(key_codes, pitching_codes[known], pitcher_index)
+    return batting, pitching, pitcher_table.sort_index()
 
-    for file in team_raw_list:
-        # For each team's set of home games, extract the game actions
-        all_games = BatterPbP(file, path_raw)
 
-        # Loop through the different home games
-        for game in all_games.index.levels[0]:
-            home_str = game[:3]
-            away_str = game[-3:]
+# Home and away pitch count tables of a single season of raw PbP files
+def season_terminal_counts(team_raw_list, path_raw):
+    home_dict, away_dict = split_home_away(team_raw_list, path_raw)
+    return terminal_counts(home_dict, 1), terminal_counts(away_dict, 0)
 
-            # Assign game events to either the home team or the away team
-            home_dict[home_str] = pd.concat([home_dict[home_str],
-                                             all_games.groupby(level=0).get_group(game)])
-            away_dict[away_str] = pd.concat([away_dict[away_str],
-                                             all_games.groupby(level=0).get_group(game)])
 
+# Batting and pitching pitch count tables of a single season of raw PbP files, parsing each file once.
+# Returns a dictionary with the Home and Away tables of season_terminal_counts, the Pitching Home and Pitching Away tables
+# of the batters each team's pitchers faced in its home and away games, and the Pitchers Home and Pitchers Away tables
+# of each pitcher (see batting_pitching_counts).
+def season_count_tables(team_raw_list, path_raw):
+    home_dict, away_dict = split_home_away(team_raw_list, path_raw, pitchers=True)
+    tables = {}
+    for team_dict, homeaway, side in [(home_dict, 1, 'Home'), (away_dict, 0, 'Away')]:
+        tables[side], tables['Pitching '+side], tables['Pitchers '+side] = batting_pitching_counts(team_dict, homeaway)
+    return tables
+
+
+# Raw PbP files in a directory, grouped into seasons by their first four characters
+def season_files(path_raw, years=None):
+    seasons = {}
+    for file in sorted(os.listdir(path_raw)):
+        if years is None or file[:4] in [str(year) for year in years]:
+            seasons.setdefault(file[:4], []).append(file)
+    return seasons
+
+
+# Run a function on the files of every season, with workers > 1 (or None for one per CPU) running the seasons in parallel
+def map_seasons(season_func, seasons, path_raw, workers=1):
+    if workers == 1:
+        return [season_func(files, path_raw) for files in seasons.values()]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(season_func, seasons.values(), repeat(path_raw)))
+
+
+# Home and away pitch count tables of every season in a directory of raw PbP files, indexed by (year, team).
+# Files are grouped into seasons by their first four characters.  Each season is aggregated on its own,
+# so with workers > 1 (or None for one per CPU) the seasons are processed in parallel.
+def league_terminal_counts(path_raw, years=None, workers=1):
+    seasons = season_files(path_raw, years)
+    tables = map_seasons(season_terminal_counts, seasons, path_raw, workers)
+    home_df, away_df = [pd.concat([season[i] for season in tables], keys=list(seasons), names=['Year','Team']) for i in range(2)]
+    return home_df, away_df
+
+
+# Batting and pitching pitch count tables of every season in a directory of raw PbP files (see season_count_tables),
+# indexed by (Year, Team), or (Year, Team, Pitcher) for the tables of each pitcher
+def league_count_tables(path_raw, years=None, workers=1):
+    seasons = season_files(path_raw, years)
+    tables = map_seasons(season_count_tables, seasons, path_raw, workers)
+    return {name:pd.concat([season[name] for season in tables], keys=list(seasons), names=['Year','Team','Pitcher'][:tables[0][name].index.nlevels+1])
+            for name in tables[0]}
+
+
+
+
+if __name__ == "__main__":
+    path_raw = '' # Path to directory containing the raw play-by-play data files
+    path_save = '' # Path to directory where the pitch count data will be saved
+    
+    team_raw_list = os.listdir(path_raw)
+
+    # Create a dictionary of DataFrames to house the pitch data for each team, separating home and away stats
+    # For each team's set of home games, extract the game actions and assign them to either the home team or the away team
+    # The pitcher of every game action is kept, so the pitching tables come from the same pass over the files
+    home_dict, away_dict = split_home_away(team_raw_list, path_raw, pitchers=True)
 
-    # Count the team's season total of pitch counts in home and away games
-    home_pitch_count_dict = all_team_count(home_dict,'1')
-    away_pitch_count_dict = all_team_count(away_dict,'0')
 
-    home_team_df = pd.DataFrame.from_dict(home_pitch_count_dict, orient='index', columns=counts)
-    away_team_df = pd.DataFrame.from_dict(away_pitch_count_dict, orient='index', columns=counts)
+    # Count the team's season total of pitch counts in home and away games, at bat and pitching, and for each pitcher
+    home_team_df, home_pitching_df, home_pitchers_df = batting_pitching_counts(home_dict, 1)
+    away_team_df, away_pitching_df, away_pitchers_df = batting_pitching_counts(away_dict, 0)
 
     
     # Save pitch count DataFrames for future use
     home_team_df.to_csv(path_save+'Home')
-    away_team_df.to_csv(path_save+'Away')
\ No newline at end of file
+    away_team_df.to_csv(path_save+'Away')
+    home_pitching_df.to_csv(path_save+'PitchingHome')
+    away_pitching_df.to_csv(path_save+'PitchingAway')
+    home_pitchers_df.to_csv(path_save+'PitchersHome')
+    away_pitchers_df.to_csv(path_save+'PitchersAway')
\ No newline at end of file
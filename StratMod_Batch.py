@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from StratMod_PitchSpecific import *
+
+
+# Convert a swing change DataFrame (as returned by custom_strat_mod) into a 12x8 array in the batch column order
+def swing_change_array(swing_changes):
+    return swing_changes[swing_columns].to_numpy(dtype=float)
+
+
+# Build a stack of swing changes from signed swing percentages for each count, one row of 12 per strategy.
+# Positive values are aggressive modifications and negative values are patient modifications of that size.
+# Counts are in the order of team_class.count_outcomes.index.
+def swing_changes_from_percentages(team_class, swing_percentages):
+    return swing_change_kernel(team_class, np.atleast_2d(swing_percentages))
+
+
+# modify_count_outcomes and contact_to_inplay over a batch of swing changes (shape N x 12 x 8).
+# Returns an N x 12 x 11 array with the columns of contact_to_inplay:
+# Ball, HBP, CStrike, SStrike, FBunt, Foul, Out, Single, Double, Triple, HR
+def batch_count_outcomes(team_class, swing_changes):
+    arrays = strategy_context(team_class).arrays
+
+    change = dict(zip(swing_columns, np.moveaxis(swing_changes, -1, 0)))
+
+    # Assume hitters will not get hit-by-pitch more often, and additional swings are not bunts
+    ball = arrays['B'] - arrays['coH'] + change['X>B'] + change['S>B'] - change['B>X'] - change['B>S']
+    cstrike = arrays['C'] + change['X>C'] + change['S>C'] - change['C>X'] - change['C>S']
+    sstrike = arrays['S'] + change['C>S'] + change['B>S'] - change['S>B'] - change['S>C']
+    contact = arrays['X'] - arrays['coL'] + change['C>X'] + change['B>X'] - change['X>B'] - change['X>C']
+
+    # Split contact into foul and fair territory, and fair territory into outs and hits, with the team's original ratios
+    foul_frac = arrays['coF']/(arrays['coF'] + arrays['coX'])
+    foul = foul_frac*contact
+    inplay = arrays['Inplay']*((1-foul_frac)*contact)[..., np.newaxis]
+
+    pitch_results = np.stack(np.broadcast_arrays(ball, arrays['coH'], cstrike, sstrike, arrays['coL'], foul), axis=-1)
+    return np.concatenate([pitch_results, inplay], axis=-1)
+
+
+# group_pitch_outcomes over a batch, implementing the game rules for how one pitch count moves to another.
+# Returns the number of Ball, Strike, and Self (foul with 2 strikes) transitions, and the outcomes in outcome_labels order.
+def batch_group_outcomes(team_class, count_outcomes):
+    arrays = strategy_context(team_class).arrays
+
+    b = arrays['Counts']//10
+    s = arrays['Counts']%10
+    ball, hbp, cstrike, sstrike, fbunt, foul = np.moveaxis(count_outcomes[..., :6], -1, 0)
+    out, single, double, triple, hr = np.moveaxis(count_outcomes[..., 6:], -1, 0)
+
+    transitions = {'Ball':np.where(b==3, 0, ball),
+                   'Strike':np.where(s==2, 0, cstrike+sstrike+fbunt+foul),
+                   'Self':np.where(s==2, foul, 0)}
+    outcomes = np.stack([np.where(s==2, cstrike+sstrike+fbunt, 0), out, np.where(b==3, ball+hbp, hbp),
+                         single, double, triple, hr], axis=-1)
+    return transitions, outcomes
+
+
+# Solve the absorbing Markov Chain of every strategy in the batch at once, starting each at-bat at 0-0.
+# Returns the probability of each outcome (N x 7) and the expected pitches per plate appearance (N).
+def batch_absorbing_state(team_class, transitions, outcomes):
+    arrays = strategy_context(team_class).arrays
+
+    b = arrays['Counts']//10
+    s = arrays['Counts']%10
+    state = 3*b+s
+    num_counts = len(state)
+
+    totals = transitions['Ball'] + transitions['Strike'] + transitions['Self'] + outcomes.sum(axis=-1)
+
+    # Transient block of the column stochastic matrix, Q[to, from]
+    Q = np.zeros(totals.shape[:-1] + (num_counts, num_counts))
+    Q[..., state, state] = transitions['Self']/totals
+    Q[..., state[s<2]+1, state[s<2]] = (transitions['Strike']/totals)[..., s<2]
+    Q[..., state[b<3]+3, state[b<3]] = (transitions['Ball']/totals)[..., b<3]
+
+    start_vector = np.zeros(num_counts)
+    start_vector[0] = 1
+    visits = np.linalg.solve(np.identity(num_counts) - Q, np.broadcast_to(start_vector, Q.shape[:-1])[..., np.newaxis])[..., 0]
+
+    outcome_prob = np.einsum('...c,...ck->...k', visits[..., state], outcomes/totals[..., np.newaxis])
+    return outcome_prob, visits.sum(axis=-1)
+
+
+# Evaluate a stack of strategies for a team (or its StrategyContext) in one call.
+# swing_changes is an N x 12 x 8 array of swing changes (columns in swing_columns order, counts in count_outcomes order),
+# or use swing_changes_from_percentages to build it from signed swing percentages at each count.
+# Returns the predicted number of each outcome in outcome_labels order (N x 7), the same as strategy_mod with exact=True,
+# and the expected pitches per plate appearance of each strategy when pitches=True.
+@stage()
+def strategy_sweep(team_class, swing_changes, pitches=False):
+    team_class = strategy_context(team_class)
+
+    count_outcomes = batch_count_outcomes(team_class, np.asarray(swing_changes, dtype=float))
+    transitions, outcomes = batch_group_outcomes(team_class, count_outcomes)
+    outcome_prob, pitches_per_pa = batch_absorbing_state(team_class, transitions, outcomes)
+
+    if pitches:
+        return outcome_prob*team_class.total_ab, pitches_per_pa
+    return outcome_prob*team_class.total_ab
@@ -2,8 +2,12 @@ import numpy as np
 import pandas as pd
 from TeamData import *
 
+# Every function taking team_class accepts either a Team or the StrategyContext from Team.strategy_context().
+# The context holds the per-team values used below, so they are only computed once for each team.
+
 # Given a team's change in strategy, modify the number of outcomes for each pitch in different counts.
 def modify_count_outcomes(team_class, swing_changes): 
+    team_class = strategy_context(team_class)
     pitch_counts = team_class.plate_disc
     mod_count_outcomes = pitch_counts[['B','C','S','X']].copy()
     
@@ -24,23 +28,19 @@ def modify_count_outcomes(team_class, swing_changes):
 # Distinguish between different types of contact made; Fair vs Foul terrirory, out vs hit.
 # Given a modified strategy, we assume the ratio of these events remains the same as the unmodified strategy.
 def contact_to_inplay(team_class, mod_count_outcomes):
-    old_count_outcomes = team_class.count_outcomes
+    team_class = strategy_context(team_class)
     
     # Split contact made on the pitch into foul or fair territory using team data for each count
     # The remaining column of fair territory is labelled 'X' to split again
     pitch_contact_result = pd.concat([mod_count_outcomes.drop(columns=['X']),
-                                      old_count_outcomes[['F','X']].div(old_count_outcomes[['F','X']].sum(axis=1),axis=0)*np.array([mod_count_outcomes['X'].values]).T],
+                                      team_class.contact_split*np.array([mod_count_outcomes['X'].values]).T],
                                      axis=1)
     pitch_contact_result = pitch_contact_result[['B','H','C','S','L','F','X']]
     pitch_contact_result.columns = ['Ball','HBP','CStrike','SStrike','FBunt', 'Foul','X']
     
     # Split the remaining pitches hit into play into their respective outcomes (Out, Single, Double, Triple, HR)
-    inplay_outcomes = team_class.outcomes.groupby('Count')['Outcome'].value_counts().unstack().fillna(0)[['O','S','D','T','R']]
-    inplay_outcomes.set_index(old_count_outcomes.index,inplace=True)
-    inplay_outcomes.columns = ['Out','Single','Double','Triple','HR']
-    
     return pd.concat([pitch_contact_result.drop(columns=['X']),
-                    inplay_outcomes.div(inplay_outcomes.sum(axis=1),axis=0)*np.array([pitch_contact_result['X'].values]).T],
+                    team_class.inplay_frac*np.array([pitch_contact_result['X'].values]).T],
                     axis=1)
 
 
@@ -61,37 +61,46 @@ def group_pitch_outcomes(count_outcomes):
     return grouped_outcomes
 
 
-# Creates a stochastic matrix describing the transitions between different pitch counts and outcomes from a single pitch
-def transformation_matrix(grouped_outcomes):
-    outcome_labels = ['Strikeout','Out','Walk','Single','Double','Triple','HR']
-    count_labels = grouped_outcomes.index.tolist()
-    all_labels = count_labels+outcome_labels
-    transition_matrix = pd.DataFrame(index=all_labels, columns=all_labels)
+# Labels of the absorbing states of the Markov Chain, the possible outcomes of an at-bat
+outcome_labels = ['Strikeout','Out','Walk','Single','Double','Triple','HR']
+
+
+# Number of times each count moves to another count or ends the at-bat, as a plain numpy array (rows: from, columns: to)
+# Counts are in the order of grouped_outcomes.index, where the count (b,s) is in position 3*b+s
+def transition_counts(grouped_outcomes):
+    num_counts = len(grouped_outcomes.index)
+    count_ints = grouped_outcomes.index.astype(int).to_numpy()
+    b = count_ints//10
+    s = count_ints%10
+    state = 3*b+s
     
     # For each count (b,s), determine the number of times the count moves to (b,s), (b+1,s), and (b,s+1)
-    for count in count_labels:
-        b = int(count)//10
-        s = int(count)%10
-        transition_matrix.loc[count,count] = grouped_outcomes.loc[count,'Self']
-        if s<2:
-            transition_matrix.iloc[3*b+s, 3*b+s+1] = grouped_outcomes.loc[count,'Strike']
-        if b<3:
-            transition_matrix.iloc[3*b+s, 3*(b+1)+s] = grouped_outcomes.loc[count,'Ball']
-            
+    transitions = np.zeros((num_counts+len(outcome_labels), num_counts+len(outcome_labels)))
+    transitions[state, state] = grouped_outcomes['Self'].to_numpy()
+    transitions[state[s<2], state[s<2]+1] = grouped_outcomes['Strike'].to_numpy()[s<2]
+    transitions[state[b<3], state[b<3]+3] = grouped_outcomes['Ball'].to_numpy()[b<3]
+    
     # Determine the number of times an at-bat ends with some outcome at each count
-    for end_outcome in outcome_labels:
-        transition_matrix[end_outcome] = grouped_outcomes[end_outcome]    
-    transition_matrix.fillna(0,inplace=True)
-    
-    # Convert number of events at a particular count into percent chances to produce Markov Chain
-    # When the at-bat ends, it cannot be started back up, so the outcomes of at-bats have extra conditions
-    MC = transition_matrix.div(transition_matrix.sum(axis=1),axis=0).T
-    for end_outcome in outcome_labels:
-        MC.loc[:,end_outcome] = 0
-        MC.loc[end_outcome, end_outcome] = 1
+    transitions[state, num_counts:] = grouped_outcomes[outcome_labels].to_numpy()
+    return transitions
+
+
+# Convert the number of events at each count into a column stochastic matrix, so the next state is given by MC.dot(v)
+# When the at-bat ends, it cannot be started back up, so the outcomes of at-bats are absorbing states
+def markov_array(transitions, num_outcomes=len(outcome_labels)):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        MC = (transitions/transitions.sum(axis=1, keepdims=True)).T
+    MC[:, -num_outcomes:] = 0
+    MC[-num_outcomes:, -num_outcomes:] = np.identity(num_outcomes)
     return MC
 
 
+# Creates a stochastic matrix describing the transitions between different pitch counts and outcomes from a single pitch
+def transformation_matrix(grouped_outcomes):
+    all_labels = grouped_outcomes.index.tolist()+outcome_labels
+    return pd.DataFrame(markov_array(transition_counts(grouped_outcomes)), index=all_labels, columns=all_labels)
+
+
 # Approximate the steady state solution by sucessive application of the transition matrix
 def steady_state(transition_matrix, initial_vector, iterations):
     v0 = initial_vector
@@ -100,15 +109,49 @@ def steady_state(transition_matrix, initial_vector, iterations):
     return v0
 
 
-# Modify a team's hitting strategy using the above functions.
-# The function will return the average steady state outcomes of the team's total at-bats.
-def strategy_mod(team_class, swing_changes):
+# Exact solution of the absorbing Markov Chain for an at-bat starting in the given state (0-0 count by default)
+# With the transient block Q and absorbing block R, the expected number of visits to each count is (I-Q)^-1 e_start.
+# Every visit to a count is one pitch, so their sum is the expected number of pitches per plate appearance,
+# and R (I-Q)^-1 e_start gives the probability of each outcome without truncating long at-bats.
+def absorbing_state(transition_matrix, start=0, num_outcomes=len(outcome_labels)):
+    MC = np.asarray(transition_matrix, dtype=float)
+    num_counts = len(MC) - num_outcomes
+    
+    start_vector = np.zeros(num_counts)
+    start_vector[start] = 1
+    visits = np.linalg.solve(np.identity(num_counts) - MC[:num_counts, :num_counts], start_vector)
+    
+    return MC[num_counts:, :num_counts].dot(visits), visits.sum()
+
+
+# Markov Chain of a team's plate appearances under a modified strategy
+def strategy_markov_chain(team_class, swing_changes):
     # Update number of pitch outcomes for the strategy, and split contact outcomes into fouls, outs, and the different hits
     mod_count_outcomes = modify_count_outcomes(team_class, swing_changes)
     
     # Add game logic and contrust stochastic matrix for transitions
     grouped_outcomes = group_pitch_outcomes(mod_count_outcomes)
-    markov_chain = transformation_matrix(grouped_outcomes)
+    return transformation_matrix(grouped_outcomes)
+
+
+# Modify a team's hitting strategy using the above functions.
+# The function will return the average steady state outcomes of the team's total at-bats.
+# With exact=True the Markov Chain is solved exactly instead (see absorbing_state), and the expected number of pitches
+# per plate appearance from the same solve is kept in the attrs of the result as 'pitches_per_pa'.
+@stage()
+def strategy_mod(team_class, swing_changes, exact=False):
+    team_class = strategy_context(team_class)
+    markov_chain = strategy_markov_chain(team_class, swing_changes)
+    
+    # The resulting vector V represents the probability of each outcome,
+    # We multiply by the total number of at-bats in the season to get the predicted number of each outcome
+    total_ab = team_class.total_ab
+    
+    if exact:
+        outcome_prob, pitches_per_pa = absorbing_state(markov_chain)
+        outcomes = pd.Series(outcome_prob, index=markov_chain.index[12:])*total_ab
+        outcomes.attrs['pitches_per_pa'] = pitches_per_pa
+        return outcomes
     
     # All at-bats start at the 0-0 count
     initial_vector = np.zeros(len(markov_chain.index))
@@ -117,12 +160,15 @@ def strategy_mod(team_class, swing_changes):
     # While there is non-zero probability that the at-bat continues, it's effect will be negligible at this point.
     outcomes_ss = steady_state(markov_chain, initial_vector, 25)
 
-    # The resulting vector V represents the probability of each outcome,
-    # We multiply by the total number of at-bats in the season to get the predicted number of each outcome
-    total_ab = team_class.outcomes['Outcome'].value_counts().sum()
     return outcomes_ss[markov_chain.index[12:]]*total_ab
 
 
+# Expected number of pitches per plate appearance under a modified strategy, from the exact solution of its Markov Chain.
+# When the predicted outcomes are needed as well, use the attrs of strategy_mod(exact=True) rather than solving again.
+def expected_pitches(team_class, swing_changes):
+    return strategy_mod(team_class, swing_changes, exact=True).attrs['pitches_per_pa']
+
+
 # Apply an aggressive modification to hitting strategy
 # Returns the number of pitches that change from balls and called strikes to swinging strikes and contact
 def aggressive_modification(pitch_ZO_sep, count_outcomes, swing_per):
@@ -198,27 +244,66 @@ def patient_modification(pitch_ZO_sep, count_outcomes, swing_per):
     return swing_changes
 
 
+# Swing changes for a signed swing percentage at every count, with the saturation rules of
+# aggressive_modification (positive percentages) and patient_modification (negative percentages) applied to all counts at once.
+# swing_percentages has 12 values in count_outcomes order, or any stack of them (... x 12).
+# Returns the swing changes (... x 12 x 8) with the columns in swing_columns order.
+swing_columns = ['B>X','C>X','B>S','C>S','X>B','X>C','S>B','S>C']
+
+def swing_change_kernel(team_class, swing_percentages):
+    arrays = strategy_context(team_class).arrays
+    per = np.asarray(swing_percentages, dtype=float)
+    B, C, H, L, total = arrays['B'], arrays['C'], arrays['coH'], arrays['coL'], arrays['Total']
+    contact_o, contact_z = arrays['O-Contact%'][0], arrays['Z-Contact%'][0]
+    fill_nan = lambda values: np.where(np.isnan(values), 0, values)
+    nan_sum = lambda *cols: sum(fill_nan(col) for col in cols) # Row sums of a DataFrame skip missing values
+    
+    # Aggressive: balls and called strikes that will be swung at, split with the conditional swing probabilities
+    swing_frac = nan_sum(arrays['S'], arrays['X'])/total
+    extra_b = (1-arrays['Zone%'])/swing_frac*arrays['O-Swing%']*np.maximum(per, 0)*total
+    extra_c = arrays['Zone%']/swing_frac*arrays['Z-Swing%']*np.maximum(per, 0)*total
+    
+    # Take leftover swings from the other type of pitch, the same sequence of limits as aggressive_modification
+    extra_c = np.where((extra_b > B) & (extra_c > C), C, extra_c)
+    extra_b = np.where((extra_b > B) & (extra_c > C), B-H, extra_b)
+    over_b = extra_b > B+H
+    extra_c = np.where(over_b, np.minimum(C, extra_c+extra_b-B+H), extra_c)
+    extra_b = np.where(over_b, B-H, extra_b)
+    over_c = extra_c > C
+    extra_b = np.where(over_c, np.minimum(B-H, extra_b+extra_c-C), extra_b)
+    extra_c = np.where(over_c, C, extra_c)
+    
+    # Patient: swings removed at the ratio of balls to called strikes, limited by the swings available
+    removed_b = B/nan_sum(B, C)*np.maximum(-per, 0)*total
+    removed_c = C/nan_sum(B, C)*np.maximum(-per, 0)*total
+    x_b, x_c = fill_nan(removed_b*contact_o), fill_nan(removed_c*contact_z)
+    s_b, s_c = fill_nan(removed_b*(1-contact_o)), fill_nan(removed_c*(1-contact_z))
+    
+    over_all = nan_sum(removed_b, removed_c) > nan_sum(arrays['X'], arrays['S'])+L
+    x_b, x_c = np.where(over_all, arrays['XO'], x_b), np.where(over_all, arrays['XZ']-L, x_c)
+    s_b, s_c = np.where(over_all, arrays['SO'], s_b), np.where(over_all, arrays['SZ'], s_c)
+    x_b = np.where(x_b+s_b > nan_sum(arrays['SO'], arrays['XO']), arrays['XO'], x_b)
+    s_b = np.where(x_b+s_b > nan_sum(arrays['SO'], arrays['XO']), arrays['SO'], s_b)
+    x_c = np.where(x_c+s_c > nan_sum(arrays['SZ'], arrays['XZ'])+L, arrays['XZ']-L, x_c)
+    s_c = np.where(x_c+s_c > nan_sum(arrays['SZ'], arrays['XZ'])+L, arrays['SZ'], s_c)
+    
+    aggressive = [extra_b*contact_o, extra_c*contact_z, extra_b*(1-contact_o), extra_c*(1-contact_z)]
+    aggressive = [fill_nan(change) for change in np.broadcast_arrays(*aggressive)] + [np.zeros(per.shape)]*4
+    patient = [np.zeros(per.shape)]*4 + [x_b, x_c, s_b, s_c]
+    return np.where(per[..., np.newaxis] < 0, np.stack(np.broadcast_arrays(*patient), axis=-1), np.stack(aggressive, axis=-1))
+
+
 # Combines multiple different strategy modifications into a single pitch/swing change DataFrame
+# The aggressive and patient percentages of each count are combined into one signed vector for swing_change_kernel
 def custom_strat_mod(team_class, pva_dict):
+    team_class = strategy_context(team_class)
+    
     # Full list of counts
     counts_str = team_class.count_outcomes.index.to_list()
     
     # Which counts will have aggressive or patient adjustments, and how much
-    aggro_counts = list(pva_dict['Aggressive'].keys())
-    aggro_percent_changes = list(pva_dict['Aggressive'].values())
-    patient_counts = list(pva_dict['Patient'].keys())
-    patient_percent_changes = list(pva_dict['Patient'].values())
-    
-    # For the list of counts where there will be no changes, set all changes in swings to zero.    
-    no_change_index = np.setdiff1d(counts_str, aggro_counts + patient_counts)
-    full_swing_changes = aggressive_modification(team_class.plate_disc, team_class.count_outcomes, 0).loc[no_change_index]
-
-    # Find pitch/swing adjustments for all aggressive modified counts
-    if len(aggro_counts)!= 0:
-        full_swing_changes = pd.concat([full_swing_changes, aggressive_modification(team_class.plate_disc.loc[aggro_counts], team_class.count_outcomes.loc[aggro_counts], aggro_percent_changes)])
-        
-    # Find pitch/swing adjustments for all patient modified counts
-    if len(patient_counts)!= 0:
-        full_swing_changes = pd.concat([full_swing_changes, patient_modification(team_class.plate_disc.loc[patient_counts], team_class.count_outcomes.loc[patient_counts], patient_percent_changes)])
-    
-    return full_swing_changes.sort_index()
\ No newline at end of file
+    swing_percentages = pd.Series(0.0, index=counts_str)
+    swing_percentages[list(pva_dict['Aggressive'].keys())] = list(pva_dict['Aggressive'].values())
+    swing_percentages[list(pva_dict['Patient'].keys())] = -np.array(list(pva_dict['Patient'].values()), dtype=float)
+    
+    return pd.DataFrame(swing_change_kernel(team_class, swing_percentages.to_numpy()), index=team_class.count_outcomes.index, columns=swing_columns)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from StratMod_Batch import *
+
+
+# Value of each outcome (in outcome_labels order) for a linear win model fit on K, O, W, S, D, T, R, and RA,
+# such as the LinearRegression of RA x W% in the AtBatOutcomes notebook.
+# With runs against held fixed, the change in wins over a number of games is weights.dot(change in outcomes).
+def win_weights(regr, runs_against, games=81):
+    return np.asarray(regr.coef_, dtype=float)[:len(outcome_labels)]/runs_against*games
+
+
+# Signed swing percentages beyond which swing_change_kernel saturates at each count.
+# Aggressive changes stop once every ball (except HBP) and called strike is swung at,
+# and patient changes stop once every swing (including foul bunts) is taken.
+# Counts that cannot be modified have both bounds set to zero.
+def saturation_bounds(team_class):
+    arrays = strategy_context(team_class).arrays
+    fill_nan = lambda values: np.where(np.isnan(values), 0, values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        swing_frac = (fill_nan(arrays['S']) + fill_nan(arrays['X']))/arrays['Total']
+        swing_prob = ((1-arrays['Zone%'])*arrays['O-Swing%'] + arrays['Zone%']*arrays['Z-Swing%'])/swing_frac
+        upper = (arrays['B'] - arrays['coH'] + arrays['C'])/(arrays['Total']*swing_prob)
+        lower = -(fill_nan(arrays['X']) + fill_nan(arrays['S']) + arrays['coL'])/arrays['Total']
+    valid = lambda bound: np.isfinite(bound) & (arrays['Total'] > 0)
+    return np.where(valid(lower), np.minimum(lower, 0), 0), np.where(valid(upper), np.maximum(upper, 0), 0)
+
+
+# Value of a stack of signed swing percentages (N x 12), the predicted outcomes weighted by weights
+def strategy_values(team_class, swing_percentages, weights):
+    return strategy_sweep(team_class, swing_change_kernel(team_class, swing_percentages)).dot(weights)
+
+
+# Find the signed swing percentages at every count that maximize weights.dot(predicted outcomes) by coordinate ascent.
+# Each sweep evaluates a grid of values around the current strategy for every count in a single strategy_sweep call,
+# and moves the one count giving the largest improvement.  Counts with no improvement have their search radius shrunk,
+# and are pruned once the radius is smaller than min_step, while the count that moved has its radius doubled again.
+# Once every count is pruned, the search restarts at the full radius from where it ended, until a restart finds no improvement.
+# The search is bounded by the saturation limits of each count.
+# start warm-starts the search, such as from the previous season's optimum.  It first searches near the start,
+# and the restarts at the full radius keep it from settling for a worse optimum than a cold start.
+# Returns the best strategy (indexed by count), its improvement over the unmodified strategy, and the number of strategies evaluated.
+def optimize_strategy(team_class, weights, start=None, grid=9, min_step=1e-3, max_sweeps=200, tol=1e-9):
+    team_class = strategy_context(team_class)
+    weights = np.asarray(weights, dtype=float)
+    lower, upper = saturation_bounds(team_class)
+    num_counts = len(lower)
+
+    current = np.zeros(num_counts) if start is None else np.clip(np.asarray(start, dtype=float), lower, upper)
+    base_value, value = strategy_values(team_class, np.stack([np.zeros(num_counts), current]), weights)
+    evaluations = 2
+
+    # A warm start only searches near the starting strategy at first, and is always followed by a restart at the full radius
+    full_step = (upper - lower)/2
+    step = full_step/(1 if start is None else 4)
+    moved = start is not None
+    offsets = np.linspace(-1, 1, grid)
+    for _ in range(max_sweeps):
+        active = np.flatnonzero(step >= min_step)
+        if len(active) == 0:
+            if not moved:
+                break
+            step, moved = full_step.copy(), False
+            continue
+
+        # One candidate per grid point for every active count, changing only that count
+        candidates = np.repeat(current[np.newaxis], len(active)*grid, axis=0)
+        changed = np.repeat(active, grid)
+        candidates[np.arange(len(candidates)), changed] = np.clip(current[changed] + np.tile(offsets, len(active))*step[changed],
+                                                                  lower[changed], upper[changed])
+        values = strategy_values(team_class, candidates, weights).reshape(len(active), grid)
+        values[np.isnan(values)] = -np.inf
+        evaluations += len(candidates)
+
+        improvement = values.max(axis=1) - value
+        step[active[improvement <= tol]] /= 2
+        if improvement.max() > tol:
+            best = np.argmax(improvement)
+            current = candidates[best*grid + np.argmax(values[best])]
+            value = values[best].max()
+            step[active[best]] = min(2*step[active[best]], full_step[active[best]])
+            moved = True
+
+    strategy = pd.Series(current, index=team_class.count_outcomes.index)
+    return strategy, value - base_value, evaluations
+
+
+# Optimize every team-season, warm-starting each from the optimum of the same team's previous season.
+# weights is an array of outcome values, or a function returning the array for a team.
+# Returns a DataFrame with the strategy at every count, the improvement, and the strategies evaluated for each team-season.
+def optimize_seasons(teams, weights, report=False, **kwargs):
+    previous = {}
+    results = {}
+    for team_class in sorted(teams, key=lambda team_class: int(team_class.year)):
+        team_weights = weights(team_class) if callable(weights) else weights
+        key = (team_class.team, team_class.homeaway)
+        strategy, improvement, evaluations = optimize_strategy(team_class, team_weights, start=previous.get(key), **kwargs)
+        previous[key] = strategy.to_numpy()
+
+        results[(team_class.year, team_class.team, team_class.homeaway)] = pd.concat([strategy, pd.Series({'Improvement':improvement, 'Evaluations':evaluations})])
+        if report:
+            print('{} {} {}: improvement {:.3f} with {} evaluations'.format(team_class.year, team_class.team, ['Away','Home'][team_class.homeaway],
+                                                                        improvement, evaluations))
+    return pd.DataFrame(results).T.rename_axis(['Year','Team','HomeAway'])
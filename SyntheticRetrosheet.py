@@ -0,0 +1,192 @@
+import random
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+
+# Retrosheet team IDs used for the 2000-2009 seasons, matching the files in the Heatmaps folder
+TEAMS = ['ANA','ARI','ATL','BAL','BOS','CHA','CHN','CIN','CLE','COL','DET','FLO','HOU','KCA','LAN',
+         'MIL','MIN','MON','NYA','NYN','OAK','PHI','PIT','SDN','SEA','SFN','SLN','TBA','TEX','TOR']
+
+# Pitch codes and their relative frequency during an at-bat.
+# (B)all, (C)alled strike, (S)winging strike, (F)oul, ball in play (X), hit-by-pitch (H), and foul bunt (L)
+PITCH_CODES = 'BCSFXHL'
+PITCH_WEIGHTS = [0.36, 0.17, 0.10, 0.17, 0.185, 0.005, 0.01]
+
+# Events for balls put into play, with their relative frequency
+INPLAY_EVENTS = ['63/G','43/G','53/G','8/F','9/F','7/F','6/P','4/L','S7/G','S8/L','S9/F','D7/L','D9/F','T8/F','HR/F','E6/G']
+INPLAY_WEIGHTS = [10, 9, 6, 8, 8, 7, 4, 3, 6, 6, 4, 2, 2, 0.3, 1.2, 0.8]
+
+# Sacrifice flies and bunts, only possible with a runner on base
+SACRIFICE_EVENTS = ['8/SF.3-H', '9/SF.3-H', '23/SH.1-2', '15/SH.1-2']
+SACRIFICE_WEIGHTS = [1, 1, 1, 0.5]
+
+# Events not involving the batter that happen between pitches with a runner on base: stolen bases, caught stealing, and pickoffs.
+# The batter's plate appearance continues on the next 'play' line, unless the out ends the inning.
+# Pickoff throws are recorded in the pitch string by the base thrown to, and other events by '.'
+RUNNER_EVENTS = ['SB2', 'SB3', 'CS2(24)', 'CS3(25)', 'PO1(13)', 'PO2(26)']
+RUNNER_WEIGHTS = [4, 1, 2, 0.5, 1, 0.5]
+RUNNER_MARKS = ['.', '.', '.', '.', '1', '2']
+
+# Chance of each edge case: a runner event before a pitch with a runner on base, a sacrifice instead of a ball in play
+# with a runner on base, and a pinch hitter replacing the batter before the plate appearance (an 'NP' play and a 'sub' line)
+RUNNER_RATE = 0.015
+SACRIFICE_RATE = 0.08
+PINCH_HIT_RATE = 0.01
+
+# Chance of a pitching change before each half inning from RELIEF_INNING on, with relievers drawn from a bullpen of BULLPEN pitchers.
+# A pitcher who was pinch hit for is always replaced.  Relievers take the pitcher's spot in the batting order.
+RELIEF_RATE = 0.3
+RELIEF_INNING = 6
+BULLPEN = 7
+
+
+# Player IDs are 8 characters long, similar to Retrosheet's 'lastf001' format
+def player_id(team, year, slot):
+    return '{}{:02d}{:03d}'.format(team.lower(), int(year)%100, slot)
+
+
+# Simulate the pitches of a single plate appearance
+# Returns the pitch string, the pitch count before the final pitch, and the at-bat event.
+# With a runner on base (and edge_cases), runner events may interrupt the plate appearance.  These are returned as
+# (count, pitches so far, event) in the order they happened, and the final pitch string includes them.
+# If an out on the bases ends the inning (outs is the number of outs before the plate appearance),
+# the plate appearance stops there and its event is None.
+def plate_appearance(rng, runner_on=False, outs=0, edge_cases=True):
+    balls, strikes = 0, 0
+    pitches = ''
+    runner_plays = []
+    while True:
+        count = str(balls) + str(strikes)
+        if edge_cases and runner_on and rng.random() < RUNNER_RATE:
+            runner_event = rng.choices(range(len(RUNNER_EVENTS)), RUNNER_WEIGHTS)[0]
+            pitches += RUNNER_MARKS[runner_event]
+            runner_plays.append((count, pitches, RUNNER_EVENTS[runner_event]))
+            if RUNNER_EVENTS[runner_event][:2] in ['CS', 'PO']:
+                runner_on = False
+                outs += 1
+                if outs == 3:
+                    return pitches, count, None, runner_plays
+        pitch = rng.choices(PITCH_CODES, PITCH_WEIGHTS)[0]
+        pitches += pitch
+        if pitch == 'B':
+            balls += 1
+            if balls == 4:
+                return pitches, count, 'W', runner_plays
+        elif pitch == 'F':
+            strikes = min(strikes + 1, 2)
+        elif pitch in 'CSL':
+            strikes += 1
+            if strikes == 3:
+                return pitches, count, 'K', runner_plays
+        elif pitch == 'H':
+            return pitches, count, 'HP', runner_plays
+        elif edge_cases and runner_on and outs < 2 and rng.random() < SACRIFICE_RATE:
+            return pitches, count, rng.choices(SACRIFICE_EVENTS, SACRIFICE_WEIGHTS)[0], runner_plays
+        else:
+            return pitches, count, rng.choices(INPLAY_EVENTS, INPLAY_WEIGHTS)[0], runner_plays
+
+
+# Simulate a half inning, returning the 'play' and 'sub' lines and the next spot in the batting order.
+# Pinch hitters replace the batter in lineup, and bat in that spot for the rest of the game.
+def half_inning(rng, inning, homeaway, lineup, order_spot, edge_cases=True):
+    lines = []
+    outs = 0
+    runner_on = False
+    while outs < 3:
+        if edge_cases and rng.random() < PINCH_HIT_RATE:
+            lines.append('play,{},{},{},00,,NP'.format(inning, homeaway, lineup[order_spot]))
+            lineup[order_spot] = lineup[order_spot][:-3] + '{:03d}'.format(int(lineup[order_spot][-3:]) + 10)
+            lines.append('sub,{},"{}",{},{},11'.format(lineup[order_spot], lineup[order_spot], homeaway, order_spot+1))
+
+        pitches, count, event, runner_plays = plate_appearance(rng, runner_on, outs, edge_cases)
+        for runner_count, runner_pitches, runner_event in runner_plays:
+            lines.append('play,{},{},{},{},{},{}'.format(inning, homeaway, lineup[order_spot], runner_count, runner_pitches, runner_event))
+            if runner_event[:2] in ['CS', 'PO']:
+                runner_on = False
+                outs += 1
+        if event is None:
+            break # The batter leads off the next inning
+
+        lines.append('play,{},{},{},{},{},{}'.format(inning, homeaway, lineup[order_spot], count, pitches, event))
+        if event == 'K' or event[0].isdigit():
+            outs += 1
+        if event[:2] == 'HR':
+            runner_on = False
+        elif not (event == 'K' or event[0].isdigit()) or event in SACRIFICE_EVENTS:
+            runner_on = True
+        order_spot = (order_spot + 1) % 9
+    return lines, order_spot
+
+
+# Create all lines for a single game in Retrosheet event file format
+def game_lines(rng, home, away, year, month, day, innings=9, edge_cases=True):
+    lines = ['id,{}{}{:02d}{:02d}0'.format(home, year, month, day),
+             'version,2',
+             'info,visteam,' + away,
+             'info,hometeam,' + home,
+             'info,date,{}/{:02d}/{:02d}'.format(year, month, day),
+             'info,number,0']
+
+    lineups = {}
+    for homeaway, team in enumerate([away, home]):
+        lineups[homeaway] = [player_id(team, year, slot) for slot in range(1, 10)]
+        for slot, player in enumerate(lineups[homeaway]):
+            lines.append('start,{},"{}",{},{},{}'.format(player, player, homeaway, slot+1, slot+1))
+
+    order_spot = {0:0, 1:0}
+    pitchers = {homeaway:lineups[homeaway][0] for homeaway in [0, 1]} # The starters bat first in the lineups
+    for inning in range(1, innings+1):
+        for homeaway in [0, 1]:
+            fielding = 1 - homeaway
+            if edge_cases and (lineups[fielding][0] != pitchers[fielding] or (inning >= RELIEF_INNING and rng.random() < RELIEF_RATE)):
+                bullpen = [player_id([away, home][fielding], year, 100+slot) for slot in range(1, BULLPEN+1)]
+                reliever = rng.choice([pitcher for pitcher in bullpen if pitcher != pitchers[fielding]])
+                lines.append('sub,{},"{}",{},1,1'.format(reliever, reliever, fielding))
+                lineups[fielding][0] = pitchers[fielding] = reliever
+
+            plays, order_spot[homeaway] = half_inning(rng, inning, homeaway, lineups[homeaway], order_spot[homeaway], edge_cases)
+            lines.extend(plays)
+
+    lines.append('data,er,{},0'.format(lineups[1][0]))
+    return lines
+
+
+# Write a deterministic event file with a home team's games over one or more seasons
+# Each season cycles through the other teams as the visiting team
+# With edge_cases=False, only plain plate appearances are written (no runner events, sacrifices, pinch hitters, or relievers)
+def write_event_file(filename, path, home, years, games=81, seed=0, edge_cases=True, teams=TEAMS):
+    rng = random.Random('{}{}{}'.format(seed, home, years[0]))
+    opponents = [team for team in teams if team != home]
+
+    with open(path + filename, 'w') as event_file:
+        for year in years:
+            for game in range(games):
+                month, day = 4 + game//30, 1 + game%30
+                lines = game_lines(rng, home, opponents[game%len(opponents)], year, month, day, edge_cases=edge_cases)
+                event_file.write('\n'.join(lines) + '\n')
+
+    return filename
+
+
+# Write the event files of whole league-seasons, one file per home team and season (named YYYYTEAM.EVA as in Retrosheet).
+# Every file is seeded by its team and season, so a season's files are the same however many seasons are written,
+# and files already written are kept.  With workers > 1 the files are written in parallel.
+# Returns the file names in season order.
+def write_league(path, years, teams=TEAMS, games=81, seed=0, edge_cases=True, workers=1, overwrite=False):
+    files = [(str(year)+team+'.EVA', team, [year]) for year in years for team in teams]
+    missing = [file for file in files if overwrite or not os.path.exists(path + file[0])]
+    args = [[file[i] for file in missing] for i in range(3)]
+    args = [args[0], repeat(path), args[1], args[2], repeat(games), repeat(seed), repeat(edge_cases), repeat(teams)]
+    if workers == 1:
+        list(map(write_event_file, *args))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(write_event_file, *args, chunksize=len(teams)))
+    return [file[0] for file in files]
+
+
+if __name__ == "__main__":
+    path_save = '' # Path to directory where the synthetic event files will be saved
+
+    write_league(path_save, [2007])
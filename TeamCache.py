@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import zipfile
+
+
+# Hash of a source file's contents, used to tell whether a cached result is out of date
+def file_hash(filename, block_size=1<<20):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# Convert a column into a typed numpy array.
+# Object columns holding strings are stored as fixed width unicode arrays, with a mask for any missing values.
+def column_arrays(values):
+    values = np.asarray(values)
+    if values.dtype != object:
+        return values, None
+    null = pd.isna(values)
+    strings = np.where(null, '', values).astype(str)
+    return strings, (null if null.any() else None)
+
+
+# Inverse of column_arrays, giving back an object array of strings with NaN for missing values
+def array_column(strings, null):
+    if strings.dtype.kind != 'U':
+        return strings
+    values = strings.astype(object)
+    if null is not None:
+        values[null] = np.nan
+    return values
+
+
+# Save a dictionary of DataFrames into a single .npz file, as typed arrays.
+# Numeric columns of the same type are stored together as one 2D block, and every other column and index level as its own array,
+# so a file holds few arrays to read back.  A default RangeIndex is not stored.
+# meta holds any extra JSON serializable information, such as the hash of the file the frames were built from.
+# The file is written next to filename and then renamed over it, so an interrupted save never leaves a truncated file behind.
+def save_frames(filename, frames, meta=None):
+    arrays = {}
+    layout = {}
+    for name, df in frames.items():
+        blocks = {}
+        for i in range(df.shape[1]):
+            values, null = column_arrays(df.iloc[:, i].to_numpy())
+            if values.dtype.kind in 'biuf':
+                blocks.setdefault(values.dtype.str, []).append((i, values))
+                continue
+            arrays['{}_c{}'.format(name, i)] = values
+            if null is not None:
+                arrays['{}_c{}_null'.format(name, i)] = null
+        for k, block in enumerate(blocks.values()):
+            arrays['{}_b{}'.format(name, k)] = np.column_stack([values for _, values in block])
+
+        range_index = isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+        if not range_index:
+            for i in range(df.index.nlevels):
+                values, null = column_arrays(df.index.get_level_values(i).to_numpy())
+                arrays['{}_i{}'.format(name, i)] = values
+                if null is not None:
+                    arrays['{}_i{}_null'.format(name, i)] = null
+        layout[name] = {'columns':df.columns.tolist(), 'columns_name':df.columns.name, 'blocks':[[i for i, _ in block] for block in blocks.values()],
+                        'index_names':list(df.index.names), 'range_index':range_index, 'rows':len(df), 'empty':(df.shape == (0, 0))}
+
+    arrays['meta'] = np.array(json.dumps({'frames':layout, 'meta':meta or {}}))
+    temp_file = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temp_file, 'wb') as cache_file: # A file object, so np.savez does not add .npz to the name
+            np.savez(cache_file, **arrays)
+            cache_file.flush()
+            os.fsync(cache_file.fileno())
+        os.replace(temp_file, filename)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+# Load the DataFrames saved by save_frames, along with their meta information
+def load_frames(filename):
+    with np.load(filename, allow_pickle=False) as stored:
+        stored = dict(stored)
+    info = json.loads(str(stored['meta']))
+
+    frames = {}
+    for name, layout in info['frames'].items():
+        if layout['empty']:
+            frames[name] = pd.DataFrame()
+            continue
+
+        def part(kind, i):
+            key = '{}_{}{}'.format(name, kind, i)
+            return array_column(stored[key], stored.get(key + '_null'))
+
+        columns = {}
+        for k, block in enumerate(layout['blocks']):
+            columns.update({i:stored['{}_b{}'.format(name, k)][:, j] for j, i in enumerate(block)})
+        columns.update({i:part('c', i) for i in range(len(layout['columns'])) if i not in columns})
+
+        if layout.get('range_index'):
+            index = pd.RangeIndex(layout['rows'], name=layout['index_names'][0])
+        else:
+            levels = [part('i', i) for i in range(len(layout['index_names']))]
+            index = pd.MultiIndex.from_arrays(levels, names=layout['index_names']) if len(levels) > 1 else pd.Index(levels[0], name=layout['index_names'][0])
+        df = pd.DataFrame({i:columns[i] for i in range(len(layout['columns']))}, index=index)
+        df.columns = pd.Index(layout['columns'], name=layout['columns_name'])
+        frames[name] = df
+    return frames, info['meta']
+
+
+# Load the frames of a cache file if it exists and was saved with the given version from a source file with the given hash.
+# A file that cannot be read, such as a damaged or partly copied one, is out of date as well.
+def load_fresh_frames(filename, source_hash, version):
+    if not os.path.exists(filename):
+        return None
+    try:
+        frames, meta = load_frames(filename)
+    except (zipfile.BadZipFile, OSError, EOFError, KeyError, ValueError):
+        return None
+    if meta.get('source_hash') != source_hash or meta.get('version') != version:
+        return None
+    return frames, meta
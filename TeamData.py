@@ -1,33 +1,181 @@
 import numpy as np
 import pandas as pd
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from PitchEngine import translate_pitches, pitch_count_series, count_outcome_frame, count_outcome_counts, terminal_from_current
+from AtBatTable import AtBatTable
+from TeamCache import file_hash, save_frames, load_fresh_frames
+from Instrumentation import stage, recorded_call, profile_call
+import Instrumentation
+
+
+# Attribute computed by the decorated function on first access, and cached on the instance.
+# depends_on names the attributes it is computed from.  When one of those is set (or dropped in turn),
+# the cached value is dropped and computed again on its next access.  Setting the attribute stores the value directly.
+# Deleting the attribute drops its value, along with everything computed from it, so it is back to its default.
+class cached_attribute:
+    def __init__(self, *depends_on):
+        self.depends_on = depends_on
+    
+    def __call__(self, func):
+        self.func = func
+        return self
+    
+    def __set_name__(self, owner, name):
+        self.name = name
+        for dependency in self.depends_on:
+            owner.dependents.setdefault(dependency, []).append(name)
+    
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            obj.__dict__[self.name] = self.func(obj)
+        return obj.__dict__[self.name]
+    
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        obj.invalidate(self.name)
+    
+    def __delete__(self, obj):
+        obj.__dict__.pop(self.name, None)
+        obj.invalidate(self.name)
+
+
+# Apply a function of a Series of strings to the distinct values of a column, and look up its result for every row.
+# A team-season has a few hundred distinct events and pitch strings, so this is much faster than string operations on every at-bat.
+# A missing value has the code -1, which takes the result of the missing value added after the distinct values.
+def map_distinct(values, func):
+    codes, distinct = pd.factorize(values)
+    result = func(pd.Series(np.append(np.asarray(distinct, dtype=object), np.nan)))
+    return result.take(codes).set_axis(values.index)
 
 
 class Team:
+    # Translations of the pitch labels into balls and strikes for the count, and into the labels recorded at each count
+    count_map = ('CFIKLMOPQRTV', 'SSBSSSSBSSSB', 'NU')
+    outcome_map = ('IKMOPQRTV', 'BSSSBSFSB', 'NU')
+    
+    # Columns of the per-team PbP files kept for each at-bat, and their names
+    event_columns = {'0':'Inning', '2':'Batter', '3':'Count', '4':'Pitches', '5':'Event'}
+    cache_suffix = '' # Added to the name of the team's cache file (see load_team)
+    cache_version = 2 # Changed whenever the contents of the cache files change, so files saved before are rebuilt
+    
+    # Attributes that are computed from each attribute, filled in by cached_attribute
+    dependents = {}
+    
+    # Only the raw events are stored when the team is created.
+    # Everything else is computed the first time it is used (see the cached attributes below),
+    # so a job that only needs the counts does not pay for the pitch-by-pitch tables.
     def __init__(self, team, year, event_data, homeaway):
         self.team = team
         self.year = year
         self.homeaway = homeaway # 0 for away, 1 for home
         self.counts_str = [i+j for j in ['0','1','2'] for i in ['0','1','2','3']] # Pitch count strings
         
-        self.event_data = self.clean_pitches(event_data)
-        self.outcomes = self.at_bat_outcomes()
-        
-        self.counts = self.outcomes['Count'].value_counts().sort_index()
-        self.count_outcomes = self.set_count_outcomes().groupby('Count')['Outcome'].value_counts().unstack().fillna(0)
-        self.plate_disc = pd.DataFrame()
+        self.source_events = event_data
+    
+    
+    # Drop every cached attribute computed from the named attribute, directly or indirectly
+    def invalidate(self, name):
+        for dependent in self.dependents.get(name, []):
+            self.__dict__.pop(dependent, None)
+            self.invalidate(dependent)
+    
+    def is_cached(self, name):
+        return name in self.__dict__
+    
+    
+    # Inputs: the PbP events the team was created from, and the (Z-Contact%, O-Contact%) of the last plate_discipline call
+    @cached_attribute()
+    def source_events(self):
+        return None
+    
+    @cached_attribute()
+    def discipline(self):
+        return None
+    
+    
+    # Events and outcomes are stored together in a compact, integer coded AtBatTable.
+    # The table is stored as a list of chunks, so merging games only appends to the list.
+    # The chunks are concatenated once, the next time the full table is used.
+    # The raw events are deleted once the table is built, as they are only needed to build it.
+    # That drops everything computed from them, which is nothing yet, as the table is stored after it is returned.
+    @cached_attribute('source_events')
+    def atbat_chunks(self):
+        event_data = self.clean_pitches(self.source_events)
+        del self.source_events
+        return [AtBatTable(event_data, self.at_bat_outcomes(event_data))]
+    
+    # Games in the at-bat table (see merge_games)
+    @cached_attribute('atbat_chunks')
+    def merged_games(self):
+        return set().union(*[chunk.index.get_level_values(0) for chunk in self.atbat_chunks])
+    
+    @property
+    def atbats(self):
+        if len(self.atbat_chunks) > 1:
+            self.__dict__['atbat_chunks'] = [AtBatTable.concat(self.atbat_chunks)] # Same at-bats, so nothing is invalidated
+        return self.atbat_chunks[0]
+    
+    @atbats.setter
+    def atbats(self, atbats):
+        self.atbat_chunks = [atbats]
+    
+    @cached_attribute('atbat_chunks')
+    def counts(self):
+        return self.atbats.value_counts('Count')
+    
+    @cached_attribute('atbat_chunks')
+    def count_outcomes(self):
+        return self.count_outcome_table()
+    
+    # Plate discipline tables of every (zcontact, ocontact) pair used since the count outcomes last changed
+    @cached_attribute('count_outcomes')
+    def plate_disc_cache(self):
+        return {}
+    
+    @cached_attribute('count_outcomes', 'discipline')
+    def plate_disc(self):
+        if self.discipline is None:
+            return pd.DataFrame()
+        if self.discipline not in self.plate_disc_cache:
+            self.plate_disc_cache[self.discipline] = self.discipline_table(*self.discipline)
+        return self.plate_disc_cache[self.discipline]
+    
+    # Values used by the strategy modification functions that only change with the team's data
+    @cached_attribute('atbat_chunks', 'count_outcomes', 'plate_disc')
+    @stage('strategy_context')
+    def strat_context(self):
+        return StrategyContext(self)
+    
+    # The event and outcome DataFrames are decoded from the table each time they are used
+    @property
+    def event_data(self):
+        return self.atbats.event_frame()
+    
+    @event_data.setter
+    def event_data(self, event_data):
+        self.atbats = AtBatTable(event_data, self.at_bat_outcomes(event_data))
+    
+    @property
+    def outcomes(self):
+        return self.atbats.outcome_frame()
         
     
     # Remove data from the string of pitches that do not involve the batter
+    @stage()
     def clean_pitches(self, event_data):
         if '1' in event_data.columns:
             # When adding games to an away team, make sure to only add the data from games that specific away team played
             if self.homeaway==0:
-                event_data = event_data[event_data.index.get_level_values(0).str[-3:]==self.team]
+                game_ids = pd.Series(event_data.index.get_level_values(0), index=event_data.index)
+                event_data = event_data[map_distinct(game_ids, lambda ids: ids.str[-3:])==self.team]
             
             # Select the home or away data for the team, and rename the columns appropriately
-            event_homeaway = event_data[event_data['1']==self.homeaway].drop(columns=['1'])
-            event_homeaway.columns = ['Inning','Batter','Count','Pitches','Event']
+            event_homeaway = event_data.loc[event_data['1']==self.batting_side(), list(self.event_columns)].rename(columns=self.event_columns)
             
             # Remove events where the same batter is at the place twice in a row in the same inning
             # This should only happen when events occur not involving the batter, such as stolen bases
@@ -37,12 +185,18 @@ class Team:
             # 'NP' = No Pitch, the batter was substituted
             # 'PO' = Pick off, a runner on base was tagged out and ended the inning
             # 'C' = Runner was caught stealing. Whether or not it ended the at-bat, it it is recorded in the game events
-            event_data = event_nodup[(event_nodup['Event']!='NP')&(~event_nodup['Event'].str.contains('PO'))&(event_nodup['Event'].str[0]!='C')]
+            batter_event = lambda events: (events!='NP')&(~events.str.contains('PO', na=False))&(events.str[0]!='C')
+            event_data = event_nodup[map_distinct(event_nodup['Event'], batter_event)]
         event_copy = event_data.copy()
-        event_copy['Pitches'] = event_data['Pitches'].str.translate(str.maketrans('','', '123+.*>'))
+        event_copy['Pitches'] = map_distinct(event_data['Pitches'], lambda pitches: pitches.str.translate(str.maketrans('','', '123+.*>')))
         return event_copy
     
     
+    # Side of the game (0 or 1) whose at-bats belong to the team
+    def batting_side(self):
+        return self.homeaway
+    
+    
     # Remove events where the same batter is at the place twice in a row in the same inning
     # This should only happen when events occur not involving the batter, such as stolen bases
     def team_next_batter(self, team_games_all):
@@ -58,15 +212,27 @@ class Team:
     
     # Create Dataframe that categorizes each at-bat outcome, and the type of contact made
     # One event that is not covered is a Balk ('B' in 'Outcome' column) that ends the game
-    def at_bat_outcomes(self):
-        ab_outcome = self.event_data['Event'].str.split('/',expand=True)
-        ab_outcome['Count'] = self.event_data['Count']
+    # By default this is done for all of the team's events, but it can be limited to a subset such as newly merged games
+    @stage()
+    def at_bat_outcomes(self, event_data=None):
+        if event_data is None:
+            event_data = self.event_data
+        
+        # The outcome only depends on the event, so it is found once for each distinct event (see map_distinct)
+        ab_outcome = map_distinct(event_data['Event'], self.event_outcomes)
+        ab_outcome.insert(0, 'Count', event_data['Count'])
+        return ab_outcome
+    
+    
+    # Outcome and type of contact of each event in a Series of events
+    def event_outcomes(self, events):
+        ab_outcome = events.str.split('/',expand=True).reindex(columns=[0,1]).astype(object)
         
         # The first split of 'Event' tells what the outcome of the at-bat is.
         # The first character is unique except for home-runs (HR) and hit-by-pitch (HP)
         # Assign the outcome as this first character, but when that character is 'H' take the 2nd character instead.
-        ab_outcome['Outcome'] = ab_outcome[0].str[0]
-        ab_outcome.loc[ab_outcome[ab_outcome[0].str[0]=='H'].index,'Outcome'] = ab_outcome[0].str[1]
+        first_char = ab_outcome[0].str[0]
+        ab_outcome['Outcome'] = first_char.where(first_char != 'H', ab_outcome[0].str[1])
         
         # Translate each specific outcome into (O)uts, Stri(K)eouts, (W)alks, (S)ingle, (D)ouble, (T)riple, Home (R)uns
         all_event_types = 'DEFRPIKSTW123456789'
@@ -77,8 +243,8 @@ class Team:
         # The 2nd split of 'Event' tells how 'hard' the ball was hit and where the ball was hit.
         # The first character is also unique except for sac-flies (SF) and sac-bunts (SH).
         # Assign the type of AB as this first character, but when that character is 'S' take the 2nd character instead.
-        ab_outcome['Type'] = ab_outcome[1].str[0]
-        ab_outcome.loc[ab_outcome[(ab_outcome[1].str[0]=='S')].index,'Type'] = ab_outcome[1].str[1]
+        first_char = ab_outcome[1].str[0]
+        ab_outcome['Type'] = first_char.where(first_char != 'S', ab_outcome[1].str[1])
         
         # Translate each specific type into (G)round ball, (F)ly ball, (P)op Fly, (T)hrowing Error,
         # Unspecified (D)ouble Play, or No Contact (NC)
@@ -86,35 +252,45 @@ class Team:
         all_launch_repl =  'GFFPFFFGTDG'
         ab_outcome['Type'] = ab_outcome['Type'].str.translate(str.maketrans(all_launch_types,all_launch_repl))
         ab_outcome['Type'].fillna('NC',inplace=True)
-
-        return ab_outcome[['Count','Outcome','Type']]
+        
+        return ab_outcome[['Outcome','Type']]
     
     
     # For away games, the at-bats will be spread throughout multiple raw files
     # The class must be able to handle merging data from multiple files.
     # New additions need to be cleaned, added to events, outcomes, and counts.
+    # Only the new at-bats are processed, and their contributions are added to counts and count_outcomes.
+    # Games that have already been merged are skipped, so the same file can be merged again during a mid-season refresh.
+    @stage()
     def merge_games(self, new_games):
-        new_games_cleaned = self.clean_pitches(new_games)
-        self.event_data = pd.concat([self.event_data, new_games_cleaned])
-        self.outcomes = self.at_bat_outcomes()
-        self.counts = self.outcomes['Count'].value_counts()
+        new_events = self.clean_pitches(new_games)
+        new_events = new_events[~new_events.index.get_level_values(0).isin(self.merged_games)]
+        if new_events.empty:
+            return
+        new_atbats = AtBatTable(new_events, self.at_bat_outcomes(new_events))
+        
+        # Counts and count outcomes that have not been computed yet will be computed from all of the chunks when used
+        updated = {'merged_games':self.merged_games | set(new_events.index.get_level_values(0))}
+        if self.is_cached('counts'):
+            updated['counts'] = self.counts.add(new_atbats.value_counts('Count'), fill_value=0).astype(int).sort_index()
+        if self.is_cached('count_outcomes'):
+            updated['count_outcomes'] = self.count_outcomes.add(self.count_outcome_table(new_atbats), fill_value=0).fillna(0)
+        
+        self.atbat_chunks.append(new_atbats)
+        self.invalidate('atbat_chunks')
+        for name, value in updated.items():
+            setattr(self, name, value)
         
     
     # Create the transformation matrix for modifying batting strategy
+    @stage(rows=lambda team_class: len(team_class.atbats))
     def transformation_matrix(self):
-        simple_pitch = self.parsing_pitches()
-        
-        # Only keep unique pitch counts during each at-bat
-        counts_reached = self.pitch_counts_during_ab(simple_pitch).groupby(level=[0,1]).unique() 
+        simple_codes, lengths = translate_pitches(self.atbats.pitch_codes, self.atbats.pitch_lengths, *self.count_map)
         
         # Create a DataFrame recording how frequently each terminal count is reached from a particular count
+        # Only unique pitch counts during each at-bat are recorded, all at-bats at once (see PitchEngine)
         num_counts = len(self.counts_str)
-        term_from_cur = pd.DataFrame(np.zeros((num_counts,num_counts)), index = self.counts_str, columns = self.counts_str)
-        
-        # For each at-bat, iterate through the pitch counts reached and record the terminal pitch count for the at-bat
-        for atbat in counts_reached.to_list():
-            for count in atbat:
-                term_from_cur.loc[count,atbat[-1]] += 1
+        term_from_cur = pd.DataFrame(terminal_from_current(simple_codes, lengths).astype(float), index = self.counts_str, columns = self.counts_str)
                 
         # For the Transformation matrix, we need to find the total number of at-bats the end after a given count
         for i in self.counts_str:
@@ -127,50 +303,46 @@ class Team:
         
     
     # Convert string of pitches during at-bat into an ordered list of all pitch counts reached during the at-bat
+    # Start the at-bat at 0-0 count, and record the count before each pitch of the at-bat
+    # All pitch strings are encoded into a single array, and balls and strikes are counted with cumulative sums (see PitchEngine)
     def pitch_counts_during_ab(self, pitch_strings):
-        # Start the at-bat at 0-0 count, which we will label as a zero (anything other than B or S)
-        # Look at each pitch during the at-bat, other than the final pitch
-        stacked_pitch = ('0'+pitch_strings.str[0:-1]).str.split('',expand=True).stack()
-        
-        # A batter will occasionally foul off enough pitches that more than 9 'strikes' occur in the at-bat.
-        # Cumulative sum over Balls = 100 and Strikes = 1 will correctly identify an expanded version of the pitch count
-        pc_during_ab = stacked_pitch.drop(stacked_pitch[stacked_pitch==''].index).str.translate(str.maketrans({'B':'100','S':'1'})).astype(int).groupby(level=[0,1]).cumsum()
-        
-        # If a pitch count goes above 4 balls without the at-bat ending (due to umpire error), the at-bat continues with 3 balls
-        counts_cap_ball = pc_during_ab*(pc_during_ab//100 < 4) + (300+pc_during_ab%100)*(pc_during_ab//100 > 3)
-        
-        # If more than 3 'strikes' occur during an at-bat, do not iterate the pitch count higher than x-2
-        counts_cap_strike = counts_cap_ball*(counts_cap_ball%100 < 3) + (2 + 100*(counts_cap_ball//100))*(counts_cap_ball%100 >2)
-        
-        # Convert the counts in the form B-0-S into a string 'BS'
-        return (counts_cap_strike//100).astype(str) + (counts_cap_strike%100).astype(str)
+        return pitch_count_series(pitch_strings)
         
     
     # Reduce each type of pitch into strikes and balls
     # N (No pitch) and U (no data) are converted into None values
     def parsing_pitches(self, all_pitch_types='CFIKLMOPQRTV', all_pitch_repl='SSBSSSSBSSSB', pitch_none='NU'):
-        return self.event_data['Pitches'].str.translate(str.maketrans(all_pitch_types,all_pitch_repl,pitch_none))
+        return self.atbats.pitch_strings().str.translate(str.maketrans(all_pitch_types,all_pitch_repl,pitch_none))
     
     
     # For pitch within an at-bat, record what happens.
     # Need to keep record of balls, hit-by-pitch, called strikes, swinging strikes, fouls, foul bunts, and balls-in-play
-    def set_count_outcomes(self):
-        all_pitch_types = 'IKMOPQRTV'
-        all_pitch_repl =  'BSSSBSFSB'
-        team_pitches = self.parsing_pitches(all_pitch_types, all_pitch_repl)
-        stacked_pitch = (team_pitches).str.split('', expand=True).stack()
-        stacked_pitch = stacked_pitch.drop(stacked_pitch[stacked_pitch==''].index)
+    @stage()
+    def set_count_outcomes(self, event_data=None):
+        pitch_strings = self.atbats.pitch_strings() if event_data is None else event_data['Pitches']
         
         # For each pitch during each at-bat, add the current pitch count
-        # Translating each pitch into an updated count is dealt with inside the Team class file
-        pitches_and_counts = pd.concat([self.pitch_counts_during_ab(self.parsing_pitches()),stacked_pitch],axis=1)
-        pitches_and_counts.columns = ['Count','Outcome']
-        
-        return pitches_and_counts
+        # Both the pitch labels and the counts are translated from a single encoding of the team's pitches
+        return count_outcome_frame(pitch_strings, self.count_map, self.outcome_map)
+    
+    
+    # Number of each pitch label thrown at each count, counted directly from the encoded pitches of an AtBatTable
+    # By default this is done for all of the team's at-bats
+    @stage(rows=lambda team_class, atbats=None: len(team_class.atbats if atbats is None else atbats))
+    def count_outcome_table(self, atbats=None):
+        if atbats is None:
+            atbats = self.atbats
+        return count_outcome_counts(atbats.pitch_codes, atbats.pitch_lengths, self.count_map, self.outcome_map)
     
     
     # Determine the team's count specific plate discipline stats: Zone%, O-Contact%, Z-Contact%
+    # The table is computed when plate_disc is next used, and kept for each (zcontact, ocontact) pair
     def plate_discipline(self, zcontact, ocontact):
+        self.discipline = (zcontact, ocontact)
+    
+    
+    @stage('plate_discipline', rows=lambda team_class, zcontact, ocontact: len(team_class.count_outcomes))
+    def discipline_table(self, zcontact, ocontact):
         # Group pitch labels, dropping special labels now that each count is correctly identified
         simple_pitch = pd.DataFrame()
         simple_pitch['B'] = self.count_outcomes['B']+self.count_outcomes['H'] # Pitches outside the strike zone w/o swing
@@ -201,20 +373,234 @@ class Team:
         simple_pitch_zosep['O-Contact%'] = ocontact
         simple_pitch_zosep['Z-Contact%'] = zcontact
         
-        self.plate_disc = simple_pitch_zosep
+        return simple_pitch_zosep
+    
+    
+    # Save the team's derived data to a columnar cache file, tagged with the hash of the PbP file it was built from.
+    # The at-bats are saved as the integer codes of the AtBatTable, so loading the team does not encode them again.
+    def save_cache(self, cache_file, source_hash):
+        atbat_frames, atbat_layout = self.atbats.to_frames()
+        frames = {'atbats '+name:frame for name, frame in atbat_frames.items()}
+        frames.update({'count_outcomes':self.count_outcomes, 'plate_disc':self.plate_disc})
+        meta = {'team':self.team, 'year':self.year, 'homeaway':self.homeaway, 'source_hash':source_hash, 'version':self.cache_version,
+                'discipline':self.discipline, 'atbats':atbat_layout}
+        save_frames(cache_file, frames, meta)
+    
+    
+    # Rebuild a team from a cache file without re-parsing its PbP file.
+    # Returns None if the cache file is missing or unreadable, was built from a different version of the source file,
+    # or was saved with a different cache_version.
+    @classmethod
+    def from_cache(cls, cache_file, source_hash):
+        cached = load_fresh_frames(cache_file, source_hash, cls.cache_version)
+        if cached is None:
+            return None
+        frames, meta = cached
+        
+        team_class = cls.__new__(cls)
+        team_class.team = meta['team']
+        team_class.year = meta['year']
+        team_class.homeaway = meta['homeaway']
+        team_class.counts_str = [i+j for j in ['0','1','2'] for i in ['0','1','2','3']]
+        team_class.atbats = AtBatTable.from_frames({name[7:]:frame for name, frame in frames.items() if name[:7] == 'atbats '}, meta['atbats'])
+        team_class.count_outcomes = frames['count_outcomes']
+        if meta.get('discipline') is not None:
+            team_class.discipline = tuple(meta['discipline'])
+            team_class.plate_disc_cache[team_class.discipline] = frames['plate_disc']
+        return team_class
+    
+    
+    # The context is built once, and rebuilt after merge_games or plate_discipline changes the data
+    def strategy_context(self):
+        return self.strat_context
+
+
+# The pitching side of a team: every table of Team is of the opposing batters in the team's games.
+# homeaway is still the side the team played (1 for its home games), so the batting side is the other one.
+# Built from per-team PbP files parsed with pitchers (see split_home_away), where the pitcher of each at-bat is kept as well.
+class PitchingStaff(Team):
+    event_columns = dict(Team.event_columns, **{'6':'Pitcher'})
+    cache_suffix = 'Pitching'
+    dependents = {name:list(attributes) for name, attributes in Team.dependents.items()}
+    
+    def batting_side(self):
+        return 1 - self.homeaway
+    
+    # Number of at-bats ending at each count (columns in counts_str order) against each of the team's pitchers
+    @cached_attribute('atbat_chunks')
+    def pitcher_counts(self):
+        pitcher_counts = self.atbats.crosstab('Pitcher', 'Count')
+        pitcher_counts.columns = pitcher_counts.columns.astype(str).str.zfill(2) # Counts read back from the PbP files are integers
+        return pitcher_counts.reindex(columns=self.counts_str, fill_value=0).astype(int)
+
+
+# Copy of a DataFrame of floats whose values are one read-only numpy array, so they cannot be changed in place
+def read_only_frame(df):
+    values = df.to_numpy(dtype=float, copy=True)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+
+# DataFrame attribute of a StrategyContext.  Every access gives a new DataFrame sharing the context's read-only values,
+# so adding or replacing columns of it does not change the context either.
+def context_frame(name):
+    return property(lambda self: self.frames[name].copy(deep=False))
+
+
+# Immutable set of per-team values used to modify a team's strategy (see StratMod_PitchSpecific)
+# Holds the team's count outcomes and plate discipline, the F/X split of contact at each count,
+# the distribution of in-play outcomes at each count, and the total number of at-bats.
+# The same values are also kept as read-only numpy arrays for the batched strategy functions.
+class StrategyContext:
+    count_outcomes = context_frame('count_outcomes')
+    plate_disc = context_frame('plate_disc')
+    contact_split = context_frame('contact_split')
+    inplay_frac = context_frame('inplay_frac')
+    
+    def __init__(self, team_class):
+        if team_class.plate_disc.empty:
+            raise ValueError('Team.plate_discipline must be called before building a strategy context')
+        count_outcomes = read_only_frame(team_class.count_outcomes)
+        plate_disc = read_only_frame(team_class.plate_disc)
+        
+        # Ratio of contact in foul ('F') and fair ('X') territory at each count
+        contact_split = count_outcomes[['F','X']].div(count_outcomes[['F','X']].sum(axis=1),axis=0)
+        
+        # Fraction of balls in play at each count resulting in an Out, Single, Double, Triple, or HR
+        inplay_outcomes = team_class.atbats.crosstab('Count','Outcome')[['O','S','D','T','R']]
+        inplay_outcomes.set_index(count_outcomes.index,inplace=True)
+        inplay_outcomes.columns = ['Out','Single','Double','Triple','HR']
+        inplay_frac = inplay_outcomes.div(inplay_outcomes.sum(axis=1),axis=0)
+        
+        arrays = {col:plate_disc[col].to_numpy(dtype=float) for col in ['B','C','S','X','Total','SO','SZ','XO','XZ',
+                                                                        'Zone%','O-Swing%','Z-Swing%','O-Contact%','Z-Contact%']}
+        arrays.update({'co'+col:count_outcomes[col].to_numpy(dtype=float) for col in ['H','L','F','X']})
+        arrays['Inplay'] = inplay_frac.to_numpy(dtype=float)
+        arrays['Counts'] = count_outcomes.index.astype(int).to_numpy()
+        for array in arrays.values():
+            array.flags.writeable = False
+        
+        frames = {'count_outcomes':count_outcomes, 'plate_disc':plate_disc,
+                  'contact_split':read_only_frame(contact_split), 'inplay_frac':read_only_frame(inplay_frac)}
+        self.__dict__.update(team=team_class.team, year=team_class.year, homeaway=team_class.homeaway, frames=frames,
+                             total_ab=team_class.atbats.value_counts('Outcome').sum(), arrays=arrays)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('StrategyContext is read-only, build a new one with Team.strategy_context()')
+    
+    
+# Strategy functions accept either a Team or its StrategyContext
+def strategy_context(team_class):
+    if isinstance(team_class, StrategyContext):
+        return team_class
+    return team_class.strategy_context()
+
+
     
+# Convert the DataFrame from BatterPbP into the column names and types of the per-team PbP files.
+# Used to merge newly parsed games into a Team without writing them to a file first.
+def pbp_frame(games_df):
+    pbp_games = games_df.rename(columns=str)
+    for col in ['0','1','3']:
+        pbp_games[col] = pd.to_numeric(pbp_games[col])
+    return pbp_games
+
 
+# Build the Team for a single per-team PbP file, and time how long it takes
+# If cache_path is given, the team is loaded from its cache file there unless the PbP file has changed since it was cached,
+# in which case the team is rebuilt and its cache file replaced.
+# The attributes listed are computed before the team is returned (the rest are computed when first used).
+# With pitching=True, the team's PitchingStaff is built from the same file (read once), and (Team, PitchingStaff) is returned.
+@stage(label=lambda path, file, *args, **kwargs: file)
+def load_team(path, file, homeaway, cache_path=None, attributes=(), pitching=False):
+    start = time.perf_counter()
+    team = file[4:7]
+    year = file[:4]
     
-def setup_teams(path,homeaway):
+    event_data = None
+    source_hash = file_hash(path+file) if cache_path is not None else None
+    team_classes = []
+    for team_type in [Team, PitchingStaff][:1+pitching]:
+        team_class = None
+        if cache_path is not None:
+            cache_file = cache_path + year + team + ['Away','Home'][homeaway] + team_type.cache_suffix + '.npz'
+            team_class = team_type.from_cache(cache_file, source_hash)
+        if team_class is None:
+            if event_data is None:
+                event_data = pd.read_csv(path+file,index_col=[0,1])
+            team_class = team_type(team, year, event_data, homeaway)
+            if cache_path is not None:
+                team_class.save_cache(cache_file, source_hash)
+        
+        for name in attributes:
+            getattr(team_class, name)
+        team_classes.append(team_class)
+    return year+team, (tuple(team_classes) if pitching else team_classes[0]), time.perf_counter()-start
+
+
+# Build every team in a directory of PbP files.
+# With workers > 1 (or None for one per CPU) the teams are built in a process pool, handing out chunksize files at a time.
+# Results are returned in the order of the files, so the dictionary is the same for any number of workers.
+# With report=True, progress is printed as teams finish, followed by the slowest team files.
+# With a cache_path, teams are loaded from (and saved to) columnar cache files in that directory (see load_team).
+# attributes are the Team attributes computed while loading.  By default nothing is computed until it is used,
+# except in a process pool, where the at-bat tables and counts are built by the workers.
+# With pitching=True, each value is the (Team, PitchingStaff) of the file (see load_team).
+def setup_teams(path,homeaway,workers=1,chunksize=1,report=False,slowest=5,cache_path=None,attributes=None,pitching=False):
     pbp_files = os.listdir(path)
+    start = time.perf_counter()
+    if attributes is None:
+        attributes = () if workers == 1 else ('counts', 'count_outcomes')
+    
+    if workers == 1:
+        loaded = (load_team(path, file, homeaway, cache_path, attributes, pitching) for file in pbp_files)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(workers)
+        if Instrumentation.recorder is None:
+            loaded = pool.map(load_team, repeat(path), pbp_files, repeat(homeaway), repeat(cache_path), repeat(attributes), repeat(pitching),
+                              chunksize=chunksize)
+        else:
+            # Stages run in the workers are recorded there, and added to this process's recorder as each team arrives
+            recorded = pool.map(recorded_call, repeat(Instrumentation.recorder.memory), repeat(load_team), repeat(path), pbp_files,
+                                repeat(homeaway), repeat(cache_path), repeat(attributes), repeat(pitching), chunksize=chunksize)
+            loaded = (Instrumentation.recorder.merge(stats) or result for result, stats in recorded)
+    
     team_dict = {}
-    for file in pbp_files:
-        team = file[4:7]
-        year = file[:4]
-        team_data = pd.read_csv(path+file,index_col=[0,1])
-        team_dict[year+team] = Team(team, year, team_data, homeaway)
+    load_times = {}
+    try:
+        for i, (file, (key, team_class, seconds)) in enumerate(zip(pbp_files, loaded)):
+            team_dict[key] = team_class
+            load_times[file] = seconds
+            if report:
+                print('Loaded {} ({}/{}) in {:.2f}s'.format(file, i+1, len(pbp_files), seconds))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    
+    if report:
+        print('Loaded {} teams in {:.2f}s'.format(len(team_dict), time.perf_counter()-start))
+        print('Slowest team files:')
+        print(pd.Series(load_times, name='Seconds').sort_values(ascending=False).head(slowest).round(3).to_string())
     return team_dict
 
+
+
+# Profile building one team from its PbP file through to its strategy context, with cProfile and tracemalloc (see profile_call).
+# strategy is optionally run on the strategy context as well, such as lambda context: strategy_mod(context, swing_changes).
+# Returns the team and the profile, allocations, and stage report of the run.
+def profile_team(path, file, homeaway, zcontact=0.87, ocontact=0.66, strategy=None, top=25):
+    def build_team():
+        _, team_class, _ = load_team(path, file, homeaway)
+        team_class.transformation_matrix()
+        team_class.plate_discipline(zcontact, ocontact)
+        if strategy is not None:
+            strategy(team_class.strategy_context())
+        else:
+            team_class.strategy_context()
+        return team_class
+    return profile_call(build_team, top=top)
+
             
 if __name__ == "__main__":
     path_home = './PbP_HomeCSV/'
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from RawPbPtoPitchCount import COUNT_LABELS
+
+
+# Win model of the StrategyAdjustment notebook, fit on the league pitch count tables:
+# the counts of every team-season are standardized and rotated into principal components (as StandPCA),
+# and RA x W% is fit on the first num_pcs components and RA (as LinReg), leaving out team-seasons whose outlier_stat
+# is more than outlier_limit standard deviations from the mean.
+# The standardization, PCA, and design matrix are computed once, so each refit is only a weighted least squares solve.
+# data is indexed by (Year, Team) with a column for each count in COUNT_LABELS, 'W%', and 'RA', such as home_counts_ra.
+class WinModelData:
+    def __init__(self, data, num_pcs=5, outlier_stat='W%', outlier_limit=2):
+        counts = data[COUNT_LABELS].to_numpy(dtype=float)
+        self.index = data.index
+        self.num_pcs = num_pcs
+
+        # StandardScaler uses the population standard deviation, and leaves constant columns unscaled
+        self.mean = counts.mean(axis=0)
+        self.scale = counts.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        standardized = (counts - self.mean)/self.scale
+        self.pc_mean = standardized.mean(axis=0)
+        self.components = np.linalg.svd(standardized - self.pc_mean, full_matrices=False)[2]
+
+        self.ra = data['RA'].to_numpy(dtype=float)
+        self.design = self.design_matrix(counts, self.ra)
+        self.target = self.ra*data['W%'].to_numpy(dtype=float)
+        outlier = data[outlier_stat]
+        self.fit_rows = (np.abs((outlier - outlier.mean())/outlier.std()) <= outlier_limit).to_numpy()
+
+
+    # Rows of [1, pc1, ..., pcN, RA] for pitch count tables (..., 12), the same rows for any leading dimensions
+    def design_matrix(self, counts, ra):
+        pcs = ((counts - self.mean)/self.scale - self.pc_mean).dot(self.components[:self.num_pcs].T)
+        ra = np.broadcast_to(ra, pcs.shape[:-1])
+        return np.concatenate([np.ones(pcs.shape[:-1] + (1,)), pcs, ra[..., np.newaxis]], axis=-1)
+
+
+# Weight of every row in each of num_fits refits.
+# 'bootstrap' draws each fit's rows with replacement, 'split' leaves out a random test_size of the rows (as train_test_split),
+# and 'cv' leaves out one of folds random folds, reshuffling the folds every folds fits.
+def resample_weights(num_rows, num_fits, rng, method='bootstrap', test_size=0.2, folds=5):
+    if method == 'bootstrap':
+        return rng.multinomial(num_rows, np.full(num_rows, 1/num_rows), size=num_fits).astype(float)
+
+    weights = np.ones((num_fits, num_rows))
+    if method == 'split':
+        num_test = int(np.ceil(test_size*num_rows))
+        for weight in weights:
+            weight[rng.permutation(num_rows)[:num_test]] = 0
+    elif method == 'cv':
+        for fit in range(num_fits):
+            if fit % folds == 0:
+                fold = np.empty(num_rows, dtype=int)
+                fold[rng.permutation(num_rows)] = np.arange(num_rows) % folds
+            weights[fit, fold == fit % folds] = 0
+    else:
+        raise ValueError('Unknown resampling method ' + method)
+    return weights
+
+
+# Least squares coefficients of every set of row weights (num_fits x rows), from stacked normal equations.
+# The products of each row with itself are computed once, so the normal equations of every fit come from two matrix products.
+def batch_least_squares(design, target, weights):
+    num_cols = design.shape[1]
+    gram = weights.dot((design[:, :, np.newaxis]*design[:, np.newaxis, :]).reshape(len(design), -1)).reshape(-1, num_cols, num_cols)
+    moments = weights.dot(design*target[:, np.newaxis])
+    try:
+        return np.linalg.solve(gram, moments[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('fij,fj->fi', np.linalg.pinv(gram), moments) # Some resample left the fit underdetermined
+
+
+# Refit a chunk of resamples with its own random stream
+def resample_chunk(design, target, num_fits, seed_seq, method='bootstrap', test_size=0.2, folds=5):
+    weights = resample_weights(len(design), num_fits, np.random.default_rng(seed_seq), method, test_size, folds)
+    return batch_least_squares(design, target, weights)
+
+
+def resample_chunk_args(args):
+    return resample_chunk(*args)
+
+
+# Coefficients of num_fits refits of the win model (num_fits x [intercept, pcs, RA]) on resamples of its fit rows.
+# The fits are split into chunks with independent random streams spawned from seed, optionally refit across worker processes.
+# The streams are fixed by seed and chunks, so the coefficients are reproducible for any number of workers.
+def resample_coefficients(model_data, num_fits=2000, method='bootstrap', seed=None, chunks=8, workers=1, test_size=0.2, folds=5):
+    design, target = model_data.design[model_data.fit_rows], model_data.target[model_data.fit_rows]
+    chunk_fits = [len(part) for part in np.array_split(np.arange(num_fits), min(chunks, num_fits))]
+    if method == 'cv':
+        chunk_fits = [folds*int(np.ceil(fits/folds)) for fits in chunk_fits] # Whole sets of folds in each chunk
+    streams = np.random.SeedSequence(seed).spawn(len(chunk_fits))
+    args = [(design, target, fits, stream, method, test_size, folds) for fits, stream in zip(chunk_fits, streams)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(resample_chunk_args, args))
+    else:
+        results = [resample_chunk(*chunk_args) for chunk_args in args]
+    return np.vstack(results)[:num_fits]
+
+
+# Coefficients of the win model fit once on all of its fit rows
+def point_coefficients(model_data):
+    fit_rows = model_data.fit_rows.astype(float)
+    return batch_least_squares(model_data.design, model_data.target, fit_rows[np.newaxis])[0]
+
+
+# Transformation matrix of the StrategyAdjustment notebook for pitch count tables (N x 12, COUNT_LABELS order),
+# giving the change in every count (rows) from ending fewer at-bats at each count (columns).
+# The at-bats no longer ending at a count are spread over the counts with as many or more balls and strikes,
+# in proportion to their number of at-bats.  The 3-2 count cannot be changed.
+def count_transformations(counts):
+    counts = np.asarray(counts, dtype=float)
+    balls, strikes = np.arange(12) % 4, np.arange(12)//4
+    reachable = (balls[:, np.newaxis] <= balls) & (strikes[:, np.newaxis] <= strikes) # [from, to]
+    np.fill_diagonal(reachable, False)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = counts.dot(reachable.T)
+        transformation = np.where(reachable.T, counts[:, :, np.newaxis]/denominator[:, np.newaxis, :], 0)
+    transformation[:, np.arange(12), np.arange(12)] = -1
+    transformation[:, 11, 11] = 0
+    return transformation
+
+
+# Pitch count tables of each team's modified strategies (N x strategies x counts), with x of the at-bats ending at each count
+# instead continuing to later counts.  The last strategy, at the 3-2 count, is the team's unmodified strategy.
+def strategy_counts(counts, x=0.01):
+    counts = np.asarray(counts, dtype=float)
+    return counts[:, np.newaxis, :] + np.swapaxes(count_transformations(counts), 1, 2)*counts[:, :, np.newaxis]*x
+
+
+# Best strategy change of every team-season in the model data (as optimize_strat_adjust), with confidence intervals from refits.
+# The strategy is chosen with the model fit on all of the data: the count and direction (patient or aggressive)
+# giving the largest change in predicted wins over games.  Its improvement is then predicted by every refit,
+# giving the interval holding the central confidence fraction of improvements, and the fraction of refits agreeing it is the best change.
+# counts is the data the model was built from, or any table with the same columns.
+def strategy_intervals(model_data, counts, x=0.01, num_fits=2000, confidence=0.95, games=81, coefficients=None, **kwargs):
+    if coefficients is None:
+        coefficients = resample_coefficients(model_data, num_fits, **kwargs)
+    ra = counts['RA'].to_numpy(dtype=float)
+    design = model_data.design_matrix(strategy_counts(counts[COUNT_LABELS].to_numpy(dtype=float), x), ra[:, np.newaxis])
+
+    # Change in wins of every strategy from the unmodified strategy, with no change for counts a team never reaches
+    change = np.nan_to_num((design - design[:, -1:])/ra[:, np.newaxis, np.newaxis]*games)
+    point_change = change.dot(point_coefficients(model_data))
+    rows = np.arange(len(change))
+    best = np.argmax(np.abs(point_change), axis=1)
+    direction = np.sign(point_change[rows, best]) # Positive when more patient is better
+
+    refit_change = change.dot(coefficients.T) # (N x strategies x refits)
+    improvements = refit_change[rows, best]*direction[:, np.newaxis]
+    refit_best = np.argmax(np.abs(refit_change), axis=1)
+    refit_direction = np.sign(np.take_along_axis(refit_change, refit_best[:, np.newaxis], axis=1)[:, 0])
+    tail = (1 - confidence)/2*100
+
+    return pd.DataFrame({'Count':np.array(COUNT_LABELS)[best], 'Strategy':np.where(direction > 0, 'Patient', 'Aggressive'),
+                         'Original Wins':design[:, -1].dot(point_coefficients(model_data))/ra*games,
+                         'Improvement':np.abs(point_change[rows, best]),
+                         'Lower':np.percentile(improvements, tail, axis=1), 'Upper':np.percentile(improvements, 100-tail, axis=1),
+                         'Std. Error':improvements.std(axis=1),
+                         'Agreement':((refit_best == best[:, np.newaxis]) & (refit_direction == direction[:, np.newaxis])).mean(axis=1)},
+                        index=counts.index)